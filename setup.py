@@ -10,6 +10,35 @@ import time
 import signal
 import re
 import pwd
+import shlex
+import threading
+import json
+import hashlib
+import base64
+import inspect
+import html
+import tempfile
+import contextlib
+import glob
+import queue
+import types
+import socket
+import urllib.request
+import asyncio
+import codecs
+import random
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Modalità senza interfaccia grafica: --headless --answers <file.json>
+HEADLESS = "--headless" in sys.argv
+# Piano dei comandi con stima dei tempi, senza eseguire nulla: --dry-run [--answers <file.json>]
+DRY_RUN = "--dry-run" in sys.argv
+
+# Cartella in cui il setup conserva il proprio stato tra un'esecuzione e l'altra
+STATE_DIR = os.environ.get("SETUP_STATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".setup_state")
+# Timbro dell'ultimo bootstrap riuscito (interprete, venv e dipendenze)
+BOOTSTRAP_STAMP_FILE = os.path.join(STATE_DIR, "bootstrap.json")
 
 REQUIRED_PIP_PACKAGES = [
 	("PyQt6", "PyQt6"),
@@ -47,7 +76,291 @@ REQUIRED_DNF_PACKAGES = [
 	"xcb-util-renderutil"
 ]
 
-def check_distro():
+# Comando di installazione, in un'unica transazione, per ogni gestore pacchetti (senza sudo)
+PACKAGE_INSTALL_COMMANDS = {
+	"apt": ["apt-get", "install", "-y"],
+	"dnf": ["dnf", "install", "-y"],
+	"pacman": ["pacman", "-S", "--noconfirm", "--needed"],
+	"zypper": ["zypper", "--non-interactive", "install"],
+	"pkg": ["pkg", "install", "-y"]
+}
+
+# Comando che elenca in un solo processo tutti i pacchetti installati ("nome versione" per riga)
+PACKAGE_SNAPSHOT_COMMANDS = {
+	"apt": ["dpkg-query", "-W", "-f=${Package} ${Version} ${db:Status-Abbrev}\n"],
+	"dnf": ["rpm", "-qa", "--qf", "%{NAME} %{VERSION}-%{RELEASE}\n"],
+	"zypper": ["rpm", "-qa", "--qf", "%{NAME} %{VERSION}-%{RELEASE}\n"],
+	"pacman": ["pacman", "-Q"],
+	"pkg": ["pkg", "query", "%n %v"]
+}
+
+# Comandi che modificano il database dei pacchetti e quindi invalidano lo snapshot
+PACKAGE_TRANSACTION_RE = re.compile(r"(^|[\s;&|(])(apt|apt-get|dnf|pacman|zypper|pkg|pkg-static|rpm|dpkg)\s")
+
+# Messaggio e tipo di log per l'esito di ciascun pacchetto di un batch
+PACKAGE_STATUS_MESSAGES = {
+	"present": ("✅ {} già installato.", "info"),
+	"installed": ("📦 {} installato.", "success"),
+	"failed": ("❌ Impossibile installare {}.", "error")
+}
+
+def detect_package_manager():
+	for pm in ["apt", "dnf", "pacman", "zypper", "pkg"]:
+		if shutil.which(pm):
+			return pm
+	return ""
+
+class InstalledPackageIndex:
+	"""
+	In-memory index (name -> version) of the installed packages.
+	The snapshot is taken with a single query on first use and reloaded
+	only after it has been invalidated by an install transaction.
+	"""
+	def __init__(self, pm):
+		self.pm = pm
+		self._packages = None
+		self._lock = threading.Lock()
+
+	def _snapshot(self):
+		packages = {}
+		cmd = PACKAGE_SNAPSHOT_COMMANDS.get(self.pm)
+		if not cmd:
+			return packages
+		try:
+			result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+		except FileNotFoundError:
+			return packages
+
+		for line in result.stdout.splitlines():
+			fields = line.split()
+			if len(fields) < 2:
+				continue
+			# dpkg elenca anche i pacchetti rimossi ma non purgati: conta solo lo stato "ii"
+			if self.pm == "apt" and (len(fields) < 3 or not fields[2].startswith("i")):
+				continue
+			packages[fields[0]] = fields[1]
+		return packages
+
+	def _index(self):
+		with self._lock:
+			if self._packages is None:
+				self._packages = self._snapshot()
+			return self._packages
+
+	def invalidate(self):
+		with self._lock:
+			self._packages = None
+
+	def is_installed(self, name):
+		return name in self._index()
+
+	def version(self, name):
+		return self._index().get(name)
+
+	def installed(self, pkg_names):
+		"""
+		Returns the subset of pkg_names that is installed.
+		"""
+		index = self._index()
+		return {name for name in pkg_names if name in index}
+
+_package_indexes = {}
+
+def get_package_index(pm):
+	"""
+	Returns the shared InstalledPackageIndex of the package manager.
+	"""
+	if pm not in _package_indexes:
+		_package_indexes[pm] = InstalledPackageIndex(pm)
+	return _package_indexes[pm]
+
+class PackageBatch:
+	"""
+	Collects the packages needed by a phase and installs the missing ones
+	with a single transaction of the package manager.
+	"""
+	def __init__(self, pm, packages=(), index=None):
+		self.pm = pm
+		self.index = index or get_package_index(pm)
+		self.packages = []
+		self.add(*packages)
+
+	def add(self, *pkg_names):
+		for name in pkg_names:
+			if name not in self.packages:
+				self.packages.append(name)
+
+	def describe(self, name):
+		"""
+		Returns the package name followed by its installed version, if known.
+		"""
+		version = self.index.version(name)
+		return f"{name} ({version})" if version else name
+
+	def install_command(self, pkg_names):
+		base = PACKAGE_INSTALL_COMMANDS.get(self.pm)
+		if base is None:
+			raise ValueError(f"Gestore pacchetti non supportato: {self.pm}")
+		return base + list(pkg_names)
+
+	def install(self, run):
+		"""
+		Installs the missing packages. run(cmd) receives the argument list of the
+		transaction (without sudo) and returns True on success.
+		Returns a dict {package: "present" | "installed" | "failed"}.
+		"""
+		installed = self.index.installed(self.packages)
+		results = {name: "present" for name in self.packages if name in installed}
+		missing = [name for name in self.packages if name not in installed]
+		if not missing:
+			return results
+
+		success = run(self.install_command(missing))
+		self.index.invalidate()
+		if success:
+			results.update((name, "installed") for name in missing)
+			return results
+
+		# La transazione è fallita: individua i pacchetti responsabili
+		installed = self.index.installed(missing)
+		for name in missing:
+			if name in installed:
+				results[name] = "installed"
+				continue
+			success = run(self.install_command([name]))
+			self.index.invalidate()
+			results[name] = "installed" if success else "failed"
+		return results
+
+# Endpoint di ogni servizio, nell'ordine di preferenza usato se nessuno risponde.
+# Di default solo quelli ufficiali: i mirror di terze parti (es. "https://repo.packagist.org
+# https://mirrors.aliyun.com/composer") si abilitano con SETUP_MIRRORS_<SERVIZIO>="url1 url2".
+MIRROR_CANDIDATES = {
+	"npm": ["https://registry.npmjs.org"],
+	"packagist": ["https://repo.packagist.org"],
+	"composer_installer": ["https://getcomposer.org/installer"],
+	"nodesource_deb": ["https://deb.nodesource.com/setup_18.x"],
+	"nodesource_rpm": ["https://rpm.nodesource.com/setup_18.x"],
+}
+MIRROR_CANDIDATES = {
+	service: os.environ.get(f"SETUP_MIRRORS_{service.upper()}", "").split() or urls
+	for service, urls in MIRROR_CANDIDATES.items()
+}
+# Hash SHA-384 pubblicato del Composer installer, verificato prima di eseguirlo da qualunque mirror
+COMPOSER_INSTALLER_SIG_URL = os.environ.get("SETUP_COMPOSER_INSTALLER_SIG_URL", "https://composer.github.io/installer.sig")
+# Risorsa scaricata per misurare un endpoint; senza voce si scarica l'URL stesso
+MIRROR_PROBE_PATHS = {
+	"npm": "/express",
+	"packagist": "/packages.json",
+}
+MIRROR_CACHE_FILE = os.path.join(STATE_DIR, "mirrors.json")
+MIRROR_CACHE_TTL = int(os.environ.get("SETUP_MIRROR_TTL", str(6 * 3600)))
+MIRROR_PROBE_TIMEOUT = float(os.environ.get("SETUP_MIRROR_TIMEOUT", "3"))
+
+class MirrorSelector:
+	"""
+	Chooses the fastest healthy endpoint of each service among its candidates.
+	The candidates are probed concurrently with a short timeout, measuring the
+	time to the first byte and the throughput of a small download; the choice
+	is cached for ttl seconds.
+	"""
+	PROBE_BYTES = 64 * 1024
+	CHUNK_BYTES = 16 * 1024
+
+	def __init__(self, candidates, cache_path=None, ttl=MIRROR_CACHE_TTL, timeout=MIRROR_PROBE_TIMEOUT, probe=True, persist=True):
+		self.candidates = candidates
+		self.cache_path = cache_path
+		self.ttl = ttl
+		self.timeout = timeout
+		self.probe_enabled = probe
+		self.persist = persist
+		self.results = {}
+		self._locks = {service: threading.Lock() for service in candidates}
+		self._save_lock = threading.Lock()
+		self._cache = {}
+		if cache_path:
+			try:
+				with open(cache_path, "r") as f:
+					self._cache = json.load(f).get("services", {})
+			except (OSError, ValueError):
+				self._cache = {}
+
+	def measure(self, service, base):
+		"""
+		Probes one candidate. The score is the estimated time to fetch
+		PROBE_BYTES: latency plus the transfer at the measured throughput.
+		"""
+		path = MIRROR_PROBE_PATHS.get(service)
+		url = base.rstrip("/") + path if path else base
+		result = {"url": base, "score": None, "latency": None, "throughput": None, "error": None}
+		started = time.monotonic()
+		try:
+			request = urllib.request.Request(url, headers={"User-Agent": "laravel-oxylabs-setup"})
+			with urllib.request.urlopen(request, timeout=self.timeout) as response:
+				latency = time.monotonic() - started
+				received = 0
+				deadline = started + self.timeout * 2
+				while received < self.PROBE_BYTES and time.monotonic() < deadline:
+					chunk = response.read(self.CHUNK_BYTES)
+					if not chunk:
+						break
+					received += len(chunk)
+		except (OSError, ValueError) as e:
+			result["error"] = str(getattr(e, "reason", e))
+			return result
+		transfer = time.monotonic() - started - latency
+		throughput = received / transfer if received and transfer > 0 else None
+		result.update({
+			"latency": round(latency, 4),
+			"throughput": round(throughput) if throughput else None,
+			"score": round(latency + (self.PROBE_BYTES / throughput if throughput else transfer), 4)
+		})
+		return result
+
+	def select(self, service):
+		"""
+		Returns (url, source) where source is "cache", "probe", "default" (a
+		single candidate or probing disabled) or "fallback" (no candidate answered).
+		"""
+		candidates = self.candidates.get(service) or []
+		if not candidates:
+			return None, None
+		with self._locks.setdefault(service, threading.Lock()):
+			cached = self._cache.get(service)
+			if cached and cached.get("candidates") == candidates and time.time() - cached.get("checked_at", 0) < self.ttl:
+				return cached["url"], "cache"
+			if len(candidates) == 1 or not self.probe_enabled:
+				return candidates[0], "default"
+
+			with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+				results = list(pool.map(lambda base: self.measure(service, base), candidates))
+			self.results[service] = results
+			healthy = [result for result in results if result["error"] is None]
+			if not healthy:
+				# Non salvato su disco, ma non si riprova durante questa esecuzione
+				self._cache[service] = {"url": candidates[0], "candidates": candidates, "checked_at": time.time(), "results": results, "fallback": True}
+				return candidates[0], "fallback"
+			best = min(healthy, key=lambda result: result["score"])
+			self._cache[service] = {"url": best["url"], "candidates": candidates, "checked_at": time.time(), "results": results}
+			self._save()
+			return best["url"], "probe"
+
+	def _save(self):
+		if not self.cache_path or not self.persist:
+			return
+		with self._save_lock:
+			os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+			tmp_path = f"{self.cache_path}.tmp"
+			services = {service: entry for service, entry in self._cache.items() if not entry.get("fallback")}
+			with open(tmp_path, "w") as f:
+				json.dump({"services": services}, f, indent=2, sort_keys=True)
+			os.replace(tmp_path, self.cache_path)
+
+def check_distro(assume_yes=None):
+	"""
+	Checks that the distribution is supported. assume_yes, if not None, answers
+	the confirmation asked for unsupported distributions with a supported package manager.
+	"""
 	distro = ""
 	pm = ""
 
@@ -93,6 +406,12 @@ def check_distro():
 	# Ipotesi 3: Distro non supportata, ma PM si
 	if not is_distro_supported and is_pm_supported:
 		print(f"⚠️ Avviso: La distribuzione '{distro}' non è ufficialmente supportata, ma il gestore pacchetti '{pm}' lo è.")
+		if assume_yes is not None:
+			if assume_yes:
+				print("Proseguimento...")
+				return
+			print("Interruzione: distribuzione non supportata (opzione allow_unsupported_distro disattivata).")
+			sys.exit(1)
 		
 		while True:
 			choice = input("Vuoi proseguire comunque? (s/n): ").lower()
@@ -111,22 +430,32 @@ def check_distro():
 		print("Interruzione dello script.")
 		sys.exit()
 
+def install_system_packages(pkg_names, pm=None):
+	"""
+	Installs the given packages with one transaction of the package manager
+	and prints the result of each package.
+	"""
+	pm = pm or detect_package_manager()
+	if pm not in PACKAGE_INSTALL_COMMANDS:
+		print(f"Gestore pacchetti non supportato. Impossibile installare: {' '.join(pkg_names)}")
+		sys.exit(1)
+
+	batch = PackageBatch(pm, pkg_names)
+	results = batch.install(lambda cmd: subprocess.run(["sudo"] + cmd, check=False).returncode == 0)
+	for name, status in results.items():
+		template, _ = PACKAGE_STATUS_MESSAGES[status]
+		print(template.format(batch.describe(name)))
+	return results
+
 def install_system_package(pkg_name):
-	if shutil.which("apt"):
-		subprocess.run(["sudo", "apt", "update"], check=False)
-		subprocess.run(["sudo", "apt", "install", "-y", pkg_name], check=True)
-	elif shutil.which("dnf"):
-		subprocess.run(["sudo", "dnf", "install", "-y", pkg_name], check=True)
-	elif shutil.which("zypper"):
-		subprocess.run(["sudo", "zypper", "install", "--no-confirm", pkg_name], check=True)
-	elif shutil.which("pacman"):
-		# Fix: Use pacman -S --noconfirm for installation
-		subprocess.run(["sudo", "pacman", "-S", "--noconfirm", "--needed", pkg_name], check=True)
-	else:
-		print(f"Gestore pacchetti non supportato. Impossibile installare: {pkg_name}")
+	results = install_system_packages([pkg_name])
+	if results.get(pkg_name) == "failed":
 		sys.exit(1)
 
-def check_and_run_setup():
+def get_venv_paths():
+	"""
+	Returns (venv_dir, venv_python).
+	"""
 	is_windows = os.name == "nt"
 	venv_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".venv")
 
@@ -137,6 +466,61 @@ def check_and_run_setup():
 	else:
 		# Logica originale per gli altri sistemi
 		venv_python = os.path.join(venv_dir, "Scripts" if is_windows else "bin", "python.exe" if is_windows else "python3")
+	return venv_dir, venv_python
+
+def bootstrap_fingerprint():
+	"""
+	Describes the bootstrap state without starting any process: declared
+	requirements, distribution, package manager, the venv interpreter and
+	the distributions installed in it.
+	"""
+	venv_dir, venv_python = get_venv_paths()
+	try:
+		with open(os.path.join(venv_dir, "pyvenv.cfg"), "r") as f:
+			venv_cfg = f.read()
+	except OSError:
+		venv_cfg = None
+	try:
+		with open("/etc/os-release", "r") as f:
+			os_release = f.read()
+	except OSError:
+		os_release = None
+
+	installed = glob.glob(os.path.join(venv_dir, "lib", "*", "site-packages", "*.dist-info"))
+	installed += glob.glob(os.path.join(venv_dir, "Lib", "site-packages", "*.dist-info"))
+	return {
+		"requirements": [REQUIRED_PIP_PACKAGES, REQUIRED_SYSTEM_PACKAGES, REQUIRED_ZYPPER_PACKAGES, REQUIRED_DNF_PACKAGES],
+		"os_release": os_release,
+		"package_manager": detect_package_manager(),
+		"venv_cfg": venv_cfg,
+		"venv_python": os.path.realpath(venv_python) if os.path.exists(venv_python) else None,
+		"distributions": sorted(os.path.basename(path) for path in installed)
+	}
+
+def bootstrap_is_current():
+	"""
+	Tells whether the stamp written by the last successful bootstrap still
+	matches the current state, so the whole bootstrap can be skipped.
+	"""
+	if "--full-bootstrap" in sys.argv:
+		return False
+	try:
+		with open(BOOTSTRAP_STAMP_FILE, "r") as f:
+			stamp = json.load(f)
+	except (OSError, ValueError):
+		return False
+	return stamp == json.loads(json.dumps(bootstrap_fingerprint()))
+
+def write_bootstrap_stamp():
+	os.makedirs(STATE_DIR, exist_ok=True)
+	tmp_path = f"{BOOTSTRAP_STAMP_FILE}.tmp"
+	with open(tmp_path, "w") as f:
+		json.dump(bootstrap_fingerprint(), f, indent=2)
+	os.replace(tmp_path, BOOTSTRAP_STAMP_FILE)
+
+def check_and_run_setup():
+	is_windows = os.name == "nt"
+	venv_dir, venv_python = get_venv_paths()
 
 	if not is_windows:
 		# Aggiorna il gestore pacchetti prima di installare
@@ -183,31 +567,19 @@ def check_and_run_setup():
 		except subprocess.CalledProcessError:
 			subprocess.run([venv_python, "-m", "pip", "install", pkg], check=True)
 
+	write_bootstrap_stamp()
 	print("Setup completato. Ambiente virtuale e dipendenze installate.")
 
 
 def install_required_system_packages():
 	# Detect package manager first
-	pm = ""
-	if shutil.which("apt"):
-		pm = "apt"
-	elif shutil.which("dnf"):
-		pm = "dnf"
-	elif shutil.which("pacman"):
-		pm = "pacman"
-	elif shutil.which("zypper"):
-		pm = "zypper"
-	else:
+	pm = detect_package_manager()
+	if pm not in ["apt", "dnf", "pacman", "zypper"]:
 		print("Gestore pacchetti non supportato per la verifica dei pacchetti di sistema.")
 		return
 
 	if pm == "dnf":
-		for pkg in REQUIRED_DNF_PACKAGES:
-			try:
-				subprocess.run(["rpm", "-q", pkg], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-			except subprocess.CalledProcessError:
-				print(f"Installazione pacchetto di sistema mancante: {pkg}")
-				install_system_package(pkg)
+		packages = REQUIRED_DNF_PACKAGES
 	elif pm == "zypper":
 		print("🔄 Verifica e sblocco di PackageKit...")
 		try:
@@ -217,47 +589,21 @@ def install_required_system_packages():
 		except subprocess.CalledProcessError:
 			print("⚠️ Impossibile fermare PackageKit. Potrebbe essere necessario farlo manualmente.")
 			sys.exit(1)
-		print("🔄 Installazione di Python 3.12 e pip...")
-		try:
-			# Installa esplicitamente python312 e python312-pip
-			subprocess.run(["sudo", "zypper", "install", "--no-confirm", "python312", "python312-pip"], check=True)
-			print("✅ Python 3.12 e pip installati.")
-		except subprocess.CalledProcessError as e:
-			print(f"❌ Errore nell'installazione di Python 3.12: {e}")
-			sys.exit(1)
-
-		# Installa i pacchetti zypper richiesti
-		for pkg in REQUIRED_ZYPPER_PACKAGES:
-			try:
-				subprocess.run(["rpm", "-q", pkg], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-			except subprocess.CalledProcessError:
-				print(f"Installazione pacchetto di sistema mancante: {pkg}")
-				install_system_package(pkg)
+		print("🔄 Installazione di Python 3.12, pip e delle librerie di sistema...")
+		# Python 3.12 e pip vengono installati nella stessa transazione delle librerie
+		packages = ["python312", "python312-pip"] + REQUIRED_ZYPPER_PACKAGES
 	else:
-		# Logica per altri sistemi...
-		for pkg in REQUIRED_SYSTEM_PACKAGES:
-			if pm == "pacman" and pkg.startswith("libxcb-"):
-				pkg_to_install = "libxcb"
-			else:
-				pkg_to_install = pkg
-			try:
-				if pm == "apt":
-					subprocess.run(["dpkg", "-s", pkg], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-				elif pm == "pacman":
-					subprocess.run(["pacman", "-Q", pkg_to_install], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-			except subprocess.CalledProcessError:
-				print(f"Installazione pacchetto di sistema mancante: {pkg_to_install}")
-				install_system_package(pkg_to_install)
+		# Su Arch tutte le librerie xcb sono fornite dal pacchetto libxcb
+		packages = ["libxcb" if pm == "pacman" and pkg.startswith("libxcb-") else pkg for pkg in REQUIRED_SYSTEM_PACKAGES]
+
+	results = install_system_packages(packages, pm)
+	failed = [name for name, status in results.items() if status == "failed"]
+	if failed:
+		print(f"❌ Errore nell'installazione dei pacchetti di sistema: {' '.join(failed)}")
+		sys.exit(1)
 
 def ensure_running_in_venv():
-	# Determina il percorso dell'eseguibile python nel venv
-	venv_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".venv")
-	if shutil.which("zypper"):
-		# Su OpenSUSE, il venv è sempre creato con python3.12
-		venv_python = os.path.join(venv_dir, "bin", "python3.12")
-	else:
-		# Logica originale per gli altri sistemi
-		venv_python = os.path.join(venv_dir, "Scripts" if os.name == "nt" else "bin", "python.exe" if os.name == "nt" else "python3")
+	venv_dir, venv_python = get_venv_paths()
 
 	if os.path.abspath(sys.executable) != os.path.abspath(venv_python):
 		print("🔁 Rilancio lo script all'interno del virtualenv con Python 3.12...")
@@ -268,33 +614,2089 @@ def ensure_running_in_venv():
 			print(f"❌ Errore: l'eseguibile Python non è stato trovato in {venv_python}. Assicurati che l'ambiente virtuale sia stato creato correttamente.")
 			sys.exit(1)
 
+def benchmark_startup(runs=3):
+	"""
+	Launches the script up to the point where the window would be created,
+	first with the full bootstrap (cold) and then through the bootstrap stamp
+	(warm), and prints the wall times as JSON lines.
+	"""
+	script = os.path.abspath(__file__)
+	for mode, extra_args in [("cold", ["--full-bootstrap"]), ("warm", [])]:
+		times = []
+		for _ in range(runs):
+			started = time.perf_counter()
+			subprocess.run([sys.executable, script, "--startup-probe"] + extra_args, check=True, stdout=subprocess.DEVNULL)
+			times.append(time.perf_counter() - started)
+		print(json.dumps({
+			"mode": mode,
+			"runs": runs,
+			"min_seconds": round(min(times), 3),
+			"mean_seconds": round(sum(times) / len(times), 3)
+		}))
+
+# Sorgente degli eseguibili simulati usati da benchmark_provisioning.
+# Ogni invocazione viene annotata in SETUP_SIM_LOG; latenza, righe di output e
+# probabilità di errore si configurano con SETUP_SIM_LATENCY[_<TOOL>],
+# SETUP_SIM_LINES e SETUP_SIM_FAILURE_RATE; SETUP_SIM_FAILURE_OUTPUT è la riga
+# stampata da un'invocazione fallita. Le righe iniziano con "#" perché
+# alcuni output (es. curl | bash) vengono eseguiti da una shell.
+# Gli strumenti che modificano file (SIMULATED_GUARDED_TOOLS) eseguono quello reale
+# di SETUP_SIM_HOST_BIN solo se tutti i percorsi sono sotto SETUP_SIM_ROOT, altrimenti
+# non fanno nulla; senza root i cambi di proprietario vengono ignorati.
+SIMULATED_TOOL_SOURCE = """#!{python}
+import os, random, sys, time
+
+tool = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+with open(os.environ["SETUP_SIM_LOG"], "a") as log:
+	log.write(" ".join([tool] + args) + "\\n")
+
+if tool in {guarded}:
+	root = os.path.realpath(os.environ["SETUP_SIM_ROOT"])
+	paths = [os.path.realpath(arg) for arg in args if not arg.startswith("-")]
+	if not all(path == root or path.startswith(root + os.sep) for path in paths):
+		sys.exit(0)
+	if os.getuid() != 0:
+		if tool == "chown":
+			sys.exit(0)
+		if tool == "install":
+			kept = []
+			while args:
+				arg = args.pop(0)
+				if arg in ("-o", "-g"):
+					args.pop(0)
+				else:
+					kept.append(arg)
+			args = kept
+	real = os.path.join(os.environ["SETUP_SIM_HOST_BIN"], tool)
+	os.execv(real, [real] + args)
+
+if tool == "sudo":
+	while args and args[0].startswith("-"):
+		flag = args.pop(0)
+		if flag == "-S":
+			sys.stdin.readline()
+		elif flag in ("-u", "-p"):
+			args.pop(0)
+	if args:
+		os.execvp(args[0], args)
+	sys.exit(0)
+
+key = "SETUP_SIM_LATENCY_" + tool.upper().replace("-", "_")
+time.sleep(float(os.environ.get(key, os.environ.get("SETUP_SIM_LATENCY", "0"))))
+for i in range(int(os.environ.get("SETUP_SIM_LINES", "0"))):
+	print("# " + tool + ": riga simulata " + str(i))
+
+if tool == "git" and args and args[0] == "clone":
+	# Struttura minima del progetto richiesta dai passaggi successivi
+	target = args[-1]
+	for folder in ["storage/logs", "app/Providers/Filament", ".git"]:
+		os.makedirs(os.path.join(target, folder), exist_ok=True)
+	for name in [".env.example", "app/Providers/Filament/AdminPanelProvider.php", "app/Providers/Filament/AdminPanelProvider-1.php"]:
+		open(os.path.join(target, name), "a").close()
+
+if random.random() < float(os.environ.get("SETUP_SIM_FAILURE_RATE", "0")):
+	if os.environ.get("SETUP_SIM_FAILURE_OUTPUT"):
+		print(os.environ["SETUP_SIM_FAILURE_OUTPUT"])
+	sys.exit(1)
+"""
+
+# Strumenti simulati comuni a tutti i rami e quelli specifici di ciascun gestore pacchetti
+SIMULATED_COMMON_TOOLS = ["sudo", "composer", "npm", "node", "php", "mysql", "mariadb", "mariadb-install-db",
+	"git", "crontab", "curl", "systemctl", "service", "update-rc.d", "sed"]
+SIMULATED_PM_TOOLS = {
+	"apt": ["apt", "apt-get", "dpkg", "dpkg-query"],
+	"dnf": ["dnf", "rpm"],
+	"pacman": ["pacman"],
+	"zypper": ["zypper", "rpm"],
+	"pkg": ["pkg", "pkg-static"]
+}
+# Strumenti che modificano file, simulati fuori dalla directory temporanea del benchmark
+SIMULATED_GUARDED_TOOLS = ["rm", "mkdir", "chown", "chmod", "mv", "cp", "install"]
+# Strumenti reali dell'host resi disponibili nel PATH ristretto del benchmark
+BENCHMARK_HOST_TOOLS = ["bash", "sh", "cat", "cut", "getent", "nohup",
+	"env", "sleep", "true", "which", "id", "sha256sum", "sha384sum"]
+
+def start_http_stand_ins(specs):
+	"""
+	Starts one local HTTP server per (latency, bytes_per_second, status) spec.
+	Each answers every GET after latency seconds with PROBE_BYTES bytes sent at
+	the given rate (0 = unlimited), and a path ending in ".sig" with the
+	SHA-384 of those bytes, like the Composer installer signature. Returns
+	the servers and their base URLs.
+	"""
+	import http.server
+	servers = []
+	for spec in specs:
+		class StandInHandler(http.server.BaseHTTPRequestHandler):
+			latency, rate, status = spec
+
+			def do_GET(self):
+				time.sleep(self.latency)
+				body = b"x" * MirrorSelector.PROBE_BYTES
+				if self.path.endswith(".sig"):
+					body = hashlib.sha384(body).hexdigest().encode("ascii")
+				self.send_response(self.status)
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				for offset in range(0, len(body), 8192):
+					self.wfile.write(body[offset:offset + 8192])
+					if self.rate:
+						time.sleep(8192 / self.rate)
+
+			def log_message(self, format, *args):
+				pass
+
+		server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+		server.daemon_threads = True
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers.append(server)
+	return servers, [f"http://127.0.0.1:{server.server_port}" for server in servers]
+
+def benchmark_mirrors():
+	"""
+	Checks the MirrorSelector against local stand-in servers with injected
+	delays: low latency but slow transfer, higher latency but fast transfer,
+	an HTTP error, a server slower than the timeout and a closed port.
+	Prints one JSON line per selection (probe, cached, expired cache).
+	"""
+	servers, urls = start_http_stand_ins([
+		(0.02, 64 * 1024, 200),
+		(0.15, 0, 200),
+		(0.01, 0, 503),
+		(5.0, 0, 200),
+	])
+	closed = socket.socket()
+	closed.bind(("127.0.0.1", 0))
+	urls.append(f"http://127.0.0.1:{closed.getsockname()[1]}")
+	closed.close()
+	expected = urls[1]
+
+	with tempfile.TemporaryDirectory(prefix="setup-mirrors-") as root:
+		cache_path = os.path.join(root, "mirrors.json")
+		for label, ttl in [("probe", 3600), ("cache", 3600), ("expired", 0)]:
+			selector = MirrorSelector({"bench": urls}, cache_path, ttl=ttl, timeout=1.0)
+			started = time.perf_counter()
+			url, source = selector.select("bench")
+			print(json.dumps({
+				"run": label,
+				"selected": url,
+				"expected": expected,
+				"correct": url == expected,
+				"source": source,
+				"seconds": round(time.perf_counter() - started, 3),
+				"candidates": selector.results.get("bench", [])
+			}))
+	for server in servers:
+		server.shutdown()
+
+def benchmark_provisioning(package_managers, latency=0.05, lines=20, failure_rate=0.0):
+	"""
+	Runs the whole headless Worker pipeline once per package manager against
+	simulated tools placed alone on PATH, with the project, cache and state
+	redirected to a temporary directory. Prints one JSON line per branch with
+	end-to-end and per-step times, subprocess counts and log overhead.
+	"""
+	script = os.path.abspath(__file__)
+	results = []
+	# I mirror vengono scelti tra due server locali invece che su Internet
+	mirror_servers, mirror_urls = start_http_stand_ins([(0.005, 0, 200), (0.05, 0, 200)])
+	# Socket in ascolto al posto di quello di MariaDB, atteso dal ramo pkg
+	socket_dir = tempfile.mkdtemp(prefix="setup-bench-mysql-")
+	mysql_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	mysql_socket.bind(os.path.join(socket_dir, "mysql.sock"))
+	mysql_socket.listen(16)
+	for pm in package_managers:
+		with tempfile.TemporaryDirectory(prefix=f"setup-bench-{pm}-") as root:
+			sim_dir = os.path.join(root, "sim-bin")
+			host_dir = os.path.join(root, "host-bin")
+			guarded_dir = os.path.join(root, "guarded-bin")
+			os.makedirs(sim_dir)
+			os.makedirs(host_dir)
+			os.makedirs(guarded_dir)
+			source = SIMULATED_TOOL_SOURCE.replace("{python}", sys.executable).replace("{guarded}", repr(SIMULATED_GUARDED_TOOLS))
+			for tool in SIMULATED_GUARDED_TOOLS:
+				real_path = shutil.which(tool)
+				if real_path:
+					os.symlink(real_path, os.path.join(guarded_dir, tool))
+			for tool in SIMULATED_COMMON_TOOLS + SIMULATED_PM_TOOLS[pm] + SIMULATED_GUARDED_TOOLS:
+				path = os.path.join(sim_dir, tool)
+				with open(path, "w") as f:
+					f.write(source)
+				os.chmod(path, 0o755)
+			for tool in BENCHMARK_HOST_TOOLS:
+				real_path = shutil.which(tool)
+				if real_path:
+					os.symlink(real_path, os.path.join(host_dir, tool))
+
+			answers_path = os.path.join(root, "answers.json")
+			with open(answers_path, "w") as f:
+				json.dump({
+					"sudo_method": "password",
+					"sudo_password": "benchmark",
+					"admin_password": "benchmark",
+					"options": {"allow_unsupported_distro": True, "no_resume": True}
+				}, f)
+
+			sim_log = os.path.join(root, "invocations.log")
+			open(sim_log, "w").close()
+			env = dict(os.environ)
+			env.setdefault("USER", getpass.getuser())
+			env.update({
+				"PATH": f"{sim_dir}:{host_dir}",
+				"SETUP_SIM_LOG": sim_log,
+				"SETUP_SIM_ROOT": root,
+				"SETUP_SIM_HOST_BIN": guarded_dir,
+				"SETUP_SIM_LATENCY": str(latency),
+				"SETUP_SIM_LINES": str(lines),
+				"SETUP_SIM_FAILURE_RATE": str(failure_rate),
+				"SETUP_SUDO_BINARY": os.path.join(sim_dir, "sudo"),
+				"SETUP_PROJECT_DIR": os.path.join(root, "www", "laravel-oxylabs-test"),
+				"SETUP_CACHE_DIR": os.path.join(root, "cache"),
+				"SETUP_STATE_DIR": os.path.join(root, "state"),
+				"SETUP_ROOT_STAGING_DIR": os.path.join(root, "root-staging"),
+				"SETUP_MYSQL_SOCKET": os.path.join(socket_dir, "mysql.sock")
+			})
+			env.update({f"SETUP_MIRRORS_{service.upper()}": " ".join(mirror_urls) for service in MIRROR_CANDIDATES})
+			env["SETUP_COMPOSER_INSTALLER_SIG_URL"] = f"{mirror_urls[0]}/installer.sig"
+
+			started = time.perf_counter()
+			process = subprocess.run([sys.executable, script, "--headless", "--answers", answers_path],
+				env=env, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+			wall = time.perf_counter() - started
+
+			events = [json.loads(line) for line in process.stdout.splitlines() if line.startswith("{")]
+			summaries = glob.glob(os.path.join(root, "state", "traces", "summary-*.json"))
+			summary = {}
+			if summaries:
+				with open(summaries[0], "r") as f:
+					summary = json.load(f)
+			with open(sim_log, "r") as f:
+				invocations = sum(1 for _ in f)
+
+			result = {
+				"pm": pm,
+				"success": process.returncode == 0,
+				"wall_seconds": round(wall, 3),
+				"pipeline_seconds": summary.get("wall_seconds"),
+				"commands": summary.get("commands"),
+				"tool_invocations": invocations,
+				"log_lines": summary.get("log", {}).get("lines", sum(1 for event in events if event.get("event") == "log")),
+				"log_delivery_seconds": summary.get("log", {}).get("delivery_seconds"),
+				"steps": [{"name": step["name"], "seconds": step["seconds"], "status": step["status"]} for step in summary.get("steps", [])]
+			}
+			results.append(result)
+			print(json.dumps(result, ensure_ascii=False))
+	for server in mirror_servers:
+		server.shutdown()
+	mysql_socket.close()
+	shutil.rmtree(socket_dir, ignore_errors=True)
+	return results
+
+def get_cli_option(name, default=None):
+	"""
+	Returns the value that follows name on the command line.
+	"""
+	if name in sys.argv:
+		position = sys.argv.index(name)
+		if position + 1 < len(sys.argv):
+			return sys.argv[position + 1]
+	return default
+
+def load_answer_file(path):
+	"""
+	Loads the JSON answer file of the headless mode, e.g.:
+	{"sudo_method": "password", "sudo_password_env": "SETUP_SUDO_PASSWORD",
+	 "panel_id": "admin", "admin_name": "admin", "admin_email": "admin@example.com",
+	 "admin_password": "...", "options": {"allow_unsupported_distro": false, "no_resume": false}}
+	sudo_method is "password" (sudo_password or the variable named by sudo_password_env),
+	"nopasswd" or "root".
+	"""
+	if not path:
+		print("❌ La modalità --headless richiede --answers <file.json>.", file=sys.stderr)
+		sys.exit(2)
+	try:
+		with open(path, "r") as f:
+			answers = json.load(f)
+	except (OSError, ValueError) as e:
+		print(f"❌ Impossibile leggere il file di risposte {path}: {e}", file=sys.stderr)
+		sys.exit(2)
+	if not isinstance(answers, dict):
+		print(f"❌ Il file di risposte {path} deve contenere un oggetto JSON.", file=sys.stderr)
+		sys.exit(2)
+	return answers
+
 # Avvia setup e rilancio se serve
-check_distro()
+if DRY_RUN:
+	# Come la modalità headless non servono venv né PyQt6; il file di risposte è facoltativo
+	answers_path = get_cli_option("--answers")
+	HEADLESS_ANSWERS = load_answer_file(answers_path) if answers_path else {}
+	with contextlib.redirect_stdout(sys.stderr):
+		check_distro(assume_yes=True)
+elif HEADLESS:
+	# Senza interfaccia non servono venv, PyQt6 né le librerie xcb: il worker usa solo la libreria standard.
+	# Lo stdout è riservato all'output strutturato, i messaggi di avvio vanno su stderr.
+	HEADLESS_ANSWERS = load_answer_file(get_cli_option("--answers"))
+	with contextlib.redirect_stdout(sys.stderr):
+		check_distro(assume_yes=bool(HEADLESS_ANSWERS.get("options", {}).get("allow_unsupported_distro", False)))
+elif "--benchmark-startup" in sys.argv:
+	benchmark_startup()
+	sys.exit(0)
+elif "--benchmark-mirrors" in sys.argv:
+	benchmark_mirrors()
+	sys.exit(0)
+elif "--benchmark-provisioning" in sys.argv:
+	# Es.: --benchmark-provisioning --sim-pm apt,zypper --sim-latency 0.05 --sim-lines 20 --sim-failure-rate 0
+	benchmark_provisioning(
+		get_cli_option("--sim-pm", ",".join(SIMULATED_PM_TOOLS)).split(","),
+		latency=float(get_cli_option("--sim-latency", "0.05")),
+		lines=int(get_cli_option("--sim-lines", "20")),
+		failure_rate=float(get_cli_option("--sim-failure-rate", "0"))
+	)
+	sys.exit(0)
+else:
+	# Avvio rapido: se il timbro del bootstrap è valido si passa direttamente al venv
+	if bootstrap_is_current():
+		print("⚡ Ambiente già pronto, bootstrap saltato.")
+	else:
+		check_distro()
+
+		# Il resto del codice verrà eseguito solo se la distro è compatibile
+		check_and_run_setup()
+	ensure_running_in_venv()
+
+
+if HEADLESS or DRY_RUN:
+	# PyQt6 non viene importato: queste classi minime forniscono a Worker
+	# i segnali, il thread e il mutex che altrimenti prende da Qt.
+	class BoundSignal:
+		def __init__(self):
+			self.slots = []
+
+		def connect(self, slot):
+			self.slots.append(slot)
+
+		def emit(self, *args):
+			for slot in self.slots:
+				slot(*args)
+
+	class pyqtSignal:
+		def __init__(self, *types):
+			self.name = None
 
-# Il resto del codice verrà eseguito solo se la distro è compatibile
-check_and_run_setup()
-ensure_running_in_venv()
+		def __set_name__(self, owner, name):
+			self.name = name
 
+		def __get__(self, obj, objtype=None):
+			if obj is None:
+				return self
+			# Ogni istanza riceve il proprio segnale, salvato nel suo __dict__
+			return obj.__dict__.setdefault(self.name, BoundSignal())
 
-from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton,
-							QTextEdit, QMessageBox, QHBoxLayout,
-							QLabel, QInputDialog, QLineEdit, QTextBrowser,
-							QSizePolicy, QListWidget, QListWidgetItem, QFrame, QAbstractItemView)
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QMutex, QObject, QTimer, QProcess
-from PyQt6.QtGui import QFont, QTextCursor, QBrush, QColor
+	class QThread:
+		def __init__(self, parent=None):
+			self._thread = None
+
+		def run(self):
+			pass
+
+		def start(self):
+			self._thread = threading.Thread(target=self.run)
+			self._thread.start()
+
+		def wait(self):
+			if self._thread is not None:
+				self._thread.join()
+
+		@staticmethod
+		def msleep(ms):
+			time.sleep(ms / 1000)
+
+	class QMutex:
+		def __init__(self):
+			self._lock = threading.Lock()
+
+		def lock(self):
+			self._lock.acquire()
+
+		def unlock(self):
+			self._lock.release()
+
+	# Le classi dell'interfaccia vengono definite ma mai istanziate
+	QObject = QWidget = object
+else:
+	from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton,
+								QTextEdit, QMessageBox, QHBoxLayout,
+								QLabel, QInputDialog, QLineEdit, QTextBrowser,
+								QSizePolicy, QListWidget, QListWidgetItem, QFrame, QAbstractItemView)
+	from PyQt6.QtCore import QThread, pyqtSignal, Qt, QMutex, QObject, QTimer, QProcess, QEventLoop
+	from PyQt6.QtGui import QFont, QTextCursor, QBrush, QColor
 
 # --- PROJECT CONFIGURATION VARIABLE ---
 # The project directory is fixed as requested.
-PROJECT_DIR = "/var/www/html/laravel-oxylabs-test"
+PROJECT_DIR = os.environ.get("SETUP_PROJECT_DIR", "/var/www/html/laravel-oxylabs-test")
+PROJECT_REPO_URL = "https://github.com/smal82/laravel-oxylabs-test.git"
+# Sincronizzazione di un progetto già presente: "reset" (fetch + reset --hard),
+# "ff" (fetch + fast-forward) oppure "clone" (cancella e riclona da zero)
+PROJECT_SYNC_MODE = os.environ.get("SETUP_SYNC_MODE", "reset")
+# Profondità del primo clone (0 = storia completa) e filtro per il clone parziale (es. "blob:none")
+PROJECT_CLONE_DEPTH = int(os.environ.get("SETUP_CLONE_DEPTH", "1"))
+PROJECT_CLONE_FILTER = os.environ.get("SETUP_CLONE_FILTER", "")
+# Mirror locale opzionale del repository, usato come --reference per il clone
+PROJECT_REFERENCE_MIRROR = os.environ.get("SETUP_GIT_MIRROR", "")
 # --- END PROJECT CONFIGURATION VARIABLE ---
 
+# Eseguibile sudo usato da run_command
+SUDO_BINARY = os.environ.get("SETUP_SUDO_BINARY", "/usr/bin/sudo")
+
+# Limiti di ogni comando in secondi: durata massima e tempo massimo senza output (0 = nessun limite)
+COMMAND_WALL_TIMEOUT = float(os.environ.get("SETUP_COMMAND_TIMEOUT", "3600"))
+COMMAND_STALL_TIMEOUT = float(os.environ.get("SETUP_STALL_TIMEOUT", "600"))
+# Codice di uscita riportato per un comando interrotto da un timeout, come timeout(1)
+TIMEOUT_EXIT_CODE = 124
+
+# Firme di errori transitori nell'output dei comandi (rete, mirror, lock): solo
+# questi giustificano un nuovo tentativo. Vengono cercate nelle ultime righe.
+TRANSIENT_FAILURE_PATTERNS = [
+	("npm", re.compile(r"\b(?:code|errno) (E(?:TIMEDOUT|CONNRESET|CONNREFUSED|AI_AGAIN|NOTFOUND|SOCKETTIMEDOUT|PIPE))\b")),
+	("npm", re.compile(r"npm (?:ERR!|error) (?:code E(?:429|50[0234])|network)")),
+	("composer", re.compile(r"curl error \d+ while downloading|The \"[^\"]+\" file could not be downloaded|Failed to download \S+ from dist")),
+	("apt", re.compile(r"Could not resolve '[^']+'|Temporary failure resolving|Failed to fetch .*(?:timed out|Could not connect|50[0234])|Could not get lock /var/lib/dpkg")),
+	("dnf", re.compile(r"Curl error \(\d+\)|Cannot download repomd\.xml|Failed to download metadata")),
+	("pacman", re.compile(r"failed retrieving file|Operation too slow|Connection timed out after|unable to lock database")),
+	("zypper", re.compile(r"Download \(curl\) error|Timeout exceeded when accessing|System management is locked")),
+	("pkg", re.compile(r"pkg: .*(?:Operation timed out|No address record|Connection refused)")),
+	("git", re.compile(r"Could not resolve host|RPC failed|early EOF|Connection (?:timed out|reset by peer)")),
+	("curl", re.compile(r"curl: \((?:6|7|28|35|52|56)\)")),
+	("rete", re.compile(r"ECONNRESET|Network is unreachable|Temporary failure in name resolution"))
+]
+RETRY_OUTPUT_TAIL = 40
+# Codici di uscita transitori degli strumenti di rete, validi quando il comando termina con lo
+# strumento stesso (non "curl ... | bash"): curl 6 host non risolto, 7 connessione rifiutata,
+# 28 timeout, 35 handshake TLS fallito, 56 ricezione interrotta; wget 4 errore di rete.
+TRANSIENT_EXIT_CODES = {
+	"curl": {6: "host non risolto", 7: "connessione fallita", 28: "timeout", 35: "handshake TLS fallito", 56: "ricezione interrotta"},
+	"wget": {4: "errore di rete"},
+}
+# Un comando senza output fino allo stall timeout di solito aspetta un input: ripeterlo
+# costerebbe un altro timeout intero, quindi viene ripetuto solo se richiesto
+RETRY_STALLED_COMMANDS = os.environ.get("SETUP_RETRY_STALLS", "0") == "1"
+
+# Tempo massimo di attesa perché il database accetti connessioni, e durata massima di ogni sonda
+DB_READY_TIMEOUT = float(os.environ.get("SETUP_DB_READY_TIMEOUT", "60"))
+# Socket di MariaDB su FreeBSD, usato dal client e dalla sonda di configure_database
+FREEBSD_MYSQL_SOCKET = os.environ.get("SETUP_MYSQL_SOCKET", "/var/run/mysql/mysql.sock")
+PROBE_COMMAND_TIMEOUT = 10
+# Tentativi dei comandi idempotenti (download e installazioni): gli errori non transitori non vengono mai ripetuti
+COMMAND_RETRIES = int(os.environ.get("SETUP_RETRIES", "3"))
+# Attesa massima tra due tentativi, in secondi
+RETRY_MAX_DELAY = float(os.environ.get("SETUP_RETRY_MAX_DELAY", "120"))
+
+def exit_tool(cmd):
+	"""
+	Returns the tool whose exit code a shell command returns: the first word
+	of the last command of its last pipeline, without sudo and variables.
+	"""
+	words = re.split(r"&&|\|\||;|\|", cmd)[-1].split()
+	words = [word for word in words if "=" not in word and word not in ("sudo", "-S", "-E")]
+	return os.path.basename(words[0]) if words else ""
+
+def classify_failure(output, timed_out=None, exit_code=None, cmd=None):
+	"""
+	Returns why a failed command is worth retrying, or None if the failure
+	isn't transient. output holds the last lines of the command output;
+	exit_code and cmd match TRANSIENT_EXIT_CODES. A stall timeout is
+	transient only with RETRY_STALLED_COMMANDS.
+	"""
+	if timed_out == "stall":
+		return "nessun output entro il limite" if RETRY_STALLED_COMMANDS else None
+	if cmd and exit_code:
+		tool = exit_tool(cmd)
+		meaning = TRANSIENT_EXIT_CODES.get(tool, {}).get(exit_code)
+		if meaning:
+			return f"{tool}: codice {exit_code} ({meaning})"
+	for line in reversed(output):
+		for tool, pattern in TRANSIENT_FAILURE_PATTERNS:
+			match = pattern.search(line)
+			if match:
+				return f"{tool}: {match.group(0).strip()}"
+	return None
+
+def retry_delay(attempt, base, cap=RETRY_MAX_DELAY):
+	"""
+	Capped exponential backoff with jitter before the given retry (1 = first):
+	between half and all of min(cap, base * 2^(attempt-1)), so that parallel
+	commands failing together don't hit the mirror again at the same instant.
+	"""
+	delay = min(cap, base * 2 ** (attempt - 1))
+	return delay / 2 + random.uniform(0, delay / 2)
+
+# Cache condivisa dell'host per i pacchetti Composer e i tarball npm
+DEPENDENCY_CACHE_DIR = os.environ.get("SETUP_CACHE_DIR", "/var/cache/laravel-oxylabs-setup")
+
+# Righe di output che indicano come è stata soddisfatta una dipendenza.
+# Composer 2 stampa "Downloading" solo per i pacchetti assenti dalla cache;
+# npm con --loglevel http annota ogni richiesta con l'esito della cache.
+CACHE_OUTPUT_PATTERNS = {
+	"composer": {
+		"miss": re.compile(r"^\s*- Downloading "),
+		"install": re.compile(r"^\s*- Installing ")
+	},
+	"npm": {
+		"hit": re.compile(r"\(cache hit\)"),
+		"miss": re.compile(r"\(cache (miss|revalidated|stale|updated)\)")
+	}
+}
+
+class DependencyCacheStats:
+	"""
+	Counts cache hits and misses of a dependency installer from its output.
+	"""
+	def __init__(self, tool):
+		self.tool = tool
+		self.patterns = CACHE_OUTPUT_PATTERNS[tool]
+		self.counts = {"hit": 0, "miss": 0, "install": 0}
+
+	def feed(self, line):
+		for kind, pattern in self.patterns.items():
+			if pattern.search(line):
+				self.counts[kind] += 1
+
+	def summary(self):
+		"""
+		Returns (hits, misses).
+		"""
+		misses = self.counts["miss"]
+		if "install" in self.patterns:
+			return max(self.counts["install"] - misses, 0), misses
+		return self.counts["hit"], misses
+
+# Artefatti scaricati in anticipo dal Prefetcher
+PREFETCH_DIR = os.path.join(DEPENDENCY_CACHE_DIR, "staging")
+# Gli script eseguiti come root vengono copiati qui (root, 0700), fuori da PREFETCH_DIR che
+# appartiene all'utente, e verificati sulla copia subito prima di eseguirli
+ROOT_STAGING_DIR = os.environ.get("SETUP_ROOT_STAGING_DIR", "/var/lib/laravel-oxylabs-setup/staging")
+
+CHECKPOINT_FILE = os.path.join(STATE_DIR, "checkpoints.json")
+HISTORY_FILE = os.path.join(STATE_DIR, "command_history.json")
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+TRACE_DIR = os.path.join(STATE_DIR, "traces")
+
+class StreamedCommand:
+	"""
+	A running command whose output lines and exit status arrive as messages
+	on a queue, fed by the CommandEngine or by the PrivilegedBroker. Signals
+	go to the process group led by pid; subclasses without a local process
+	override signal().
+	"""
+	def __init__(self, pid=None):
+		self.pid = pid
+		self.messages = queue.Queue()
+		self.exit_code = None
+		self.rusage = None
+		self.exited = threading.Event()
+		self.started = time.monotonic()
+		self.last_output = self.started
+		self.timed_out = None # "wall" o "stall" se interrotto da un timeout
+		self.timeout_limit = None
+
+	def put(self, message):
+		if "line" in message:
+			self.last_output = time.monotonic()
+		else:
+			self.exited.set()
+		self.messages.put(message)
+
+	def lines(self):
+		"""
+		Yields the output lines until the command exits.
+		"""
+		while True:
+			message = self.messages.get()
+			if "line" in message:
+				yield message["line"]
+				continue
+			if message.get("exit") is None:
+				raise RuntimeError(message.get("error") or "Il processo è terminato senza codice di uscita.")
+			self.exit_code = TIMEOUT_EXIT_CODE if self.timed_out else message["exit"]
+			self.rusage = message.get("rusage")
+			return
+
+	def wait(self):
+		if self.exit_code is None:
+			for _ in self.lines():
+				pass
+		return self.exit_code, self.rusage
+
+	def signal(self, sig):
+		if self.pid is None:
+			return
+		try:
+			os.killpg(self.pid, sig)
+		except (ProcessLookupError, PermissionError):
+			pass
+
+	def terminate(self):
+		self.signal(signal.SIGTERM)
+
+class EngineCommand(StreamedCommand):
+	"""
+	A command started by the CommandEngine in its own process group.
+	"""
+	def __init__(self, process):
+		super().__init__(process.pid)
+		self.process = process
+
+class CommandEngine:
+	"""
+	Runs shell commands with an asyncio event loop on a background thread.
+	Output is read in chunks without blocking, any number of commands can be
+	in flight, and every command (including those of the PrivilegedBroker)
+	gets a wall-clock and a no-output timeout that kill its process group.
+	"""
+	CHUNK_SIZE = 65536
+	KILL_GRACE = 5
+
+	def __init__(self, wall_timeout=COMMAND_WALL_TIMEOUT, stall_timeout=COMMAND_STALL_TIMEOUT):
+		self.wall_timeout = wall_timeout
+		self.stall_timeout = stall_timeout
+		self.loop = None
+		self._thread = None
+		self._tasks = set() # il loop tiene solo riferimenti deboli ai task
+		self._lock = threading.Lock()
+
+	def _spawn(self, coro):
+		"""
+		Schedules coro on the engine loop, starting the loop on first use.
+		"""
+		with self._lock:
+			if self.loop is None:
+				self.loop = asyncio.new_event_loop()
+				self._thread = threading.Thread(target=self.loop.run_forever, name="command-engine", daemon=True)
+				self._thread.start()
+			self.loop.call_soon_threadsafe(self._start_task, coro)
+
+	def _start_task(self, coro):
+		task = self.loop.create_task(coro)
+		self._tasks.add(task)
+		task.add_done_callback(self._tasks.discard)
+
+	def run(self, cmd, stdin_data=None, wall_timeout=None, stall_timeout=None):
+		"""
+		Starts cmd through bash and returns its EngineCommand. stdin_data, if
+		given, is written to the command's stdin, which is then closed: a
+		command never waits on an input nobody will type.
+		"""
+		process = subprocess.Popen(cmd, shell=True, executable="/bin/bash", stdin=subprocess.DEVNULL if stdin_data is None else subprocess.PIPE,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+		if stdin_data is not None:
+			try:
+				process.stdin.write(stdin_data.encode("utf-8"))
+				process.stdin.close()
+			except BrokenPipeError:
+				pass
+		command = EngineCommand(process)
+		self._spawn(self._pump(command))
+		self.watch(command, wall_timeout, stall_timeout)
+		return command
+
+	def watch(self, command, wall_timeout=None, stall_timeout=None):
+		"""
+		Enforces the timeouts on a StreamedCommand; None means the engine default.
+		"""
+		wall = self.wall_timeout if wall_timeout is None else wall_timeout
+		stall = self.stall_timeout if stall_timeout is None else stall_timeout
+		if wall or stall:
+			self._spawn(self._watch(command, wall, stall))
+
+	async def _pump(self, command):
+		process = command.process
+		try:
+			reader = asyncio.StreamReader()
+			transport, _ = await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+			decoder = codecs.getincrementaldecoder("utf-8")("replace")
+			pending = ""
+			try:
+				while True:
+					chunk = await reader.read(self.CHUNK_SIZE)
+					if not chunk:
+						break
+					pending += decoder.decode(chunk)
+					*lines, pending = pending.split("\n")
+					for line in lines:
+						command.put({"line": line + "\n"})
+				pending += decoder.decode(b"", True)
+				if pending:
+					command.put({"line": pending})
+			finally:
+				transport.close()
+
+			# wait4 al posto del child watcher di asyncio, per avere anche le risorse usate
+			delay = 0.002
+			while True:
+				pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+				if pid:
+					break
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 0.05)
+			process.returncode = os.waitstatus_to_exitcode(status)
+			command.put({"exit": process.returncode, "rusage": rusage})
+		except ChildProcessError:
+			command.put({"exit": process.returncode if process.returncode is not None else -1})
+		except Exception as e:
+			command.put({"exit": None, "error": str(e)})
+
+	async def _watch(self, command, wall, stall):
+		interval = min([1.0] + [limit / 4 for limit in (wall, stall) if limit])
+		while not command.exited.is_set():
+			now = time.monotonic()
+			if wall and now - command.started > wall:
+				command.timed_out, command.timeout_limit = "wall", wall
+			elif stall and now - command.last_output > stall:
+				command.timed_out, command.timeout_limit = "stall", stall
+			else:
+				await asyncio.sleep(interval)
+				continue
+			command.signal(signal.SIGTERM)
+			deadline = time.monotonic() + self.KILL_GRACE
+			while not command.exited.is_set() and time.monotonic() < deadline:
+				await asyncio.sleep(0.05)
+			if not command.exited.is_set():
+				command.signal(signal.SIGKILL)
+			return
+
+	def close(self):
+		with self._lock:
+			if self.loop is None:
+				return
+			loop, self.loop = self.loop, None
+		def stop():
+			for task in list(self._tasks):
+				task.cancel()
+			loop.call_soon(loop.stop)
+		loop.call_soon_threadsafe(stop)
+		self._thread.join(timeout=5)
+
+# Helper privilegiato avviato una sola volta con sudo: riceve i comandi come righe
+# JSON sul proprio stdin ed esegue ognuno in un thread, restituendo su stdout
+# l'output riga per riga e infine il codice di uscita con le risorse usate.
+BROKER_SOURCE = r"""
+import json, os, subprocess, sys, threading
+
+out_lock = threading.Lock()
+processes = {}
+
+def send(message):
+	with out_lock:
+		sys.stdout.write(json.dumps(message) + "\n")
+		sys.stdout.flush()
+
+def run(request):
+	command_id = request["id"]
+	try:
+		process = subprocess.Popen(["/bin/bash", "-c", request["cmd"]], cwd=request.get("cwd") or None,
+			stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+	except OSError as e:
+		send({"id": command_id, "line": str(e) + "\n"})
+		send({"id": command_id, "exit": 127})
+		return
+	processes[command_id] = process
+	for raw in iter(process.stdout.readline, b""):
+		send({"id": command_id, "line": raw.decode("utf-8", "replace")})
+	process.stdout.close()
+	_, status, usage = os.wait4(process.pid, 0)
+	processes.pop(command_id, None)
+	send({"id": command_id, "exit": os.waitstatus_to_exitcode(status), "rusage": [usage.ru_utime, usage.ru_stime, usage.ru_maxrss]})
+
+send({"ready": True, "uid": os.getuid()})
+for line in sys.stdin:
+	try:
+		request = json.loads(line)
+	except ValueError:
+		continue
+	if "signal" in request:
+		process = processes.get(request["id"])
+		if process is not None:
+			try:
+				os.killpg(process.pid, request["signal"])
+			except OSError:
+				pass
+	elif "cmd" in request:
+		threading.Thread(target=run, args=(request,), daemon=True).start()
+"""
+
+class BrokerCommand(StreamedCommand):
+	"""
+	A command running inside the PrivilegedBroker.
+	"""
+	def __init__(self, broker, command_id):
+		super().__init__()
+		self.broker = broker
+		self.command_id = command_id
+
+	def signal(self, sig):
+		try:
+			self.broker.send({"id": self.command_id, "signal": sig})
+		except (OSError, ValueError, AttributeError):
+			pass
+
+class PrivilegedBroker:
+	"""
+	Long-lived privileged helper, authenticated once through sudo, that runs
+	the commands received over a pipe and streams back output and exit codes.
+	The sudo password is written only once, to sudo itself.
+	"""
+	START_TIMEOUT = 30
+
+	def __init__(self, sudo_binary=SUDO_BINARY):
+		self.sudo_binary = sudo_binary
+		self.process = None
+		self.commands = {}
+		self.next_id = 0
+		self.ready = threading.Event()
+		self.stderr_text = []
+		self._lock = threading.Lock()
+
+	def start(self, password=None):
+		"""
+		Starts the helper. Returns False if it can't be started, so that the
+		caller can fall back to one sudo per command; raises ValueError if
+		the password is wrong.
+		"""
+		cmd = [sys.executable, "-c", BROKER_SOURCE]
+		if os.getuid() != 0:
+			# Senza password sudo non deve mai mettersi in attesa di un input
+			cmd = [self.sudo_binary, "-S", "-p", ""] + cmd if password else [self.sudo_binary, "-n"] + cmd
+		try:
+			self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+		except OSError:
+			return False
+		threading.Thread(target=self._read_stdout, daemon=True).start()
+		threading.Thread(target=self._read_stderr, daemon=True).start()
+		if password and os.getuid() != 0:
+			self.process.stdin.write(password + "\n")
+			self.process.stdin.flush()
+
+		deadline = time.monotonic() + self.START_TIMEOUT
+		while not self.ready.wait(0.05):
+			errors = "".join(self.stderr_text).lower()
+			if "incorrect password" in errors or "try again" in errors:
+				self.process.kill()
+				raise ValueError("Incorrect sudo password provided.")
+			if self.process.poll() is not None or time.monotonic() > deadline:
+				self.process.kill()
+				return False
+		return True
+
+	def _read_stdout(self):
+		for line in self.process.stdout:
+			try:
+				message = json.loads(line)
+			except ValueError:
+				continue
+			if message.get("ready"):
+				self.ready.set()
+				continue
+			command = self.commands.get(message.get("id"))
+			if command is not None:
+				usage = message.get("rusage")
+				if usage:
+					message["rusage"] = types.SimpleNamespace(ru_utime=usage[0], ru_stime=usage[1], ru_maxrss=usage[2])
+				command.put(message)
+				if "exit" in message:
+					self.commands.pop(message["id"], None)
+		# Il broker è terminato: sblocca i comandi ancora in attesa
+		for command in list(self.commands.values()):
+			command.put({"exit": None, "error": "Il broker privilegiato è terminato durante il comando."})
+		self.commands.clear()
+
+	def _read_stderr(self):
+		for line in self.process.stderr:
+			self.stderr_text.append(line)
+
+	def send(self, message):
+		with self._lock:
+			self.process.stdin.write(json.dumps(message) + "\n")
+			self.process.stdin.flush()
+
+	def run(self, cmd):
+		"""
+		Starts a command as root and returns its BrokerCommand.
+		"""
+		with self._lock:
+			self.next_id += 1
+			command = BrokerCommand(self, self.next_id)
+			self.commands[command.command_id] = command
+		self.send({"id": command.command_id, "cmd": cmd, "cwd": os.getcwd()})
+		return command
+
+	def stop(self):
+		if self.process is None:
+			return
+		try:
+			self.process.stdin.close()
+			self.process.wait(timeout=10)
+		except (OSError, subprocess.TimeoutExpired):
+			self.process.kill()
+		self.process = None
+
+# Argomenti segreti delle righe di comando, es. --password='...' di make:filament-user
+SECRET_ARGUMENT_RE = re.compile(r"(--password[= ])('[^']*'|\S+)")
+
+def redact_secrets(text):
+	"""
+	Masks the secret arguments of a command line before it is logged or stored.
+	"""
+	return SECRET_ARGUMENT_RE.sub(r"\1***", text)
+
+class RunTrace:
+	"""
+	Records the steps and commands of a run as spans and exports them as a
+	Chrome trace (chrome://tracing, Perfetto) plus a JSON summary.
+	"""
+	def __init__(self):
+		self.origin = time.perf_counter()
+		self.started_at = time.time()
+		self.spans = []
+		self._threads = {}
+		self._lock = threading.Lock()
+
+	def now(self):
+		return time.perf_counter()
+
+	def record(self, category, name, start, end, **args):
+		"""
+		Stores a span; start and end come from now().
+		"""
+		with self._lock:
+			tid = self._threads.setdefault(threading.get_ident(), len(self._threads) + 1)
+			self.spans.append({
+				"category": category,
+				"name": name,
+				"start": start - self.origin,
+				"seconds": end - start,
+				"tid": tid,
+				"args": args
+			})
+
+	def record_command(self, cmd, start, exit_code, rusage, output_bytes, **args):
+		args.update({
+			"exit_code": exit_code,
+			"output_bytes": output_bytes,
+			"cpu_user_s": round(rusage.ru_utime, 3) if rusage else None,
+			"cpu_sys_s": round(rusage.ru_stime, 3) if rusage else None,
+			"max_rss_kb": rusage.ru_maxrss if rusage else None
+		})
+		# Trace e riepilogo finiscono su disco: il comando viene registrato senza segreti
+		self.record("command", redact_secrets(cmd), start, self.now(), **args)
+
+	def chrome_trace(self):
+		events = []
+		for span in self.spans:
+			events.append({
+				"name": span["name"],
+				"cat": span["category"],
+				"ph": "X",
+				"ts": round(span["start"] * 1e6),
+				"dur": round(span["seconds"] * 1e6),
+				"pid": os.getpid(),
+				"tid": span["tid"],
+				"args": span["args"]
+			})
+		return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+	def summary(self):
+		steps = [span for span in self.spans if span["category"] == "step"]
+		commands = [span for span in self.spans if span["category"] == "command"]
+		total_end = max((span["start"] + span["seconds"] for span in self.spans), default=0)
+		return {
+			"started_at": self.started_at,
+			"wall_seconds": round(total_end, 3),
+			"commands": len(commands),
+			"command_seconds": round(sum(span["seconds"] for span in commands), 3),
+			"child_cpu_seconds": round(sum((span["args"].get("cpu_user_s") or 0) + (span["args"].get("cpu_sys_s") or 0) for span in commands), 3),
+			"output_bytes": sum(span["args"].get("output_bytes") or 0 for span in commands),
+			"steps": [
+				{
+					"index": span["args"].get("index"),
+					"name": span["name"],
+					"status": span["args"].get("status"),
+					"seconds": round(span["seconds"], 3),
+					"commands": sum(1 for command in commands if command["args"].get("step") == span["args"].get("index"))
+				}
+				for span in sorted(steps, key=lambda span: span["start"])
+			],
+			"slowest_commands": [
+				{"command": span["name"], "seconds": round(span["seconds"], 3), "exit_code": span["args"].get("exit_code")}
+				for span in sorted(commands, key=lambda span: span["seconds"], reverse=True)[:10]
+			]
+		}
+
+	def export(self, trace_path, summary_path, extra=None):
+		"""
+		Writes the trace and the summary; extra is merged into the summary.
+		"""
+		os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+		with self._lock:
+			summary = self.summary()
+			summary.update(extra or {})
+			with open(trace_path, "w") as f:
+				json.dump(self.chrome_trace(), f)
+			with open(summary_path, "w") as f:
+				json.dump(summary, f, indent=2)
+
+# Intervallo (secondi) con cui le righe di log del worker vengono consegnate all'interfaccia
+LOG_FLUSH_INTERVAL = 0.1
+# Righe mantenute nella finestra di log; il log completo resta su disco
+LOG_MAX_LINES = 5000
+
+class LogPipeline:
+	"""
+	Buffers the log lines produced by the worker threads and delivers them to
+	the sink in timed batches, while appending the full log to disk.
+	emit(message, type) mirrors the signal it replaces.
+	"""
+	def __init__(self, sink, log_path=None, interval=LOG_FLUSH_INTERVAL):
+		self.sink = sink
+		self.log_path = log_path
+		self.interval = interval
+		self._pending = []
+		self._lock = threading.Lock()
+		self._stop_event = threading.Event()
+		self._thread = None
+		self._file = None
+		self.lines = 0
+		self.sink_seconds = 0.0
+
+	def start(self):
+		if self._thread is not None:
+			return
+		if self.log_path and self._file is None:
+			os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+			self._file = open(self.log_path, "a", encoding="utf-8")
+		self._stop_event.clear()
+		self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		"""
+		Stops the periodic flush and delivers the remaining lines.
+		"""
+		if self._thread is not None:
+			self._stop_event.set()
+			self._thread.join()
+			self._thread = None
+		self.flush()
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def _flush_loop(self):
+		while not self._stop_event.wait(self.interval):
+			self.flush()
+
+	def emit(self, message, message_type):
+		# I comandi eseguiti vengono registrati anche su disco: niente password in chiaro
+		message = redact_secrets(str(message))
+		with self._lock:
+			if self._file is not None:
+				self._file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{message_type}] {message}\n")
+			self._pending.append((message, message_type))
+			self.lines += 1
+		# Fuori dall'esecuzione del worker (es. kill_processes) le righe vengono consegnate subito
+		if self._thread is None:
+			self.flush()
+
+	def flush(self):
+		with self._lock:
+			batch, self._pending = self._pending, []
+			if self._file is not None:
+				self._file.flush()
+		if batch:
+			started = time.perf_counter()
+			self.sink(batch)
+			self.sink_seconds += time.perf_counter() - started
+
+class CommandHistory:
+	"""
+	Average duration of the commands of previous real runs, used to estimate
+	how long a dry-run plan will take. Commands never seen before are estimated
+	from the other commands of the same tool.
+	"""
+	# Dopo questo numero di campioni la media pesa di più le esecuzioni recenti
+	MAX_SAMPLES = 10
+
+	def __init__(self, path):
+		self.path = path
+		self.commands = {}
+		try:
+			with open(path, "r") as f:
+				self.commands = json.load(f).get("commands", {})
+		except (OSError, ValueError):
+			self.commands = {}
+
+	@classmethod
+	def key(cls, cmd):
+		return redact_secrets(" ".join(cmd.split()))
+
+	@staticmethod
+	def tool(cmd):
+		"""
+		Returns the tool of a command, e.g. "apt install" or "php artisan".
+		"""
+		# Ultimo comando di una catena "cd ... && ...", primo di una pipeline
+		segment = re.split(r"&&|;", cmd)[-1].split("|")[0]
+		words = [word.strip("'\"") for word in segment.split() if "=" not in word and word not in ("sudo", "-S")]
+		if not words:
+			return ""
+		name = os.path.basename(words[0])
+		if len(words) > 1 and not words[1].startswith("-"):
+			return f"{name} {words[1]}"
+		return name
+
+	def estimate(self, cmd):
+		"""
+		Returns (seconds, source) where source is "history", "tool" or None.
+		"""
+		entry = self.commands.get(self.key(cmd))
+		if entry:
+			return entry["seconds"], "history"
+		tool = self.tool(cmd)
+		similar = [entry["seconds"] for key, entry in self.commands.items() if tool and self.tool(key) == tool]
+		if similar:
+			return sum(similar) / len(similar), "tool"
+		return None, None
+
+	def update(self, spans):
+		"""
+		Adds the successful command spans of a RunTrace and saves the history.
+		"""
+		for span in spans:
+			if span["category"] != "command" or span["args"].get("exit_code") != 0:
+				continue
+			key = self.key(span["name"])
+			entry = self.commands.setdefault(key, {"seconds": 0.0, "samples": 0})
+			entry["samples"] = min(entry["samples"] + 1, self.MAX_SAMPLES)
+			entry["seconds"] += (span["seconds"] - entry["seconds"]) / entry["samples"]
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		tmp_path = f"{self.path}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump({"commands": self.commands}, f, indent=2, sort_keys=True)
+		os.replace(tmp_path, self.path)
+
+class CheckpointStore:
+	"""
+	Persists the completed setup steps together with the fingerprint of their
+	inputs, so that a new run can skip the steps that are still valid.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self._steps = {}
+		try:
+			with open(path, "r") as f:
+				self._steps = json.load(f).get("steps", {})
+		except (OSError, ValueError):
+			self._steps = {}
+
+	@staticmethod
+	def fingerprint(inputs):
+		data = json.dumps(inputs, sort_keys=True, default=str)
+		return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+	@staticmethod
+	def file_digest(path):
+		"""
+		Returns the SHA-256 of a file, or None if it doesn't exist.
+		"""
+		digest = hashlib.sha256()
+		try:
+			with open(path, "rb") as f:
+				for chunk in iter(lambda: f.read(65536), b""):
+					digest.update(chunk)
+		except OSError:
+			return None
+		return digest.hexdigest()
+
+	def _save(self):
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		tmp_path = f"{self.path}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump({"steps": self._steps}, f, indent=2, sort_keys=True)
+		os.replace(tmp_path, self.path)
+
+	def is_valid(self, key, fingerprint):
+		with self._lock:
+			entry = self._steps.get(key)
+			return entry is not None and entry.get("fingerprint") == fingerprint
+
+	def record(self, key, fingerprint):
+		with self._lock:
+			self._steps[key] = {"fingerprint": fingerprint, "completed_at": time.time()}
+			self._save()
+
+	def invalidate(self, key):
+		with self._lock:
+			if self._steps.pop(key, None) is not None:
+				self._save()
+
+	def clear(self):
+		with self._lock:
+			self._steps = {}
+			self._save()
+
+class EnvFile:
+	"""
+	Reads and edits a dotenv file in place, keeping comments, blank lines and
+	key order. Changes are applied in one pass and written atomically.
+	"""
+	ASSIGNMENT_RE = re.compile(r"^(\s*(?:export\s+)?)([A-Za-z_][A-Za-z0-9_.]*)(\s*=\s*)(.*)$")
+	# Valori che possono essere scritti senza virgolette
+	PLAIN_VALUE_RE = re.compile(r"^[A-Za-z0-9_./:@,+=-]*$")
+	# Segnaposto commentato, es. "# DB_HOST=127.0.0.1" di .env.example
+	COMMENTED_RE = re.compile(r"^\s*#\s*([A-Za-z_][A-Za-z0-9_.]*)\s*=")
+
+	def __init__(self, path, template=None):
+		self.path = path
+		self.lines = []
+		self.created = False
+		self.stat = None
+		source = path if os.path.exists(path) or template is None else template
+		try:
+			with open(source, "r") as f:
+				self.lines = f.read().splitlines()
+			self.stat = os.stat(source)
+		except FileNotFoundError:
+			self.lines = []
+		self.created = source != path
+
+	@staticmethod
+	def quote(value):
+		value = str(value)
+		if EnvFile.PLAIN_VALUE_RE.match(value):
+			return value
+		# Tra apici singoli il valore è letterale (niente interpolazione di ${...})
+		if "'" not in value and "\n" not in value:
+			return f"'{value}'"
+		escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$").replace("\n", "\\n")
+		return f'"{escaped}"'
+
+	@staticmethod
+	def unquote(raw):
+		raw = raw.strip()
+		if len(raw) >= 2 and raw[0] == raw[-1] == "'":
+			return raw[1:-1]
+		if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+			return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), raw[1:-1])
+		# Commento in coda a un valore senza virgolette
+		return re.split(r"\s+#", raw, maxsplit=1)[0]
+
+	def values(self, keys=None):
+		"""
+		Returns the current values, optionally only for the given keys.
+		"""
+		result = {}
+		for line in self.lines:
+			match = self.ASSIGNMENT_RE.match(line)
+			if match and (keys is None or match.group(2) in keys):
+				result[match.group(2)] = self.unquote(match.group(4))
+		return result
+
+	def update(self, changes):
+		"""
+		Applies a dictionary of changes and returns the keys whose value
+		actually changed. A missing key replaces its commented placeholder in
+		place (as sed did), otherwise it is appended at the end.
+		"""
+		pending = dict(changes)
+		changed = []
+		for i, line in enumerate(self.lines):
+			match = self.ASSIGNMENT_RE.match(line)
+			if not match or match.group(2) not in pending:
+				continue
+			key = match.group(2)
+			value = str(pending.pop(key))
+			if self.unquote(match.group(4)) != value:
+				self.lines[i] = f"{match.group(1)}{key}{match.group(3)}{self.quote(value)}"
+				changed.append(key)
+		for i, line in enumerate(self.lines):
+			match = self.COMMENTED_RE.match(line)
+			if match and match.group(1) in pending:
+				key = match.group(1)
+				self.lines[i] = f"{key}={self.quote(pending.pop(key))}"
+				changed.append(key)
+		for key, value in pending.items():
+			self.lines.append(f"{key}={self.quote(value)}")
+			changed.append(key)
+		return changed
+
+	def save(self):
+		"""
+		Writes the file through a temporary file and a rename, keeping the
+		owner and permissions of the original (or of the template).
+		"""
+		directory = os.path.dirname(os.path.abspath(self.path))
+		fd, tmp_path = tempfile.mkstemp(prefix=".env.", dir=directory)
+		try:
+			with os.fdopen(fd, "w") as f:
+				f.write("\n".join(self.lines) + "\n")
+				f.flush()
+				os.fsync(f.fileno())
+			if self.stat is not None:
+				os.chmod(tmp_path, self.stat.st_mode & 0o7777)
+				if os.getuid() == 0:
+					os.chown(tmp_path, self.stat.st_uid, self.stat.st_gid)
+			os.replace(tmp_path, self.path)
+		except BaseException:
+			try:
+				os.unlink(tmp_path)
+			except OSError:
+				pass
+			raise
+		self.created = False
+
+class ReadinessProbe:
+	"""
+	Waits until a dependency is ready. Every check must pass in the same
+	attempt; checks are polled with a tight exponential backoff up to a
+	deadline, so that a step goes on as soon as the dependency answers.
+	A check returns None when it passes, otherwise the reason it failed.
+	"""
+	def __init__(self, name, checks, timeout=60, initial_delay=0.02, max_delay=1.0):
+		self.name = name
+		self.checks = checks
+		self.timeout = timeout
+		self.initial_delay = initial_delay
+		self.max_delay = max_delay
+		self.attempts = 0
+
+	def wait(self, should_stop=None):
+		"""
+		Returns (ready, seconds waited, last failure reason).
+		"""
+		started = time.monotonic()
+		deadline = started + self.timeout
+		delay = self.initial_delay
+		self.attempts = 0
+		while True:
+			self.attempts += 1
+			error = None
+			for check in self.checks:
+				error = check()
+				if error is not None:
+					break
+			now = time.monotonic()
+			if error is None:
+				return True, now - started, None
+			if now >= deadline or (should_stop and should_stop()):
+				return False, now - started, error
+			time.sleep(min(delay, deadline - now))
+			delay = min(delay * 2, self.max_delay)
+
+	@staticmethod
+	def unix_socket(path):
+		def check():
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+				sock.settimeout(1)
+				try:
+					sock.connect(path)
+				except OSError as e:
+					return f"{path}: {e.strerror or e}"
+			return None
+		return check
+
+	@staticmethod
+	def http(url):
+		def check():
+			try:
+				with urllib.request.urlopen(url, timeout=2) as response:
+					status = response.status
+			except urllib.error.HTTPError as e:
+				status = e.code
+			except (OSError, ValueError) as e:
+				return f"{url}: {getattr(e, 'reason', None) or e}"
+			# Anche un 404 dimostra che il server risponde
+			return None if status < 500 else f"{url}: HTTP {status}"
+		return check
+
+	@staticmethod
+	def command(run, description):
+		"""
+		A check passing when run() returns True, e.g. a SQL "SELECT 1".
+		"""
+		return lambda: None if run() else f"{description} non riuscito"
+
+# Log dei servizi ruotati oltre questa dimensione, conservando SERVICE_LOG_BACKUPS copie
+SERVICE_LOG_MAX_BYTES = int(os.environ.get("SETUP_SERVICE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SERVICE_LOG_BACKUPS = 3
+# Un worker fermo (nessun job in corso) senza output da questo numero di secondi, mentre ci sono
+# job pronti e non riservati, è considerato bloccato
+QUEUE_HEARTBEAT_TIMEOUT = float(os.environ.get("SETUP_QUEUE_HEARTBEAT_TIMEOUT", "300"))
+# Ultima riga di queue:work per un job ancora in corso (Laravel 9+: "... RUNNING", prima "Processing:")
+QUEUE_JOB_RUNNING_RE = re.compile(r"(?:\bRUNNING\s*$|\bProcessing:)")
+# Pool di worker della coda: 0 = uno per core disponibile; ogni worker viene riciclato
+# oltre QUEUE_WORKER_MEMORY_MB di memoria o dopo QUEUE_WORKER_MAX_JOBS job
+QUEUE_WORKERS = int(get_cli_option("--queue-workers", os.environ.get("SETUP_QUEUE_WORKERS", "0")))
+QUEUE_WORKER_MEMORY_MB = int(os.environ.get("SETUP_QUEUE_WORKER_MEMORY", "256"))
+QUEUE_WORKER_MAX_JOBS = int(os.environ.get("SETUP_QUEUE_WORKER_MAX_JOBS", "1000"))
+QUEUE_REPORT_INTERVAL = 10
+# Righe di queue:work per un job concluso (Laravel 9+: "... DONE"/"... FAIL", prima "Processed:"/"Failed:")
+QUEUE_JOB_DONE_RE = re.compile(rb"(?:\bDONE[ \t\r]*$|\bProcessed:)", re.MULTILINE)
+QUEUE_JOB_FAILED_RE = re.compile(rb"(?:\bFAIL[ \t\r]*$|\bFailed:)", re.MULTILINE)
+
+def queue_pool_size(requested=QUEUE_WORKERS, memory_mb=QUEUE_WORKER_MEMORY_MB):
+	"""
+	Returns how many queue workers to run: the requested count, or one per
+	core available to the process, as long as that many workers at their
+	memory limit fit in half of the RAM.
+	"""
+	if requested > 0:
+		return requested
+	try:
+		cores = len(os.sched_getaffinity(0))
+	except AttributeError:
+		cores = os.cpu_count() or 1
+	try:
+		ram_mb = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+	except (AttributeError, ValueError, OSError):
+		return cores
+	return max(1, min(cores, ram_mb // 2 // memory_mb))
+
+class QueueMonitor:
+	"""
+	Measures the throughput of the queue workers by counting the jobs they
+	log as done or failed, together with the backlog of the jobs table, and
+	reports it through on_report while there is something to report.
+	"""
+	def __init__(self, log_paths, backlog, on_report):
+		self.log_paths = log_paths
+		self.backlog = backlog
+		self.on_report = on_report
+		self.offsets = {}
+		for path in log_paths:
+			try:
+				self.offsets[path] = os.path.getsize(path)
+			except OSError:
+				self.offsets[path] = 0
+		self.started = self.last_sample = time.monotonic()
+		self.done = 0
+		self.failed = 0
+		self.last = None
+
+	def _read_new(self, path):
+		"""
+		Returns the jobs done and failed logged since the previous sample. A
+		log smaller than the last offset has been rotated: the rest of it is
+		read from its first backup, then the log again from the start.
+		"""
+		rotated = b""
+		try:
+			with open(path, "rb") as log:
+				size = os.fstat(log.fileno()).st_size
+				offset = self.offsets.get(path, 0)
+				if size < offset:
+					with contextlib.suppress(OSError), open(f"{path}.1", "rb") as backup:
+						backup.seek(offset)
+						rotated = backup.read()
+					offset = 0
+				log.seek(offset)
+				data = log.read(size - offset)
+		except OSError:
+			return 0, 0
+		# Solo righe complete: il resto viene letto al prossimo campione
+		complete = data.rfind(b"\n") + 1
+		self.offsets[path] = offset + complete
+		data = rotated + data[:complete]
+		return len(QUEUE_JOB_DONE_RE.findall(data)), len(QUEUE_JOB_FAILED_RE.findall(data))
+
+	def sample(self):
+		now = time.monotonic()
+		done = failed = 0
+		for path in self.log_paths:
+			path_done, path_failed = self._read_new(path)
+			done += path_done
+			failed += path_failed
+		elapsed = max(now - self.last_sample, 1e-6)
+		self.last_sample = now
+		self.done += done
+		self.failed += failed
+		backlog = self.backlog()
+		self.last = {
+			"workers": len(self.log_paths),
+			"jobs_per_second": round((done + failed) / elapsed, 2),
+			"backlog": backlog,
+			"done": self.done,
+			"failed": self.failed,
+			"average_jobs_per_second": round((self.done + self.failed) / max(now - self.started, 1e-6), 2)
+		}
+		# Coda ferma e vuota: nessun messaggio
+		if done or failed or backlog:
+			waiting = "?" if backlog is None else backlog
+			self.on_report(f"📊 Coda: {self.last['jobs_per_second']:.2f} job/s ({done} completati, {failed} falliti), "
+				f"{waiting} in attesa, {len(self.log_paths)} worker.", "info")
+		return self.last
+
+class SupervisedService:
+	"""
+	A long-running service of the ServiceSupervisor and its restart state.
+	health is a ReadinessProbe-style check; restart is "always",
+	"on-failure" (a clean exit ends the service) or "recycle" (a clean exit
+	is a planned recycle and the service starts again at once). unsupervised_cmd,
+	if given, replaces cmd when the supervisor detaches, for services that
+	can't be left running without it.
+	"""
+	def __init__(self, name, cmd, log_path, health=None, restart="always", unsupervised_cmd=None):
+		self.name = name
+		self.cmd = cmd
+		self.unsupervised_cmd = unsupervised_cmd
+		self.log_path = log_path
+		self.health = health
+		self.restart = restart
+		self.process = None
+		self.started_at = None
+		self.healthy = False
+		self.failures = 0
+		self.restarts = 0
+		self.recycles = 0
+		self.backoff = ServiceSupervisor.INITIAL_BACKOFF
+		self.next_start = 0.0
+		self.finished = False
+
+class ServiceSupervisor:
+	"""
+	Runs long-running services in their own process groups and keeps track
+	of their real PIDs. Services that exit or keep failing their health
+	check are restarted with exponential backoff, their logs are rotated by
+	size, and stop() shuts them down in reverse start order.
+	"""
+	CHECK_INTERVAL = 2
+	STARTUP_GRACE = 30
+	HEALTH_FAILURES = 3
+	INITIAL_BACKOFF = 1
+	MAX_BACKOFF = 60
+	STABLE_UPTIME = 60
+	MIN_RECYCLE_UPTIME = 5
+	STOP_GRACE = 10
+
+	def __init__(self, cwd, user=None, on_event=None, log_max_bytes=SERVICE_LOG_MAX_BYTES, log_backups=SERVICE_LOG_BACKUPS):
+		self.cwd = cwd
+		self.user = user
+		self.on_event = on_event or (lambda message, message_type: None)
+		self.log_max_bytes = log_max_bytes
+		self.log_backups = log_backups
+		self.services = []
+		self.reporters = []
+		self._lock = threading.Lock()
+		self._stop_event = threading.Event()
+		self._thread = None
+
+	def add(self, service):
+		self.services.append(service)
+
+	def add_reporter(self, report, interval):
+		"""
+		Calls report() from the monitor every interval seconds while supervising.
+		"""
+		self.reporters.append({"report": report, "interval": interval, "due": time.monotonic() + interval})
+
+	def start(self):
+		for service in self.services:
+			self._spawn(service)
+		self._thread = threading.Thread(target=self._monitor, name="service-supervisor", daemon=True)
+		self._thread.start()
+
+	def _spawn(self, service):
+		"""
+		Starts a service with its output appended to its log. exec makes the
+		PID the service itself rather than a wrapper shell.
+		"""
+		kwargs = {}
+		if self.user is not None and os.getuid() == 0 and self.user.pw_uid != 0:
+			kwargs = {
+				"user": self.user.pw_uid,
+				"group": self.user.pw_gid,
+				"extra_groups": os.getgrouplist(self.user.pw_name, self.user.pw_gid),
+				"env": dict(os.environ, HOME=self.user.pw_dir, USER=self.user.pw_name, LOGNAME=self.user.pw_name)
+			}
+		try:
+			os.makedirs(os.path.dirname(service.log_path), exist_ok=True)
+			# O_APPEND: dopo una rotazione il servizio continua a scrivere in fondo al file troncato
+			with open(service.log_path, "ab") as log:
+				if "user" in kwargs:
+					os.chown(service.log_path, self.user.pw_uid, self.user.pw_gid)
+				service.process = subprocess.Popen(["/bin/bash", "-c", f"exec {service.cmd}"], cwd=self.cwd, stdin=subprocess.DEVNULL,
+					stdout=log, stderr=subprocess.STDOUT, start_new_session=True, **kwargs)
+		except OSError as e:
+			self.on_event(f"❌ Impossibile avviare {service.name}: {e}", "error")
+			service.process = None
+			self._schedule_restart(service)
+			return
+		service.started_at = time.monotonic()
+		service.healthy = False
+		service.failures = 0
+		self.on_event(f"▶️ {service.name} avviato (PID {service.process.pid}): {service.cmd}", "info")
+
+	def _schedule_restart(self, service):
+		service.next_start = time.monotonic() + service.backoff
+		service.backoff = min(service.backoff * 2, self.MAX_BACKOFF)
+
+	def _monitor(self):
+		while not self._stop_event.wait(self.CHECK_INTERVAL):
+			with self._lock:
+				if self._stop_event.is_set():
+					return
+				for service in self.services:
+					self._check(service)
+				# I report leggono i log prima che vengano ruotati
+				self._report()
+				for service in self.services:
+					self._rotate(service)
+
+	def _report(self):
+		now = time.monotonic()
+		for reporter in self.reporters:
+			if now < reporter["due"]:
+				continue
+			reporter["due"] = now + reporter["interval"]
+			try:
+				reporter["report"]()
+			except Exception as e:
+				self.on_event(f"Report dei servizi non riuscito: {e}", "warning")
+
+	def _check(self, service):
+		now = time.monotonic()
+		if service.finished:
+			return
+		if service.process is None:
+			if now >= service.next_start:
+				service.restarts += 1
+				self._spawn(service)
+			return
+
+		code = service.process.poll()
+		if code is not None:
+			uptime = now - service.started_at
+			service.process = None
+			if code == 0 and service.restart == "on-failure":
+				service.finished = True
+				self.on_event(f"⏹️ {service.name} terminato dopo {uptime:.0f} s.", "info")
+				return
+			# Riciclo pianificato (es. --max-jobs o --memory): riparte subito, ma non in un ciclo stretto
+			if code == 0 and service.restart == "recycle" and uptime >= self.MIN_RECYCLE_UPTIME:
+				service.recycles += 1
+				service.backoff = self.INITIAL_BACKOFF
+				self.on_event(f"♻️ {service.name} riciclato dopo {uptime:.0f} s.", "info")
+				self._spawn(service)
+				return
+			# Un servizio rimasto in piedi a lungo riparte subito
+			if uptime >= self.STABLE_UPTIME:
+				service.backoff = self.INITIAL_BACKOFF
+			self.on_event(f"💥 {service.name} terminato con codice {code} dopo {uptime:.0f} s: riavvio tra {service.backoff:.0f} s.", "warning")
+			self._schedule_restart(service)
+			return
+
+		if service.health is None:
+			return
+		error = service.health()
+		if error is None:
+			service.healthy = True
+			service.failures = 0
+			return
+		# All'avvio il servizio ha tempo per diventare pronto
+		if not service.healthy and now - service.started_at < self.STARTUP_GRACE:
+			return
+		service.failures += 1
+		if service.failures >= self.HEALTH_FAILURES:
+			self.on_event(f"🩺 {service.name} non risponde ({error}): riavvio.", "warning")
+			self._terminate(service)
+
+	def _terminate(self, service):
+		"""
+		Stops the process group of a service: SIGTERM, then SIGKILL after STOP_GRACE.
+		"""
+		self._terminate_all([service])
+
+	def _terminate_all(self, services):
+		"""
+		Sends SIGTERM to the process groups of the given services in order,
+		waits for all of them against one shared STOP_GRACE deadline, then
+		SIGKILLs the survivors. Returns the services that were still running.
+		"""
+		stopping = []
+		for service in services:
+			process = service.process
+			if process is None or process.poll() is not None:
+				continue
+			with contextlib.suppress(OSError):
+				os.killpg(process.pid, signal.SIGTERM)
+			stopping.append(service)
+		deadline = time.monotonic() + self.STOP_GRACE
+		for service in stopping:
+			try:
+				service.process.wait(timeout=max(0, deadline - time.monotonic()))
+			except subprocess.TimeoutExpired:
+				with contextlib.suppress(OSError):
+					os.killpg(service.process.pid, signal.SIGKILL)
+		# Raccoglie anche i processi terminati con SIGKILL
+		for service in stopping:
+			service.process.wait()
+		return stopping
+
+	def _rotate(self, service):
+		try:
+			if os.path.getsize(service.log_path) < self.log_max_bytes:
+				return
+			for index in range(self.log_backups - 1, 0, -1):
+				if os.path.exists(f"{service.log_path}.{index}"):
+					os.replace(f"{service.log_path}.{index}", f"{service.log_path}.{index + 1}")
+			# Copia e troncamento: il servizio mantiene aperto lo stesso file
+			shutil.copyfile(service.log_path, f"{service.log_path}.1")
+			with open(service.log_path, "r+b") as log:
+				log.truncate(0)
+		except OSError as e:
+			self.on_event(f"Impossibile ruotare {service.log_path}: {e}", "warning")
+
+	def running(self, name):
+		"""
+		Tells whether the named service currently has a live process.
+		"""
+		for service in self.services:
+			if service.name == name:
+				return service.process is not None and service.process.poll() is None
+		return False
+
+	def status(self):
+		now = time.monotonic()
+		return [{
+			"name": service.name,
+			"pid": service.process.pid if service.process else None,
+			"running": service.process is not None and service.process.poll() is None,
+			"healthy": service.healthy,
+			"restarts": service.restarts,
+			"recycles": service.recycles,
+			"uptime_seconds": round(now - service.started_at) if service.process else 0
+		} for service in self.services]
+
+	def _end_monitor(self):
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join()
+
+	def detach(self):
+		"""
+		Stops supervising and leaves the services running on their own. The
+		services with an unsupervised_cmd are asked to stop with SIGTERM (which
+		lets them finish their current work) and, once they have all exited,
+		replaced by that command, so the two never run side by side.
+		"""
+		self._end_monitor()
+		with self._lock:
+			# Anche un servizio in attesa di riavvio viene sostituito
+			replaced = [service for service in self.services if service.unsupervised_cmd is not None and not service.finished]
+			self._terminate_all(replaced)
+			for service in replaced:
+				service.cmd = service.unsupervised_cmd
+				self._spawn(service)
+
+	def stop(self):
+		"""
+		Stops supervising and shuts the services down in reverse start order,
+		waiting at most STOP_GRACE for all of them together.
+		"""
+		self._end_monitor()
+		with self._lock:
+			for service in self._terminate_all(list(reversed(self.services))):
+				self.on_event(f"⏹️ {service.name} (PID {service.process.pid}) arrestato.", "info")
+			for service in self.services:
+				service.process = None
+				service.finished = True
+
+class Prefetcher:
+	"""
+	Runs downloads needed by later steps in the background, so that network
+	and package-manager work overlap. A task starts as soon as the steps (or
+	other tasks) it depends on are done; consumers call get(), which waits for
+	a task already in flight and returns None if it failed or never started.
+	"""
+	def __init__(self, max_workers=2):
+		self._pool = ThreadPoolExecutor(max_workers=max_workers)
+		self._lock = threading.Lock()
+		self._tasks = {}
+		self._done = set()
+		self.stopping = threading.Event()
+
+	def add(self, name, func, after=()):
+		with self._lock:
+			self._tasks[name] = {"func": func, "after": set(after), "future": None}
+		self._start_ready()
+
+	def step_done(self, key):
+		"""
+		Marks a step index (or a task name) as done and starts the tasks waiting for it.
+		"""
+		with self._lock:
+			self._done.add(key)
+		self._start_ready()
+
+	def _start_ready(self):
+		with self._lock:
+			if self.stopping.is_set():
+				return
+			ready = [(name, task) for name, task in self._tasks.items() if task["future"] is None and task["after"] <= self._done]
+			for name, task in ready:
+				task["future"] = self._pool.submit(self._run, name, task["func"])
+
+	def _run(self, name, func):
+		try:
+			return func()
+		finally:
+			self.step_done(name)
+
+	def get(self, name, timeout=None):
+		with self._lock:
+			task = self._tasks.get(name)
+		if task is None or task["future"] is None:
+			return None
+		try:
+			return task["future"].result(timeout=timeout)
+		except Exception:
+			return None
+
+	def shutdown(self):
+		"""
+		Cancels the tasks not started yet and waits for the running ones, which
+		can watch stopping to end early, so that no download outlives the run.
+		"""
+		self.stopping.set()
+		self._pool.shutdown(wait=True, cancel_futures=True)
+
+class CommandPlan:
+	"""
+	Keeps track of the commands planned in a run: idempotent commands run only
+	once, and the subprocesses dropped or fused are counted, together with the
+	seconds saved (measured on the execution that was kept).
+	"""
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._done = {}
+		self.saved_processes = 0
+		self.saved_seconds = 0.0
+		self.notes = []
+
+	def once(self, key, func, processes=1):
+		"""
+		Runs func the first time key is planned; later calls are dropped.
+		"""
+		with self._lock:
+			if key in self._done:
+				self._save(key, processes, self._done[key])
+				return False
+			self._done[key] = 0.0
+		started = time.monotonic()
+		try:
+			return func()
+		finally:
+			with self._lock:
+				self._done[key] = time.monotonic() - started
+
+	def skipped(self, key, processes, seconds=0.0):
+		"""
+		Records commands that were dropped because they are not needed.
+		"""
+		with self._lock:
+			self._save(key, processes, seconds)
+
+	def _save(self, key, processes, seconds):
+		self.saved_processes += processes
+		self.saved_seconds += seconds
+		self.notes.append({"command": key, "processes": processes, "seconds": round(seconds, 3)})
+
+	def summary(self):
+		with self._lock:
+			return {"saved_processes": self.saved_processes, "saved_seconds": round(self.saved_seconds, 3), "saved": list(self.notes)}
+
+# Esegue più comandi artisan avviando Laravel una sola volta. Ogni argomento è
+# un comando; quelli che terminano con "?" sono opzionali. Si ferma al primo
+# comando non opzionale che fallisce.
+ARTISAN_BATCH_SOURCE = r"""
+$started = microtime(true);
+require getcwd() . "/vendor/autoload.php";
+$app = require getcwd() . "/bootstrap/app.php";
+$kernel = $app->make(Illuminate\Contracts\Console\Kernel::class);
+$kernel->bootstrap();
+echo "Laravel avviato in " . round((microtime(true) - $started) * 1000) . " ms\n";
+$output = new Symfony\Component\Console\Output\ConsoleOutput();
+foreach (array_slice($argv, 1) as $argument) {
+	$optional = substr($argument, -1) === "?";
+	$command = rtrim($argument, "?");
+	echo "> php artisan $command\n";
+	try {
+		$status = $kernel->call($command, [], $output);
+	} catch (Throwable $e) {
+		echo $e->getMessage() . "\n";
+		$status = 1;
+	}
+	if ($status !== 0 && !$optional) {
+		exit($status);
+	}
+}
+"""
+ARTISAN_BOOT_RE = re.compile(r"Laravel avviato in (\d+) ms")
+
+# Ripara la proprietà di un albero (argomenti: uid gid percorso) cambiando solo le
+# voci con uid o gid diversi. Le cartelle di uno stesso livello vengono lette in
+# parallelo con os.scandir; alla fine stampa i conteggi come riga JSON.
+OWNERSHIP_REPAIR_SOURCE = r"""
+import json, os, sys
+from concurrent.futures import ThreadPoolExecutor
+
+uid, gid, root = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+MAX_REPORTED_ERRORS = 20
+counts = {"scanned": 0, "changed": 0, "errors": 0}
+
+def repair(path, st):
+	if st.st_uid == uid and st.st_gid == gid:
+		return 0, None
+	try:
+		os.chown(path, uid, gid, follow_symlinks=False)
+		return 1, None
+	except OSError as e:
+		return 0, f"{path}: {e.strerror}"
+
+def scan(directory):
+	subdirs, scanned, changed, errors = [], 0, 0, []
+	try:
+		with os.scandir(directory) as entries:
+			for entry in entries:
+				scanned += 1
+				try:
+					fixed, error = repair(entry.path, entry.stat(follow_symlinks=False))
+					if entry.is_dir(follow_symlinks=False):
+						subdirs.append(entry.path)
+				except OSError as e:
+					fixed, error = 0, f"{entry.path}: {e.strerror}"
+				changed += fixed
+				if error:
+					errors.append(error)
+	except OSError as e:
+		errors.append(f"{directory}: {e.strerror}")
+	return subdirs, scanned, changed, errors
+
+def add(scanned, changed, errors):
+	for error in errors:
+		if counts["errors"] < MAX_REPORTED_ERRORS:
+			print(error)
+		counts["errors"] += 1
+	counts["scanned"] += scanned
+	counts["changed"] += changed
+
+fixed, error = repair(root, os.lstat(root))
+add(1, fixed, [error] if error else [])
+level = [root]
+with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+	while level:
+		next_level = []
+		for subdirs, scanned, changed, errors in pool.map(scan, level):
+			next_level.extend(subdirs)
+			add(scanned, changed, errors)
+		level = next_level
+print(json.dumps(counts))
+sys.exit(1 if counts["errors"] else 0)
+"""
+
+class StepScheduler:
+	"""
+	Runs setup steps according to their declared dependencies and resources.
+	Steps that are ready and don't compete for the same resource run in parallel
+	on a bounded thread pool.
+	"""
+	# Quante istanze di ogni risorsa possono essere usate contemporaneamente.
+	# Le risorse non elencate sono esclusive (capacità 1).
+	DEFAULT_CAPACITIES = {
+		"network": 2,
+	}
+
+	def __init__(self, max_workers=3, capacities=None):
+		self.max_workers = max_workers
+		self.capacities = dict(self.DEFAULT_CAPACITIES)
+		if capacities:
+			self.capacities.update(capacities)
+		self.steps = {}
+		self.order = []
+		self.failed_step = None
+
+	def add(self, index, func, deps=(), resources=()):
+		"""
+		Registers a step. func is called without arguments.
+		"""
+		self.steps[index] = (func, tuple(deps), tuple(resources))
+		self.order.append(index)
+
+	def _capacity(self, resource):
+		return self.capacities.get(resource, 1)
+
+	def run(self, should_stop=lambda: False):
+		"""
+		Executes all the registered steps and returns the set of completed ones.
+		The first exception raised by a step stops the scheduling of new steps
+		and is re-raised once the running ones have finished.
+		"""
+		for index in self.order:
+			for dep in self.steps[index][1]:
+				if dep not in self.steps:
+					raise ValueError(f"Il passaggio {index} dipende da un passaggio inesistente: {dep}")
+
+		done = set()
+		pending = list(self.order)
+		running = {}
+		in_use = {}
+		error = None
+
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			while pending or running:
+				if error is None and not should_stop():
+					for index in list(pending):
+						if len(running) >= self.max_workers:
+							break
+						func, deps, resources = self.steps[index]
+						if not all(dep in done for dep in deps):
+							continue
+						if any(in_use.get(res, 0) >= self._capacity(res) for res in resources):
+							continue
+						for res in resources:
+							in_use[res] = in_use.get(res, 0) + 1
+						pending.remove(index)
+						running[pool.submit(func)] = index
+
+				if not running:
+					if pending and error is None and not should_stop():
+						raise RuntimeError(f"Dipendenze circolari tra i passaggi: {pending}")
+					break
+
+				finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+				for future in finished:
+					index = running.pop(future)
+					for res in self.steps[index][2]:
+						in_use[res] -= 1
+					exc = future.exception()
+					if exc is not None:
+						if error is None:
+							error = exc
+							self.failed_step = index
+					else:
+						done.add(index)
+
+		if error is not None:
+			raise error
+		return done
+
 class Worker(QThread):
 	"""
 	Worker thread to run the setup in the background.
 	This prevents the user interface from freezing.
 	"""
 	progress_updated = pyqtSignal(int)
-	log_message = pyqtSignal(str, str) # (message, type)
+	log_batch = pyqtSignal(list) # [(message, type), ...], consegnate da LogPipeline
 	finished = pyqtSignal(bool)
 	step_status_updated = pyqtSignal(int, str) # (step_index, status_type)
 
@@ -323,13 +2725,117 @@ class Worker(QThread):
 		"Avvio server e coda..."
 	]
 
+	# Grafo dei passaggi: (metodo, argomenti, dipendenze, risorse).
+	# Le dipendenze sono indici di STEPS; le risorse indicano cosa il passaggio
+	# tiene occupato: "pm" (lock del gestore pacchetti), "network", "project"
+	# (cartella del progetto) e "db" (server MariaDB).
+	STEP_GRAPH = [
+		("fix_package_manager_lock", ("pm",), [], ["pm"]),
+		("update_packages", ("pm", "distro"), [0], ["pm", "network"]),
+		("install_php_and_extensions", ("pm",), [1], ["pm", "network"]),
+		("install_nodejs", ("pm",), [1], ["pm", "network"]),
+		("install_composer", ("pm",), [2], ["pm", "network"]),
+		("install_git", ("pm",), [1], ["pm", "network"]),
+		("install_mysql", ("pm", "distro"), [1], ["pm", "network", "db"]),
+		("clean_packages", ("pm",), [2, 3, 4, 5, 6], ["pm"]),
+		("configure_database", ("pm",), [6], ["db"]),
+		("clone_project", (), [5], ["network", "project"]),
+		("fix_permissions", (), [9], ["project"]),
+		("install_dependencies", (), [2, 3, 4, 10], ["network", "project"]),
+		("configure_laravel", (), [8, 11], ["project", "db"]),
+		("configure_filament", (), [12], ["project"]),
+		("configure_cron", ("pm",), [1], ["pm"]),
+		("start_services", (), [13, 14], ["project"]),
+	]
+
+	# Numero massimo di passaggi eseguiti contemporaneamente
+	MAX_PARALLEL_STEPS = 3
+
+	# Risposte necessarie al setup, raccolte prima dell'avvio: (chiave, titolo, etichetta, default, password)
+	INPUT_PROMPTS = [
+		("panel_id", "Configurazione Filament", "Inserisci l'ID del pannello Filament:", "admin", False),
+		("admin_name", "Crea Utente Amministratore", "Nome utente per l'amministratore:", "admin", False),
+		("admin_email", "Crea Utente Amministratore", "Email per l'amministratore:", "admin@example.com", False),
+		("admin_password", "Crea Utente Amministratore", "Password per l'amministratore:", "", True)
+	]
+
+	# Passaggi che vengono eseguiti a ogni avvio, anche se già completati
+	ALWAYS_RUN_STEPS = ["start_services"]
+
+	# Comandi che sbloccano il gestore pacchetti, eseguiti una sola volta per run
+	PACKAGE_LOCK_COMMANDS = {
+		"apt": [
+			("rm -f /var/lib/dpkg/lock-frontend", "dpkg lock removed."),
+			("rm -f /var/lib/dpkg/lock", "dpkg lock removed."),
+			("rm -f /var/cache/apt/archives/lock", "apt lock removed."),
+			("dpkg --configure -a", "dpkg configured."),
+		],
+		"zypper": [
+			("rm -f /var/lib/rpm/.rpm.lock", "RPM lock removed."),
+			("rpm --rebuilddb", "RPM database rebuilt."),
+			("zypper clean --all", "Zypper cache cleaned."),
+		],
+		"dnf": [
+			("dnf clean all", "dnf cache cleaned."),
+		],
+		"pacman": [
+			("rm -f /var/lib/pacman/db.lck", "pacman lock removed."),
+		],
+		"pkg": [
+			("rm -f /var/db/pkg/lock", "pkg lock removed."),
+			("pkg-static -f install -y", "pkg issues resolved."),
+		],
+	}
+
+	# Pacchetti Composer richiesti dal progetto oltre a quelli del composer.json
+	COMPOSER_EXTRA_PACKAGES = ["symfony/dom-crawler"]
+
+	# Valori scritti nel file .env del progetto da configure_laravel
+	ENV_SETTINGS = {
+		"DB_CONNECTION": "mysql",
+		"DB_HOST": "127.0.0.1",
+		"DB_PORT": "3306",
+		"DB_DATABASE": "laravel_oxylabs_test_database",
+		"DB_USERNAME": "laravel_oxylabs_test_user",
+		"DB_PASSWORD": "kA[Q+LgF-~1C",
+	}
+
+	# Chiavi del .env che determinano l'esito della configurazione di Laravel
+	CHECKPOINT_ENV_KEYS = ["APP_KEY", "DB_CONNECTION", "DB_HOST", "DB_PORT", "DB_DATABASE", "DB_USERNAME", "DB_PASSWORD"]
+
 	def __init__(self, parent=None):
 		super().__init__(parent)
 		self.sudo_password = None
 		self.input_queue = None
 		self.authenticated = False
 		self.input_result = None
-		self.processes = []
+		self.input_ready = threading.Event()
+		self.answers = {}
+		self.supervisor = None
+		self.queue_monitor = None
+		self.package_index = None
+		self.broker = None
+		self.engine = CommandEngine()
+		self.dry_run = DRY_RUN
+		self.dry_run_plan = {} # indice del passaggio -> comandi che verrebbero eseguiti
+		self.checkpoints = CheckpointStore(CHECKPOINT_FILE)
+		self.step_state = threading.local() # stato del passaggio in esecuzione su questo thread
+		self.run_id = time.strftime("%Y%m%d-%H%M%S")
+		self.log_path = os.path.join(LOG_DIR, f"setup-{self.run_id}.log")
+		self.trace = RunTrace()
+		self.plan = CommandPlan()
+		self.prefetcher = Prefetcher()
+		self.download_digests = {} # percorso -> (algoritmo, hash) dei file scaricati
+		self.mirrors = MirrorSelector(MIRROR_CANDIDATES, MIRROR_CACHE_FILE, probe="--no-mirror-probe" not in sys.argv, persist=not DRY_RUN)
+		self.completed_steps = 0
+		self.progress_lock = threading.Lock()
+		self.log_message = LogPipeline(self.log_batch.emit, None if self.dry_run else self.log_path)
+		if "--no-resume" in sys.argv:
+			if self.dry_run:
+				# Il piano considera tutti i passaggi senza toccare i checkpoint salvati
+				self.checkpoints = CheckpointStore(os.devnull)
+			else:
+				self.checkpoints.clear()
 		self.is_canceled = False
 		self.current_user = os.environ.get("SUDO_USER") or os.environ.get("USER")
 		if self.current_user is None:
@@ -340,121 +2846,282 @@ class Worker(QThread):
 		Contains the main logic of the setup script.
 		"""
 		self.mutex.lock()
+		self.log_message.start()
+		step_index = 0
 		try:
 			self.progress_updated.emit(0)
 			self.log_message.emit("Avvio del setup...", "info")
 			self.log_message.emit("Avvio script multipiattaforme.", "info")
 			
 			distro, pm = self.detect_system_b()
+			self.package_index = get_package_index(pm)
+			if not self.dry_run:
+				self.start_privileged_broker()
+			context = {"pm": pm, "distro": distro}
+			self.context = context
+			if not self.dry_run and "--no-prefetch" not in sys.argv:
+				self.start_prefetch(pm)
+
+			scheduler = StepScheduler(max_workers=self.MAX_PARALLEL_STEPS)
+			fingerprints = {}
+			for index, (_, _, deps, resources) in enumerate(self.STEP_GRAPH):
+				scheduler.add(
+					index,
+					lambda index=index: self.run_step_with_checkpoint(index, context, fingerprints),
+					deps,
+					resources
+				)
 
-			step_index = 0
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.fix_package_manager_lock, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.update_packages, pm, distro)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_php_and_extensions, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_nodejs, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_composer, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_git, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_mysql, pm, distro)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.clean_packages, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.configure_database, pm)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.clone_project)
-			if self.is_canceled: return
-			step_index += 1
-
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.fix_permissions)
+			try:
+				scheduler.run(should_stop=lambda: self.is_canceled)
+			except Exception:
+				if scheduler.failed_step is not None:
+					step_index = scheduler.failed_step
+				raise
 			if self.is_canceled: return
-			step_index += 1
 
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.install_dependencies)
-			if self.is_canceled: return
-			step_index += 1
+			self.progress_updated.emit(100)
+			self.log_plan_savings()
+			self.log_message.emit("✅ Setup completato!", "success")
+			self.log_message.flush()
+			self.finished.emit(True)
 
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.configure_laravel)
-			if self.is_canceled: return
-			step_index += 1
+		except Exception as e:
+			self.log_message.emit(f"❌ Errore critico durante il setup: {e}", "error")
+			self.log_message.flush()
+			self.finished.emit(False)
+			# Update the last active step to error status
+			self.step_status_updated.emit(step_index, "error")
+		finally:
+			self.prefetcher.shutdown()
+			if self.broker is not None:
+				self.broker.stop()
+				self.broker = None
+			self.engine.close()
+			self.export_trace()
+			self.log_message.stop()
+			self.mutex.unlock()
 
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.configure_filament)
-			if self.is_canceled: return
-			step_index += 1
+	def start_privileged_broker(self):
+		"""
+		Authenticates once and starts the privileged broker used by run_command.
+		If it can't be started, every command falls back to its own sudo.
+		"""
+		if "--no-broker" in sys.argv:
+			return
+		broker = PrivilegedBroker()
+		self.log_message.emit("Autenticazione sudo in corso...", "info")
+		try:
+			started = broker.start(self.sudo_password)
+		except ValueError as ve:
+			self.log_message.emit(f"❌ Errore di autenticazione: {ve}", "error")
+			raise
+		if started:
+			self.broker = broker
+			self.authenticated = True
+			self.log_message.emit("🔐 Broker privilegiato avviato: i comandi root non richiedono più sudo.", "success")
+		else:
+			self.log_message.emit("⚠️ Broker privilegiato non disponibile, uso sudo per ogni comando.", "warning")
 
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.configure_cron, pm)
-			if self.is_canceled: return
-			step_index += 1
+	def start_prefetch(self, pm):
+		"""
+		Queues the background downloads: installer scripts right away, the
+		project mirror once git is there, and the Composer and npm packages
+		once their tool and the mirror are there.
+		"""
+		self.log_message.emit(f"📥 Download anticipati in {PREFETCH_DIR}.", "info")
+		self.plan.once("prepare_dependency_cache", self.prepare_dependency_cache)
+		if not shutil.which("composer"):
+			self.prefetcher.add("composer_installer", lambda: self.prefetch_download("composer_installer", "composer-setup.php"))
+		if not shutil.which("npm") and pm in ("apt", "dnf"):
+			service = "nodesource_deb" if pm == "apt" else "nodesource_rpm"
+			self.prefetcher.add("nodesource", lambda: self.prefetch_download(service, "nodesource_setup.sh"))
+
+		# Indici di STEP_GRAPH: 3 Node.js, 4 Composer, 5 Git
+		manifests = [] if shutil.which("git") else [5]
+		if PROJECT_SYNC_MODE == "clone" or not self.is_project_checkout():
+			self.prefetcher.add("project_mirror", self.prefetch_project_mirror, after=manifests)
+			manifests = manifests + ["project_mirror"]
+		self.prefetcher.add("composer_cache", self.prefetch_composer_cache, after=manifests + ([] if shutil.which("composer") else [4]))
+		self.prefetcher.add("npm_cache", self.prefetch_npm_cache, after=manifests + ([] if shutil.which("npm") else [3]))
+
+	def prefetch_download(self, service, filename):
+		"""
+		Downloads the file of service into the staging directory and returns its path.
+		"""
+		# Con --no-prefetch, o per un download di riserva, la cache può non essere ancora stata creata
+		self.plan.once("prepare_dependency_cache", self.prepare_dependency_cache)
+		url = self.mirror(service)
+		path = os.path.join(PREFETCH_DIR, filename)
+		started = self.trace.now()
+		os.makedirs(PREFETCH_DIR, exist_ok=True)
+		digest = hashlib.sha256()
+		with urllib.request.urlopen(url, timeout=60) as response, open(f"{path}.part", "wb") as f:
+			while chunk := response.read(64 * 1024):
+				if self.prefetcher.stopping.is_set():
+					raise OSError(f"download di {url} interrotto")
+				digest.update(chunk)
+				f.write(chunk)
+		os.replace(f"{path}.part", path)
+		# Hash del contenuto ricevuto, non del file: root_staged_command lo verifica sulla copia di root
+		self.download_digests[path] = ("sha256", digest.hexdigest())
+		self.trace.record("prefetch", url, started, self.trace.now(), path=path)
+		self.log_message.emit(f"📥 {url} scaricato in anticipo.", "info")
+		return path
+
+	def prefetch_project_mirror(self):
+		"""
+		Creates or refreshes a bare mirror of the repository in the staging
+		directory, used as clone reference by clone_fresh_project.
+		"""
+		if PROJECT_REFERENCE_MIRROR:
+			return self.update_reference_mirror() or None
+		mirror = os.path.join(PREFETCH_DIR, "project.git")
+		if os.path.isdir(mirror):
+			self.run_as_user(f"git -C {mirror} fetch --prune", "📥 Mirror del progetto aggiornato in anticipo.", retries=COMMAND_RETRIES)
+		else:
+			self.run_as_user(f"git clone --mirror {PROJECT_REPO_URL} {mirror}", "📥 Mirror del progetto scaricato in anticipo.")
+		return mirror
 
-			self.run_step_with_status_update(step_index, self.STEPS[step_index], self.start_services)
+	def prefetch_manifests(self, name, files):
+		"""
+		Extracts the given files of the project, from the prefetched mirror or
+		from the existing checkout, into a staging work directory and returns it.
+		"""
+		git_dir = self.prefetcher.get("project_mirror") or os.path.join(PROJECT_DIR, ".git")
+		if not os.path.isdir(git_dir):
+			return None
+		work_dir = os.path.join(PREFETCH_DIR, name)
+		required, optional = files
+		git = f"git -c safe.directory=* --git-dir {git_dir}"
+		extract = [f"{git} show HEAD:{path} > {path}" for path in required]
+		extract += [f"({git} show HEAD:{path} > {path} || rm -f {path})" for path in optional]
+		self.run_as_user(f"mkdir -p {work_dir} && cd {work_dir} && " + " && ".join(extract))
+		return work_dir
+
+	def prefetch_composer_cache(self):
+		"""
+		Downloads the locked Composer packages into the shared cache.
+		"""
+		if not shutil.which("composer"):
+			return None
+		work_dir = self.prefetch_manifests("composer-work", (["composer.json"], ["composer.lock"]))
+		if not work_dir:
+			return None
+		self.configure_packagist()
+		self.run_as_user(
+			f"cd {work_dir} && {self.composer_env()}composer install --no-scripts --no-autoloader --no-plugins --no-interaction --no-progress --ignore-platform-reqs && rm -rf vendor",
+			"📥 Pacchetti Composer scaricati in anticipo.",
+			retries=COMMAND_RETRIES
+		)
+		return work_dir
 
-			self.progress_updated.emit(100)
-			self.log_message.emit("✅ Setup completato!", "success")
-			self.finished.emit(True)
+	def prefetch_npm_cache(self):
+		"""
+		Downloads the locked npm packages into the shared cache.
+		"""
+		if not shutil.which("npm"):
+			return None
+		work_dir = self.prefetch_manifests("npm-work", (["package.json"], ["package-lock.json"]))
+		if not work_dir:
+			return None
+		self.run_as_user(
+			f"cd {work_dir} && npm install --ignore-scripts --no-audit --no-fund --prefer-offline --cache {self.dependency_cache_path('npm')} --registry {self.mirror('npm')} && rm -rf node_modules",
+			"📥 Pacchetti npm scaricati in anticipo.",
+			retries=COMMAND_RETRIES
+		)
+		return work_dir
 
-		except Exception as e:
-			self.log_message.emit(f"❌ Errore critico durante il setup: {e}", "error")
-			self.finished.emit(False)
-			# Update the last active step to error status
-			self.step_status_updated.emit(step_index, "error")
-		finally:
-			self.mutex.unlock()
+	def export_trace(self):
+		"""
+		Writes the Chrome trace and the JSON summary of the run, and adds its
+		commands to the history used by the dry run.
+		"""
+		if self.dry_run:
+			return
+		trace_path = os.path.join(TRACE_DIR, f"trace-{self.run_id}.json")
+		summary_path = os.path.join(TRACE_DIR, f"summary-{self.run_id}.json")
+		try:
+			log_stats = {"lines": self.log_message.lines, "delivery_seconds": round(self.log_message.sink_seconds, 3)}
+			self.trace.export(trace_path, summary_path, extra={"log": log_stats, "plan": self.plan.summary()})
+			self.log_message.emit(f"⏱️ Trace dei tempi salvato in {trace_path} (riepilogo: {summary_path}).", "info")
+			CommandHistory(HISTORY_FILE).update(self.trace.spans)
+		except OSError as e:
+			self.log_message.emit(f"Impossibile salvare il trace dei tempi: {e}", "warning")
 
 	def kill_processes(self):
 		"""
 		Terminate all background processes started by this worker.
 		"""
+		if self.supervisor is None:
+			return
 		self.log_message.emit("Terminazione dei processi in background...", "warning")
-		for proc in self.processes:
-			try:
-				if proc.poll() is None:
-					# Check if the process is still running
-					os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-					self.log_message.emit(f"Processo {proc.pid} terminato.", "warning")
-			except OSError as e:
-				self.log_message.emit(f"Impossibile terminare il processo: {e}", "error")
-		self.processes = []
+		self.supervisor.stop()
+		self.supervisor = None
+
+	def detach_processes(self):
+		"""
+		Stops supervising the background processes and leaves them running,
+		after reporting the queue throughput measured so far.
+		"""
+		if self.supervisor is None:
+			return
+		if self.queue_monitor is not None:
+			self.queue_monitor.sample()
+		self.supervisor.detach()
+		self.supervisor = None
+		self.log_message.emit("I servizi restano in esecuzione in background.", "info")
 
 	def cancel(self):
 		self.is_canceled = True
+		# Sblocca un'eventuale attesa di input
+		self.provide_input(None, False)
 
 	def set_sudo_password(self, password):
 		self.sudo_password = password
 
+	def set_answers(self, answers):
+		"""
+		Provides the answers collected before the run, keyed as in INPUT_PROMPTS.
+		"""
+		self.answers = dict(answers)
+
+	def get_answer(self, key):
+		"""
+		Returns a collected answer, asking the GUI only if it is missing.
+		"""
+		if self.answers.get(key):
+			return self.answers[key]
+		for prompt_key, title, label, default_value, is_password in self.INPUT_PROMPTS:
+			if prompt_key == key:
+				if is_password:
+					self.answers[key] = self.get_password_input(title, label)
+				else:
+					self.answers[key] = self.get_user_input(title, label, default_value)
+				return self.answers[key]
+		raise KeyError(f"Risposta sconosciuta: {key}")
+
+	def provide_input(self, result, ok):
+		"""
+		Hands the result of an input dialog to the waiting worker thread.
+		"""
+		self.input_result = (result, ok)
+		self.input_ready.set()
+
+	def wait_for_input(self):
+		self.input_ready.wait()
+		self.input_ready.clear()
+		return self.input_result
+
 	def get_user_input(self, title, label, default_value=""):
 		"""
 		Requests user input from the main GUI thread.
 		This is a blocking call within the worker thread.
 		"""
-		self.input_result = None
+		self.input_ready.clear()
 		self.request_input.emit(title, label, default_value)
-		# Wait for the main thread to provide the result
-		while self.input_result is None:
-			QThread.msleep(100) # Wait a bit to avoid busy looping
-		result, ok = self.input_result
+		# Attende che il thread principale fornisca il risultato
+		result, ok = self.wait_for_input()
 		if not ok:
 			raise Exception("Input dialog canceled by user.")
 		return result
@@ -464,58 +3131,79 @@ class Worker(QThread):
 		Requests a password input from the main GUI thread.
 		This is a blocking call within the worker thread.
 		"""
-		self.input_result = None
+		self.input_ready.clear()
 		self.request_password_input.emit(title, label)
-		# Wait for the main thread to provide the result
-		while self.input_result is None:
-			QThread.msleep(100)
-		result, ok = self.input_result
+		# Attende che il thread principale fornisca il risultato
+		result, ok = self.wait_for_input()
 		if not ok:
 			raise Exception("Password dialog canceled by user.")
 		return result
 
-	def run_command(self, cmd, success_msg="", error_msg="", use_sudo=True, retries=1, delay=5):
+	def run_command(self, cmd, success_msg="", error_msg="", use_sudo=True, retries=1, delay=5, timeout=None, stall_timeout=None, on_output=None):
 		"""
 		Executes a system command and handles output and errors.
 		Now it manages the sudo password and real-time output.
+		timeout and stall_timeout override the CommandEngine limits;
+		on_output, if given, is called with every output line.
 		"""
 		if self.is_canceled: return
+		if self.dry_run:
+			self.record_planned_command(cmd, use_sudo)
+			return True
 
-		full_cmd = f"/usr/bin/sudo -S {cmd}" if use_sudo else cmd
+		# Con il broker attivo il comando viene eseguito come root senza un nuovo sudo
+		use_broker = use_sudo and self.broker is not None
+		full_cmd = f"{SUDO_BINARY} -S {cmd}" if use_sudo and not use_broker else cmd
 
 		for i in range(retries):
 			try:
 				self.log_message.emit(f"Esecuzione: {full_cmd} (Tentativo {i+1}/{retries})", "realtime")
-				process = subprocess.Popen(full_cmd, shell=True, text=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, executable="/bin/bash")
-
-				if use_sudo and self.sudo_password:
-					if not self.authenticated:
-						self.log_message.emit("Autenticazione sudo in corso...", "info")
-					process.stdin.write(self.sudo_password + '\n')
-					process.stdin.flush()
-
-				for line in iter(process.stdout.readline, ''):
+				started = self.trace.now()
+				if use_broker:
+					process = self.broker.run(cmd)
+					self.engine.watch(process, timeout, stall_timeout)
+				else:
+					stdin_data = None
+					if use_sudo and self.sudo_password:
+						if not self.authenticated:
+							self.log_message.emit("Autenticazione sudo in corso...", "info")
+						stdin_data = self.sudo_password + '\n'
+					process = self.engine.run(full_cmd, stdin_data, timeout, stall_timeout)
+
+				output_bytes = 0
+				tail = collections.deque(maxlen=RETRY_OUTPUT_TAIL)
+				for line in process.lines():
 					if self.is_canceled:
 						process.terminate()
 						raise Exception("Process canceled by user")
+					output_bytes += len(line.encode("utf-8", "replace"))
+					tail.append(line)
 					self.log_message.emit(line.strip(), "output")
+					if on_output:
+						on_output(line)
 					if "incorrect password" in line.lower():
 						raise ValueError("Incorrect sudo password provided.")
 					if "password for" in line.lower() and use_sudo:
 						self.authenticated = True
 
-				process.stdout.close()
-				return_code = process.wait()
+				return_code, rusage = process.wait()
+				reason = classify_failure(tail, process.timed_out, return_code, cmd) if return_code else None
+				self.trace.record_command(cmd, started, return_code, rusage, output_bytes, step=getattr(self.step_state, "index", None), attempt=i + 1, sudo=use_sudo, timed_out=process.timed_out, transient=reason)
+				self.log_timeout(process)
+
+				# Un'installazione o rimozione di pacchetti rende obsoleto lo snapshot
+				if self.package_index and PACKAGE_TRANSACTION_RE.search(cmd):
+					self.package_index.invalidate()
 
 				if return_code == 0:
 					if success_msg:
 						self.log_message.emit(success_msg, "success")
 					return True
-				else:
-					self.log_message.emit(f"{error_msg}\nComando fallito con stato di uscita {return_code}", "error")
-					# La riga seguente è stata rimossa, in quanto causava l'errore "I/O operation on closed file".
-					# La gestione degli errori di rete è già inclusa nel blocco `except Exception as e`.
-					return False # Fail immediately for non-network errors
+				if reason and i + 1 < retries and self.wait_before_retry(reason, i + 1, retries, delay):
+					continue
+				self.log_message.emit(f"{error_msg}\nComando fallito con stato di uscita {return_code}", "error")
+				self.note_command_failure()
+				return False # Fail immediately for non-transient errors
 
 			except ValueError as ve:
 				self.log_message.emit(f"❌ Errore di autenticazione: {ve}", "error")
@@ -523,23 +3211,29 @@ class Worker(QThread):
 			except Exception as e:
 				full_error = f"Comando fallito: {cmd}\nErrore: {e}" if error_msg else f"Comando fallito: {cmd}\nErrore: {e}"
 				self.log_message.emit(full_error, "error")
-				if "ECONNRESET" in str(e).lower() or "network" in str(e).lower():
-					self.log_message.emit(f"Errore di rete rilevato. Riprovo in {delay} secondi...", "warning")
-					time.sleep(delay)
-					delay *= 2
-				else:
+				reason = classify_failure([str(e)])
+				if not reason:
 					raise
+				if not (i + 1 < retries and self.wait_before_retry(reason, i + 1, retries, delay)):
+					break
 
 		self.log_message.emit(f"❌ Comando fallito dopo {retries} tentativi.", "error")
+		self.note_command_failure()
 		return False
 
-	def run_as_user(self, cmd, success_msg="", error_msg="", ignore_error=False, interactive=False, retries=1, delay=5):
+	def run_as_user(self, cmd, success_msg="", error_msg="", ignore_error=False, interactive=False, retries=1, delay=5, on_output=None, label=None, timeout=None, stall_timeout=None):
 		"""
 		Executes a command without sudo, with optional retries.
 
 		If run as root, it will switch to a non-root user.
+		on_output, if given, is called with every output line; label, if given,
+		prefixes every output line in the log (e.g. when tools run concurrently).
+		timeout and stall_timeout override the CommandEngine limits.
 		"""
 		if self.is_canceled: return
+		if self.dry_run:
+			self.record_planned_command(cmd, False)
+			return ""
 
 		# If the script is running as root, switch to the user that initiated the sudo command
 		if os.getuid() == 0 and self.current_user != "root":
@@ -550,25 +3244,30 @@ class Worker(QThread):
 		for i in range(retries):
 			try:
 				self.log_message.emit(f"Esecuzione: {full_cmd} (Tentativo {i+1}/{retries})", "realtime")
-				stdin_pipe = subprocess.PIPE if interactive else None
-				process = subprocess.Popen(full_cmd, shell=True, text=True, stdin=stdin_pipe, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-				if interactive and self.input_queue:
-					for line in self.input_queue:
-						process.stdin.write(line + '\n')
-					process.stdin.flush()
-					process.stdin.close()
+				stdin_data = "".join(line + '\n' for line in self.input_queue) if interactive and self.input_queue else None
+				started = self.trace.now()
+				process = self.engine.run(full_cmd, stdin_data, timeout, stall_timeout)
 
-				for line in iter(process.stdout.readline, ''):
+				output_bytes = 0
+				tail = collections.deque(maxlen=RETRY_OUTPUT_TAIL)
+				for line in process.lines():
 					if self.is_canceled:
 						process.terminate()
 						raise Exception("Process canceled by user")
-					self.log_message.emit(line.strip(), "output")
+					output_bytes += len(line.encode("utf-8", "replace"))
+					tail.append(line)
+					self.log_message.emit(f"[{label}] {line.strip()}" if label else line.strip(), "output")
+					if on_output:
+						on_output(line)
 
-				process.stdout.close()
-				return_code = process.wait()
+				return_code, rusage = process.wait()
+				reason = classify_failure(tail, process.timed_out, return_code, cmd) if return_code else None
+				self.trace.record_command(cmd, started, return_code, rusage, output_bytes, step=getattr(self.step_state, "index", None), attempt=i + 1, sudo=False, timed_out=process.timed_out, transient=reason)
+				self.log_timeout(process)
 
 				if return_code != 0 and not ignore_error:
+					if reason and i + 1 < retries and self.wait_before_retry(reason, i + 1, retries, delay):
+						continue
 					full_error = f"{error_msg}\nComando fallito con stato di uscita {return_code}" if error_msg else f"Comando fallito: {cmd}"
 					self.log_message.emit(full_error, "error")
 					raise subprocess.CalledProcessError(return_code, cmd)
@@ -580,15 +3279,267 @@ class Worker(QThread):
 				if not ignore_error:
 					full_error = f"Comando fallito: {cmd}\nErrore: {e}" if error_msg else f"Comando fallito: {cmd}\nErrore: {e}"
 					self.log_message.emit(full_error, "error")
-					if "ECONNRESET" in str(e).lower() or "network" in str(e).lower():
-						self.log_message.emit(f"Errore di rete rilevato. Riprovo in {delay} secondi...", "warning")
-						time.sleep(delay)
-						delay *= 2
-					else:
+					reason = classify_failure([str(e)])
+					if not reason:
 						raise
+					if not (i + 1 < retries and self.wait_before_retry(reason, i + 1, retries, delay)):
+						break
 		self.log_message.emit(f"❌ Comando fallito dopo {retries} tentativi.", "error")
+		self.note_command_failure()
 		return False
 
+	def mirror(self, service):
+		"""
+		Returns the endpoint chosen by the MirrorSelector for service, logging the choice.
+		"""
+		url, source = self.mirrors.select(service)
+		if source in ("probe", "fallback"):
+			for result in self.mirrors.results.get(service, []):
+				if result["error"]:
+					self.log_message.emit(f"🌐 {service}: {result['url']} non raggiungibile ({result['error']}).", "warning")
+				else:
+					self.log_message.emit(f"🌐 {service}: {result['url']} risponde in {result['latency'] * 1000:.0f} ms, {(result['throughput'] or 0) / 1024:.0f} KiB/s.", "info")
+			if source == "probe":
+				self.log_message.emit(f"🌐 Endpoint scelto per {service}: {url}", "success")
+			else:
+				self.log_message.emit(f"⚠️ Nessun endpoint per {service} ha risposto, uso {url}.", "warning")
+		elif source == "cache":
+			self.log_message.emit(f"🌐 Endpoint per {service} dalla cache: {url}", "info")
+		return url
+
+	def record_planned_command(self, cmd, use_sudo):
+		"""
+		Adds a command to the dry-run plan of the current step instead of running it.
+		"""
+		index = getattr(self.step_state, "index", None)
+		with self.progress_lock:
+			self.dry_run_plan.setdefault(index, []).append((cmd, use_sudo))
+
+	def wait_before_retry(self, reason, attempt, retries, delay):
+		"""
+		Logs a transient failure with its reason and sleeps for the backoff
+		before the next attempt. Returns False if the setup was canceled.
+		"""
+		seconds = retry_delay(attempt, delay)
+		self.log_message.emit(f"🔁 Errore transitorio ({reason}): tentativo {attempt + 1}/{retries} tra {seconds:.1f} secondi.", "warning")
+		deadline = time.monotonic() + seconds
+		while not self.is_canceled and time.monotonic() < deadline:
+			time.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+		return not self.is_canceled
+
+	def wait_until_ready(self, probe, should_stop=None):
+		"""
+		Waits for a ReadinessProbe, logging how long it took. Returns whether
+		the dependency is ready; if not, the step goes on and its own commands
+		report the failure. should_stop can end the wait early, e.g. when the
+		process that should answer has exited.
+		"""
+		if self.dry_run:
+			self.record_planned_command(f"# attesa di {probe.name}", False)
+			return True
+		self.log_message.emit(f"⏳ In attesa di {probe.name}...", "info")
+		ready, seconds, error = probe.wait(should_stop=lambda: self.is_canceled or bool(should_stop and should_stop()))
+		if ready:
+			self.log_message.emit(f"✅ {probe.name} pronto in {seconds:.2f} s ({probe.attempts} tentativi).", "success")
+		elif not self.is_canceled:
+			self.log_message.emit(f"⚠️ {probe.name} non pronto dopo {seconds:.0f} s: {error}", "warning")
+		return ready
+
+	def queue_backlog(self, claimable=False):
+		"""
+		Returns the number of jobs waiting in the database queue, or None if
+		it can't be read. With claimable, only the jobs that are due and not
+		reserved by a worker are counted.
+		"""
+		env = self.read_env_values(["DB_HOST", "DB_PORT", "DB_DATABASE", "DB_USERNAME", "DB_PASSWORD"])
+		client = shutil.which("mariadb") or shutil.which("mysql")
+		if not client or not env.get("DB_DATABASE"):
+			return None
+		query = "SELECT COUNT(*) FROM jobs"
+		if claimable:
+			query += " WHERE reserved_at IS NULL AND available_at <= UNIX_TIMESTAMP()"
+		try:
+			result = subprocess.run([client, "-h", env.get("DB_HOST") or "127.0.0.1", "-P", env.get("DB_PORT") or "3306",
+				"-u", env.get("DB_USERNAME") or "", "-N", "-B", "-e", query, env["DB_DATABASE"]],
+				capture_output=True, text=True, timeout=5, env=dict(os.environ, MYSQL_PWD=env.get("DB_PASSWORD") or ""))
+			return int(result.stdout.strip()) if result.returncode == 0 else None
+		except (OSError, ValueError, subprocess.TimeoutExpired):
+			return None
+
+	def queue_heartbeat(self, log_path):
+		"""
+		Health check of a queue worker. A worker whose last logged job is
+		still running is busy however long the job takes (its runtime is
+		bounded by queue:work --timeout); an idle worker fails when it hasn't
+		written anything for QUEUE_HEARTBEAT_TIMEOUT seconds while due jobs
+		are left unreserved.
+		"""
+		try:
+			idle = time.time() - os.path.getmtime(log_path)
+			with open(log_path, "rb") as log:
+				log.seek(max(os.fstat(log.fileno()).st_size - 4096, 0))
+				tail = log.read().decode("utf-8", "replace").strip().splitlines()
+		except OSError:
+			return None
+		if idle < QUEUE_HEARTBEAT_TIMEOUT or (tail and QUEUE_JOB_RUNNING_RE.search(tail[-1])):
+			return None
+		backlog = self.queue_backlog(claimable=True)
+		if backlog:
+			return f"{backlog} job pronti e non riservati, nessuna attività da {idle:.0f} s"
+		return None
+
+	def probe_command(self, cmd, use_sudo=True):
+		"""
+		Runs a short check command without logging or tracing it and tells
+		whether it succeeded.
+		"""
+		if use_sudo and self.broker is not None:
+			process = self.broker.run(cmd)
+			self.engine.watch(process, PROBE_COMMAND_TIMEOUT, 0)
+		else:
+			stdin_data = self.sudo_password + "\n" if use_sudo and self.sudo_password else None
+			process = self.engine.run(f"{SUDO_BINARY} -S {cmd}" if use_sudo else cmd, stdin_data, PROBE_COMMAND_TIMEOUT, 0)
+		try:
+			return process.wait()[0] == 0
+		except RuntimeError:
+			return False
+
+	def log_timeout(self, process):
+		"""
+		Logs why a command was killed by the CommandEngine, if it was.
+		"""
+		if process.timed_out == "wall":
+			self.log_message.emit(f"⏱️ Comando interrotto: superato il limite di {process.timeout_limit:.0f} secondi.", "error")
+		elif process.timed_out == "stall":
+			self.log_message.emit(f"⏱️ Comando interrotto: nessun output da {process.timeout_limit:.0f} secondi.", "error")
+
+	def step_finished(self):
+		"""
+		Advances the progress bar by one step.
+		"""
+		with self.progress_lock:
+			self.completed_steps += 1
+			self.progress_updated.emit(int(self.completed_steps * 100 / len(self.STEPS)))
+
+	def run_step_with_checkpoint(self, index, context, fingerprints):
+		"""
+		Runs a step through run_checkpointed_step, recording its span in the trace.
+		"""
+		self.step_state.index = index
+		started = self.trace.now()
+		status = "error"
+		try:
+			status = self.run_checkpointed_step(index, context, fingerprints)
+		finally:
+			self.trace.record("step", self.STEPS[index], started, self.trace.now(), index=index, method=self.STEP_GRAPH[index][0], status=status)
+			self.step_state.index = None
+		self.prefetcher.step_done(index)
+		self.step_finished()
+
+	def run_checkpointed_step(self, index, context, fingerprints):
+		"""
+		Runs a step unless the checkpoint store holds a completion with the same
+		input fingerprint, then records the new checkpoint. Returns the step status.
+		"""
+		method, arg_names, deps, _ = self.STEP_GRAPH[index]
+		dep_fingerprints = [fingerprints.get(dep) for dep in deps]
+
+		inputs = self.step_inputs(method, context, dep_fingerprints)
+		if inputs is not None and self.checkpoints.is_valid(method, CheckpointStore.fingerprint(inputs)):
+			self.log_message.emit(f"⏭️ {self.STEPS[index]} già completato in precedenza, passaggio saltato.", "info")
+			self.step_status_updated.emit(index, "success")
+			fingerprints[index] = CheckpointStore.fingerprint(inputs)
+			return "skipped"
+
+		if not self.dry_run:
+			self.checkpoints.invalidate(method)
+		self.step_state.failed_commands = 0
+		args = [context[name] for name in arg_names]
+		self.run_step_with_status_update(index, self.STEPS[index], getattr(self, method), *args)
+		if self.is_canceled:
+			return "canceled"
+		if self.step_state.failed_commands:
+			self.log_message.emit(f"⚠️ {self.STEPS[index]} non registrato come completato: alcuni comandi sono falliti.", "warning")
+			return "failed_commands"
+		if inputs is None or self.dry_run:
+			return "success"
+
+		# Gli input vengono ricalcolati perché il passaggio può averli modificati (es. HEAD del clone)
+		fingerprint = CheckpointStore.fingerprint(self.step_inputs(method, context, dep_fingerprints))
+		self.checkpoints.record(method, fingerprint)
+		fingerprints[index] = fingerprint
+		return "success"
+
+	def step_inputs(self, method, context, dep_fingerprints):
+		"""
+		Returns the inputs that determine the outcome of a step, or None if the
+		step must always run.
+		"""
+		if method in self.ALWAYS_RUN_STEPS:
+			return None
+
+		try:
+			code = inspect.getsource(getattr(Worker, method))
+		except (OSError, TypeError):
+			code = method
+		inputs = {
+			"code": hashlib.sha256(code.encode("utf-8")).hexdigest(),
+			"pm": context["pm"],
+			"distro": context["distro"],
+			"user": self.current_user,
+			"deps": dep_fingerprints
+		}
+
+		if method == "clone_project":
+			inputs["remote_head"] = self.git_output(f"git ls-remote {PROJECT_REPO_URL} HEAD").split("\t")[0]
+			inputs["local_head"] = self.git_output(self.project_git("rev-parse HEAD"))
+		elif method == "install_dependencies":
+			inputs["vendor"] = os.path.exists(os.path.join(PROJECT_DIR, "vendor", "autoload.php"))
+			inputs["node_modules"] = os.path.isdir(os.path.join(PROJECT_DIR, "node_modules"))
+			# Manifest e lockfile, più i file che Composer e npm scrivono solo a installazione completata
+			inputs["files"] = {name: CheckpointStore.file_digest(os.path.join(PROJECT_DIR, name)) for name in [
+				"composer.json", "composer.lock", "package.json", "package-lock.json",
+				"vendor/composer/installed.json", "node_modules/.package-lock.json"
+			]}
+		elif method == "configure_laravel":
+			inputs["env"] = self.read_env_values(self.CHECKPOINT_ENV_KEYS)
+		elif method == "configure_filament":
+			inputs["answers"] = {key: self.answers.get(key) for key in ["panel_id", "admin_name", "admin_email"]}
+		return inputs
+
+	def note_command_failure(self):
+		"""
+		Counts a failed command against the step running on the current thread.
+		"""
+		self.step_state.failed_commands = getattr(self.step_state, "failed_commands", 0) + 1
+
+	def git_output(self, cmd):
+		"""
+		Returns the stripped output of a read-only git command, or an empty string on failure.
+		"""
+		try:
+			result = subprocess.run(shlex.split(cmd), capture_output=True, text=True, timeout=30)
+		except (OSError, subprocess.TimeoutExpired):
+			return ""
+		return result.stdout.strip() if result.returncode == 0 else ""
+
+	def read_env_values(self, keys):
+		"""
+		Reads the given keys from the project's .env file.
+		"""
+		try:
+			return EnvFile(os.path.join(PROJECT_DIR, ".env")).values(keys)
+		except OSError:
+			return {}
+
+	def log_package_results(self, batch, results):
+		"""
+		Logs the outcome of each package of a PackageBatch.
+		"""
+		for name, status in results.items():
+			template, message_type = PACKAGE_STATUS_MESSAGES[status]
+			self.log_message.emit(template.format(batch.describe(name)), message_type)
+
 	def run_step_with_status_update(self, index, msg, func, *args):
 		"""
 		Runs a single setup step, updating the status list and log.
@@ -640,25 +3591,11 @@ class Worker(QThread):
 
 	def fix_package_manager_lock(self, pm):
 		"""
-		Resolves package manager lock issues.
+		Resolves package manager lock issues, once per run.
 		"""
 		if self.is_canceled: return
-		if pm == "apt":
-			self.run_command("rm -f /var/lib/dpkg/lock-frontend", "dpkg lock removed.")
-			self.run_command("rm -f /var/lib/dpkg/lock", "dpkg lock removed.")
-			self.run_command("rm -f /var/cache/apt/archives/lock", "apt lock removed.")
-			self.run_command("dpkg --configure -a", "dpkg configured.")
-		elif pm == "zypper":
-			self.run_command("rm -f /var/lib/rpm/.rpm.lock", "RPM lock removed.")
-			self.run_command("rpm --rebuilddb", "RPM database rebuilt.")
-			self.run_command("zypper clean --all", "Zypper cache cleaned.")
-		elif pm == "dnf":
-			self.run_command("dnf clean all", "dnf cache cleaned.")
-		elif pm == "pacman":
-			self.run_command("rm -f /var/lib/pacman/db.lck", "pacman lock removed.")
-		elif pm == "pkg":
-			self.run_command("rm -f /var/db/pkg/lock", "pkg lock removed.")
-			self.run_command("pkg-static -f install -y", "pkg issues resolved.")
+		commands = self.PACKAGE_LOCK_COMMANDS.get(pm, [])
+		self.plan.once(f"fix_package_manager_lock:{pm}", lambda: [self.run_command(cmd, msg) for cmd, msg in commands], processes=len(commands))
 
 	def update_packages(self, pm, distro):
 		"""
@@ -668,21 +3605,21 @@ class Worker(QThread):
 		self.fix_package_manager_lock(pm)
 		if pm == "apt":
 			if distro == "neon":
-				self.run_command("apt-get update", "Apt update completed.")
-				self.run_command("apt-get upgrade -y", "Packages upgraded.")
+				self.run_command("apt-get update", "Apt update completed.", retries=COMMAND_RETRIES)
+				self.run_command("apt-get upgrade -y", "Packages upgraded.", retries=COMMAND_RETRIES)
 			else:
-				self.run_command("apt update", "Apt update completed.")
-				self.run_command("apt upgrade -y", "Packages upgraded.")
+				self.run_command("apt update", "Apt update completed.", retries=COMMAND_RETRIES)
+				self.run_command("apt upgrade -y", "Packages upgraded.", retries=COMMAND_RETRIES)
 		elif pm == "dnf":
-			self.run_command("dnf upgrade --refresh -y", "Packages updated.")
+			self.run_command("dnf upgrade --refresh -y", "Packages updated.", retries=COMMAND_RETRIES)
 		elif pm == "pacman":
-			self.run_command("pacman -Syu --noconfirm --disable-download-timeout", "Packages updated.")
+			self.run_command("pacman -Syu --noconfirm --disable-download-timeout", "Packages updated.", retries=COMMAND_RETRIES)
 		elif pm == "zypper":
-			self.run_command("zypper --non-interactive refresh", "Repository aggiornati.")
-			self.run_command("zypper --non-interactive dup", "Pacchetti aggiornati.")
+			self.run_command("zypper --non-interactive refresh", "Repository aggiornati.", retries=COMMAND_RETRIES)
+			self.run_command("zypper --non-interactive dup", "Pacchetti aggiornati.", retries=COMMAND_RETRIES)
 		elif pm == "pkg":
-			self.run_command("pkg update -f", "Pkg update completed.")
-			self.run_command("pkg upgrade -y", "Packages upgraded.")
+			self.run_command("pkg update -f", "Pkg update completed.", retries=COMMAND_RETRIES)
+			self.run_command("pkg upgrade -y", "Packages upgraded.", retries=COMMAND_RETRIES)
 
 	def install_php_and_extensions(self, pm):
 		"""
@@ -694,28 +3631,14 @@ class Worker(QThread):
 		self.log_message.emit("Verifica e installazione di PHP e delle estensioni essenziali...", "info")
 
 		if pm == "pacman":
-			# Installa PHP e le estensioni richieste con --noconfirm
-			# Pacchetto 'php-intl' viene gestito separatamente dopo per la verifica esplicita
-			# Pacchetti aggiuntivi: php, php-fpm, php-gd, unzip, curl
-			if not self.run_command("pacman -S --noconfirm php php-fpm php-gd unzip curl", "Pacchetti aggiuntivi PHP installati con successo.", "Errore critico durante l'installazione di pacchetti aggiuntivi PHP."):
-				self.log_message.emit("❌ Errore critico durante l'installazione dei pacchetti PHP aggiuntivi. Verificare l'output per dettagli.", "error")
-				# A questo punto, dato che il pacchetto principale non è stato installato, potremmo voler uscire.
-				# sys.exit(1) # Decommenta se vuoi uscire in caso di fallimento di questi pacchetti essenziali
-
-			# Assicurati che php-intl sia installato esplicitamente
-			self.log_message.emit("Installazione/verifica php-intl...", "info")
-
-			# Usa pacman -Q per controllare se è già installato. Non richiede sudo.
-			try:
-				# Usiamo subprocess.run qui perché non ha bisogno di sudo e non vogliamo gestire ritentativi/autenticazione
-				subprocess.run(['pacman', '-Q', 'php-intl'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-				self.log_message.emit("php-intl già installato.", "success")
-			except subprocess.CalledProcessError:
-				self.log_message.emit("Pacchetto php-intl non trovato, installazione in corso...", "info")
-				# Usa run_command per installare php-intl, che gestirà sudo e possibili errori
-				if not self.run_command("pacman -S --noconfirm php-intl", "php-intl installato con successo.", "Errore critico: Impossibile installare php-intl. Verifica i tuoi repository."):
-					self.log_message.emit("❌ Errore critico: Impossibile installare php-intl. Verificare l'output per dettagli.", "error")
-					sys.exit(1) # Uscita critica se php-intl non può essere installato
+			# Installa PHP e le estensioni richieste in un'unica transazione
+			# Pacchetto 'php-intl' incluso nel batch, ma la sua assenza è critica
+			batch = PackageBatch(pm, ["php", "php-fpm", "php-gd", "unzip", "curl", "php-intl"])
+			results = batch.install(lambda cmd: self.run_command(shlex.join(cmd), "Pacchetti PHP installati con successo.", "Errore durante l'installazione dei pacchetti PHP.", retries=COMMAND_RETRIES))
+			self.log_package_results(batch, results)
+			if results.get("php-intl") == "failed":
+				self.log_message.emit("❌ Errore critico: Impossibile installare php-intl. Verificare l'output per dettagli.", "error")
+				sys.exit(1) # Uscita critica se php-intl non può essere installato
 
 			self.log_message.emit("Verifica e abilitazione estensioni PHP in php.ini...", "info")
 
@@ -746,18 +3669,21 @@ class Worker(QThread):
 		elif pm == "pkg":
 			self.run_command(
 				"pkg install -y php82 php82-phar php82-filter php82-iconv php82-mbstring php82-dom php82-tokenizer php82-pdo php82-pdo_mysql php82-session php82-xml php82-intl php82-xmlreader php82-zip unzip curl",
-				"Pacchetti PHP installati."
+				"Pacchetti PHP installati.",
+				retries=COMMAND_RETRIES
 			)
 
 		elif pm == "dnf":
 			self.run_command(
 				"dnf install -y php php-cli php-mbstring php-xml php-bcmath php-curl php-zip php-mysqlnd php-intl unzip curl php-dom",
-				"Pacchetti PHP installati."
+				"Pacchetti PHP installati.",
+				retries=COMMAND_RETRIES
 			)
 		elif pm == "apt":
 			self.run_command(
 				"apt install -y php php-cli php-mbstring php-xml php-bcmath php-curl php-zip php-mysqlnd php-intl unzip curl php-dom",
-				"Pacchetti PHP installati."
+				"Pacchetti PHP installati.",
+				retries=COMMAND_RETRIES
 			)
 		elif pm == "zypper":
 			PHP_VERSION = "8"
@@ -781,13 +3707,9 @@ class Worker(QThread):
 			"curl"
 		]
 
-			for pkg in REQUIRED_PKGS:
-				result = subprocess.run(["rpm", "-q", pkg], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-				if result.returncode == 0:
-					self.log_message.emit(f"✅ {pkg} già installato.", "info")
-				else:
-					self.log_message.emit(f"📦 Installazione {pkg}...", "info")
-					self.run_command(f"zypper install --no-confirm {pkg}", "Pacchetti PHP installati.")
+			batch = PackageBatch(pm, REQUIRED_PKGS)
+			results = batch.install(lambda cmd: self.run_command(shlex.join(cmd), "Pacchetti PHP installati.", retries=COMMAND_RETRIES))
+			self.log_package_results(batch, results)
 		else:
 			self.log_message.emit("❌ Impossibile procedere con l'installazione delle estensioni PHP. Gestore dei comandi non supportato", "error")
 
@@ -805,13 +3727,17 @@ class Worker(QThread):
 		except (subprocess.CalledProcessError, FileNotFoundError):
 			self.log_message.emit("Node.js o npm non trovati, installazione in corso...", "warning")
 
+		nodesource_script = self.prefetcher.get("nodesource")
 		if pm == "apt":
-			self.run_command("curl -fsSL https://deb.nodesource.com/setup_18.x | sudo -E bash -", "NodeSource repository aggiunto.")
-			self.run_command("apt-get install -y nodejs", "Node.js e NPM installati.")
+			if nodesource_script:
+				self.run_command(self.root_staged_command(nodesource_script, "bash {script}"), "NodeSource repository aggiunto.", retries=COMMAND_RETRIES)
+			else:
+				self.run_command(f"curl -fsSL {self.mirror('nodesource_deb')} | sudo -E bash -", "NodeSource repository aggiunto.", retries=COMMAND_RETRIES)
+			self.run_command("apt-get install -y nodejs", "Node.js e NPM installati.", retries=COMMAND_RETRIES)
 		elif pm == "zypper":
 			# Per openSUSE, usa il repository ufficiale o installa direttamente
 			# Opzione 1: Installa dalla repository standard di openSUSE
-			self.run_command("zypper install --no-confirm nodejs npm", "Node.js e NPM installati.")
+			self.run_command("zypper install --no-confirm nodejs npm", "Node.js e NPM installati.", retries=COMMAND_RETRIES)
 
 			# Se nodejs18 non è disponibile, prova con nodejs generico
 			# Questo comando fallirà silenziosamente se nodejs18 non esiste, poi proverà nodejs
@@ -821,14 +3747,57 @@ class Worker(QThread):
 				self.log_message.emit("Node.js installato correttamente.", "success")
 			except (subprocess.CalledProcessError, FileNotFoundError):
 				self.log_message.emit("Tentativo con nodejs generico...", "info")
-				self.run_command("zypper install --no-confirm nodejs npm", "Node.js e NPM installati.")
+				self.run_command("zypper install --no-confirm nodejs npm", "Node.js e NPM installati.", retries=COMMAND_RETRIES)
 		elif pm == "dnf":
-			self.run_command("curl -fsSL https://rpm.nodesource.com/setup_18.x | sudo bash - && sudo dnf install -y nodejs --allowerasing", "Node.js v18 installato.")
+			setup_script = self.root_staged_command(nodesource_script, "bash {script}") if nodesource_script else f"curl -fsSL {self.mirror('nodesource_rpm')} | sudo bash -"
+			self.run_command(f"{setup_script} && sudo dnf install -y nodejs --allowerasing", "Node.js v18 installato.", retries=COMMAND_RETRIES)
 		elif pm == "pacman":
 			# Aggiunto --disable-download-timeout per prevenire errori di timeout di rete
-			self.run_command("pacman -S --noconfirm --needed --disable-download-timeout nodejs npm", "Node.js e NPM installati.")
+			self.run_command("pacman -S --noconfirm --needed --disable-download-timeout nodejs npm", "Node.js e NPM installati.", retries=COMMAND_RETRIES)
 		elif pm == "pkg":
-			self.run_command("pkg install -y www/npm-node18", "Node.js e NPM installati.")
+			self.run_command("pkg install -y www/npm-node18", "Node.js e NPM installati.", retries=COMMAND_RETRIES)
+
+	def root_staged_command(self, path, command):
+		"""
+		Returns a root command that copies the downloaded file path into
+		ROOT_STAGING_DIR, checks the copy against the hash taken at download
+		time and runs command on it ("{script}" is the copy), so that a file
+		swapped in the user-writable staging directory is never run as root.
+		"""
+		algorithm, digest = self.download_digests[path]
+		staged = os.path.join(ROOT_STAGING_DIR, os.path.basename(path))
+		script = (f"install -d -m 0700 -o 0 -g 0 {ROOT_STAGING_DIR} && install -m 0600 -o 0 -g 0 {shlex.quote(path)} {staged} && "
+			f"echo {shlex.quote(f'{digest}  {staged}')} | {algorithm}sum -c --quiet - && {command.format(script=staged)}; "
+			f"status=$?; rm -f {staged}; exit $status")
+		return f"sh -c {shlex.quote(script)}"
+
+	def composer_installer(self):
+		"""
+		Returns the path of the Composer installer (prefetched, or downloaded
+		now) once its SHA-384 matches the official signature, or None.
+		"""
+		if self.dry_run:
+			self.record_planned_command(f"curl -sS {self.mirror('composer_installer')} -o composer-setup.php", False)
+			self.record_planned_command(f"# verifica di composer-setup.php con {COMPOSER_INSTALLER_SIG_URL}", False)
+			self.download_digests["composer-setup.php"] = ("sha384", "<firma>")
+			return "composer-setup.php"
+		try:
+			installer = self.prefetcher.get("composer_installer") or self.prefetch_download("composer_installer", "composer-setup.php")
+			with urllib.request.urlopen(COMPOSER_INSTALLER_SIG_URL, timeout=30) as response:
+				expected = response.read().decode("ascii", "replace").strip()
+			with open(installer, "rb") as f:
+				actual = hashlib.sha384(f.read()).hexdigest()
+		except OSError as e:
+			self.log_message.emit(f"❌ Impossibile scaricare o verificare il Composer installer: {e}", "error")
+			return None
+		self.download_digests[installer] = ("sha384", actual)
+		if actual != expected:
+			self.log_message.emit(f"❌ Il Composer installer scaricato da {self.mirror('composer_installer')} non corrisponde alla firma ufficiale: non verrà eseguito.", "error")
+			with contextlib.suppress(OSError):
+				os.remove(installer)
+			return None
+		self.log_message.emit("🔏 Composer installer verificato con la firma ufficiale.", "info")
+		return installer
 
 	def install_composer(self, pm):
 		"""
@@ -861,38 +3830,33 @@ class Worker(QThread):
 				self.log_message.emit("🚫 PHP non trovato. Impossibile installare Composer.", "error")
 				return
 
-			try:
-				# Download composer.phar using curl and the detected PHP binary
-				curl_process = subprocess.Popen(["curl", "-sS", "https://getcomposer.org/installer"], stdout=subprocess.PIPE, text=True)
-				php_process = subprocess.Popen([php_bin], stdin=curl_process.stdout, stdout=subprocess.PIPE, text=True)
-				curl_process.stdout.close()
-
-				output, _ = php_process.communicate()
-				if php_process.returncode != 0:
-					self.log_message.emit("❌ Errore durante l'installazione di Composer.", "error")
-					return
-
-				# Move composer.phar to /usr/local/bin/composer
-				self.log_message.emit("ℹ️ Spostando il file eseguibile di Composer...", "info")
-				subprocess.run(["sudo", "mv", "composer.phar", "/usr/local/bin/composer"], check=True)
-				composer_path = "/usr/local/bin/composer"
-				self.log_message.emit("✅ Composer installato con successo in /usr/local/bin/composer.", "success")
+			installer = self.composer_installer()
+			if not installer or not self.run_command(f"{php_bin} {installer}", use_sudo=False, retries=COMMAND_RETRIES):
+				self.log_message.emit("❌ Errore durante l'installazione di Composer.", "error")
+				return
 
-			except subprocess.CalledProcessError as e:
-				self.log_message.emit(f"❌ Errore durante l'installazione di Composer: {e}", "error")
+			# Move composer.phar to /usr/local/bin/composer
+			self.log_message.emit("ℹ️ Spostando il file eseguibile di Composer...", "info")
+			if not self.run_command("mv composer.phar /usr/local/bin/composer"):
+				self.log_message.emit("❌ Errore durante l'installazione di Composer.", "error")
+				return
+			composer_path = "/usr/local/bin/composer"
+			self.log_message.emit("✅ Composer installato con successo in /usr/local/bin/composer.", "success")
 		elif pm == "pacman":
-			self.run_command("sudo pacman -S --noconfirm --needed composer", "Composer installed.")
+			self.run_command("sudo pacman -S --noconfirm --needed composer", "Composer installed.", retries=COMMAND_RETRIES)
 			composer_path = "/usr/bin/composer"    # Su Arch, composer viene installato qui
 		elif pm == "pkg":
-			self.run_command("sudo pkg install -y composer", "Composer installed.")
+			self.run_command("sudo pkg install -y composer", "Composer installed.", retries=COMMAND_RETRIES)
 			composer_path = "/usr/local/bin/composer"  # FreeBSD
 		elif pm == "apt":
 			# Questa sezione è per sistemi basati su apt (come Debian/Ubuntu)
-			self.run_command("curl -sS https://getcomposer.org/installer | sudo php -- --install-dir=/usr/local/bin --filename=composer", "Composer installed via script.")
+			installer = self.composer_installer()
+			if installer:
+				self.run_command(self.root_staged_command(installer, "php {script} --install-dir=/usr/local/bin --filename=composer"), "Composer installed via script.", retries=COMMAND_RETRIES)
 			composer_path = "/usr/local/bin/composer"
 		elif pm == "zypper":
 			try:
-				self.run_command("sudo zypper install --no-confirm php-composer", "Installato pacchetto per Composer dal repository.")
+				self.run_command("sudo zypper install --no-confirm php-composer", "Installato pacchetto per Composer dal repository.", retries=COMMAND_RETRIES)
 				composer_path = "/usr/bin/composer"
 				composer_version_check = subprocess.run([composer_path, "--version"], capture_output=True, text=True, check=False)
 				if composer_version_check.returncode == 0:
@@ -923,9 +3887,10 @@ class Worker(QThread):
 					sys.exit(1)
 
 				# Esegui lo script di installazione con PHP
-				subprocess.run([php_bin, '-r', 'copy("https://getcomposer.org/installer", "composer-setup.php");'], check=True)
-				subprocess.run([php_bin, 'composer-setup.php'], check=True)
-				subprocess.run([php_bin, '-r', 'unlink("composer-setup.php");'], check=True)
+				installer = self.composer_installer()
+				setup_command = [php_bin, installer]
+				if not installer or not self.run_command(shlex.join(setup_command), use_sudo=False, retries=COMMAND_RETRIES):
+					raise subprocess.CalledProcessError(1, setup_command)
 
 				self.run_command("sudo mv composer.phar /usr/local/bin/composer", "Installato Composer tramite script ufficiale.")
 				composer_path = "/usr/local/bin/composer"
@@ -952,11 +3917,11 @@ class Worker(QThread):
 		if self.is_canceled: return
 		if pm == "pacman":
 			# Fix: Added --noconfirm and --needed flags
-			self.run_command(f"pacman -S --noconfirm --needed git", "Git installed.")
+			self.run_command(f"pacman -S --noconfirm --needed git", "Git installed.", retries=COMMAND_RETRIES)
 		elif pm == "zypper":
-			self.run_command("zypper install --no-confirm git", "Git installed.")
+			self.run_command("zypper install --no-confirm git", "Git installed.", retries=COMMAND_RETRIES)
 		else:
-			self.run_command(f"{pm} install -y git", "Git installed.")
+			self.run_command(f"{pm} install -y git", "Git installed.", retries=COMMAND_RETRIES)
 
 	def install_mysql(self, pm, distro):
 		"""
@@ -964,26 +3929,25 @@ class Worker(QThread):
 		"""
 		if self.is_canceled: return
 		if pm == "apt":
-			self.run_command("apt install -y mariadb-server", "MariaDB installed.")
+			self.run_command("apt install -y mariadb-server", "MariaDB installed.", retries=COMMAND_RETRIES)
 			if distro == "MX Linux":
 				self.run_command("service mariadb start && update-rc.d mysql enable", "MariaDB started.")
 			else:
 				self.run_command("systemctl enable --now mysql", "MariaDB started.")
 		elif pm == "dnf":
-			self.run_command("dnf install -y mariadb-server", "MariaDB installed.")
+			self.run_command("dnf install -y mariadb-server", "MariaDB installed.", retries=COMMAND_RETRIES)
 			self.run_command("systemctl enable --now mariadb", "MariaDB started.")
 		elif pm == "zypper":
-			self.run_command("zypper install --no-confirm mariadb-server", "MariaDB installed.")
+			self.run_command("zypper install --no-confirm mariadb-server", "MariaDB installed.", retries=COMMAND_RETRIES)
 			self.run_command("systemctl enable --now mariadb", "MariaDB started.")
 		elif pm == "pacman":
-			self.run_command("pacman -S --noconfirm --needed mariadb", "MariaDB installed.")
+			self.run_command("pacman -S --noconfirm --needed mariadb", "MariaDB installed.", retries=COMMAND_RETRIES)
 			self.run_command("mariadb-install-db --user=mysql --basedir=/usr --datadir=/var/lib/mysql", "MariaDB database initialized.")
 			self.run_command("systemctl enable --now mariadb", "MariaDB started.")
 		elif pm == "pkg":
-			self.run_command("pkg install -y mariadb118-server-11.8.2_1 mariadb118-client-11.8.2_1", "MariaDB installed.")
+			self.run_command("pkg install -y mariadb118-server-11.8.2_1 mariadb118-client-11.8.2_1", "MariaDB installed.", retries=COMMAND_RETRIES)
 			self.run_command("mariadb-install-db --user=mysql --basedir=/usr/local --datadir=/var/db/mysql", "MariaDB database initialized.")
 			self.run_command("service mysql-server onestart", "MariaDB started.")
-			self.log_message.emit("Waiting for the MariaDB service to create the socket file...", "info")
 
 	def clean_packages(self, pm):
 		"""
@@ -1020,73 +3984,157 @@ class Worker(QThread):
 		GRANT ALL PRIVILEGES ON laravel_oxylabs_test_database.* TO 'laravel_oxylabs_test_user'@'localhost';
 		FLUSH PRIVILEGES;
 		"""
+		checks = []
 		if pm == "pacman":
-			self.run_command(f"mariadb <<EOF\n{sql_commands}\nEOF", "Database configured.")
+			client = "mariadb"
 		elif pm == "pkg":
-			self.run_command(f"mariadb -S /var/run/mysql/mysql.sock <<EOF\n{sql_commands}\nEOF", "Database configured.")
+			# Su FreeBSD il client usa il socket indicato: prima deve esistere e accettare connessioni
+			client = f"mariadb -S {FREEBSD_MYSQL_SOCKET}"
+			checks.append(ReadinessProbe.unix_socket(FREEBSD_MYSQL_SOCKET))
 		else:
-			self.run_command(f"mysql <<EOF\n{sql_commands}\nEOF", "Database configured.")
+			client = "mysql"
+
+		# Il servizio appena avviato può non accettare ancora connessioni
+		select = f'{client} -e "SELECT 1"'
+		checks.append(ReadinessProbe.command(lambda: self.probe_command(select), select))
+		self.wait_until_ready(ReadinessProbe("MariaDB", checks, timeout=DB_READY_TIMEOUT))
+		self.run_command(f"{client} <<EOF\n{sql_commands}\nEOF", "Database configured.")
 
 	def clone_project(self):
 		"""
-		Clones the project from Git. The project folder is created here.
+		Brings the project to the latest revision. An existing checkout of the
+		repository is updated in place, keeping vendor/, node_modules/ and .env;
+		otherwise the project folder is created with a fresh clone.
 		"""
 		if self.is_canceled: return
 		parent_dir = os.path.dirname(PROJECT_DIR)
 		if not os.path.exists(parent_dir):
 			self.run_command(f"mkdir -p {parent_dir}", f"Cartella padre {parent_dir} creata.")
 
-		if os.path.exists(PROJECT_DIR):
-			self.run_command(f"rm -rf {PROJECT_DIR}", "Cartella progetto esistente rimossa.")
+		if PROJECT_SYNC_MODE != "clone" and self.is_project_checkout() and self.sync_project():
+			self.log_message.emit("Progetto esistente riutilizzato.", "info")
+		else:
+			if os.path.exists(PROJECT_DIR):
+				self.run_command(f"rm -rf {PROJECT_DIR}", "Cartella progetto esistente rimossa.")
+			self.clone_fresh_project(as_user=self.prepare_project_dir())
 
-		self.run_command(f"git clone https://github.com/smal82/laravel-oxylabs-test.git {PROJECT_DIR}", "Progetto clonato.")
 		self.run_command(f"rm -f {PROJECT_DIR}/setup.sh {PROJECT_DIR}/setup2.sh", "File di setup rimossi dal progetto.")
 
-		self.run_command(f"bash -c 'cd {PROJECT_DIR} && git config --global --add safe.directory {PROJECT_DIR}'", "Permessi Git configurati.")
 		self.log_message.emit("Clonazione completata.", "success")
 
+	def project_git(self, args):
+		"""
+		Returns a git command operating on the project checkout, whoever owns it.
+		"""
+		return f"git -c safe.directory={PROJECT_DIR} -C {PROJECT_DIR} {args}"
+
+	def is_project_checkout(self):
+		"""
+		Tells whether PROJECT_DIR is a checkout of PROJECT_REPO_URL.
+		"""
+		if not os.path.isdir(os.path.join(PROJECT_DIR, ".git")):
+			return False
+		return self.git_output(self.project_git("remote get-url origin")) == PROJECT_REPO_URL
+
+	def sync_project(self):
+		"""
+		Updates the existing checkout with fetch plus fast-forward or hard reset.
+		Returns False if the checkout couldn't be updated and must be cloned again.
+		"""
+		if PROJECT_SYNC_MODE == "ff":
+			if self.run_command(self.project_git("fetch --prune origin"), "Aggiornamenti del progetto scaricati.", retries=COMMAND_RETRIES) and \
+					self.run_command(self.project_git("merge --ff-only @{u}"), "Progetto aggiornato (fast-forward)."):
+				return True
+			self.log_message.emit("⚠️ Fast-forward non possibile, riallineo il progetto con reset.", "warning")
+
+		depth = f"--depth {PROJECT_CLONE_DEPTH} " if PROJECT_CLONE_DEPTH > 0 else ""
+		if not self.run_command(self.project_git(f"fetch --prune {depth}origin"), "Aggiornamenti del progetto scaricati.", retries=COMMAND_RETRIES):
+			return False
+		# I file non tracciati (vendor/, node_modules/, .env) non vengono toccati dal reset
+		return bool(self.run_command(self.project_git("reset --hard @{u}"), "Progetto aggiornato sul posto."))
+
+	def prepare_project_dir(self):
+		"""
+		Creates an empty PROJECT_DIR owned by the target user, so that the
+		clone runs as that user and leaves no ownership to fix up. Returns
+		False when the clone has to run as root instead.
+		"""
+		if self.current_user == "root":
+			return False
+		try:
+			user = pwd.getpwnam(self.current_user)
+		except KeyError:
+			return False
+		return bool(self.run_command(f"install -d -o {user.pw_uid} -g {user.pw_gid} {PROJECT_DIR}", f"Cartella progetto creata per {self.current_user}."))
+
+	def clone_fresh_project(self, as_user=False):
+		"""
+		Clones the project, shallow or partial, optionally borrowing objects
+		from the local reference mirror. With as_user the clone runs as the
+		target user into the empty folder made by prepare_project_dir.
+		"""
+		options = []
+		mirror = self.prefetcher.get("project_mirror") or self.update_reference_mirror()
+		if mirror:
+			# Gli oggetti arrivano dal mirror locale: serve solo la differenza dalla rete
+			options.append(f"--reference-if-able {mirror} --dissociate")
+		elif PROJECT_CLONE_DEPTH > 0:
+			options.append(f"--depth {PROJECT_CLONE_DEPTH}")
+		if PROJECT_CLONE_FILTER and not mirror:
+			options.append(f"--filter={PROJECT_CLONE_FILTER}")
+
+		clone = " ".join(["git clone"] + options + [PROJECT_REPO_URL, PROJECT_DIR])
+		if as_user:
+			self.run_as_user(clone, "Progetto clonato.")
+		else:
+			self.run_command(clone, "Progetto clonato.")
+
+	def update_reference_mirror(self):
+		"""
+		Creates or refreshes the local mirror of the repository, if configured.
+		Returns the mirror path, or an empty string when it can't be used.
+		"""
+		if not PROJECT_REFERENCE_MIRROR:
+			return ""
+		if os.path.isdir(PROJECT_REFERENCE_MIRROR):
+			ok = self.run_command(f"git -C {PROJECT_REFERENCE_MIRROR} fetch --prune", "Mirror locale aggiornato.", retries=COMMAND_RETRIES)
+		else:
+			ok = self.run_command(f"git clone --mirror {PROJECT_REPO_URL} {PROJECT_REFERENCE_MIRROR}", "Mirror locale creato.")
+		return PROJECT_REFERENCE_MIRROR if ok else ""
+
 	def fix_permissions(self):
+		"""
+		Gives the project tree to the target user. Only the entries whose owner
+		or group differ (e.g. written by a root command) are changed, so on a
+		rerun the pass costs one parallel stat walk instead of a chown -R.
+		"""
 		if self.is_canceled:
 			return
 
 		try:
-			current_user = os.environ.get("SUDO_USER") or os.environ.get("USER")
-
-			if shutil.which("zypper"):
-				# openSUSE: recupera gruppo reale associato all'utente
-				import pwd
-				user_info = pwd.getpwnam(current_user)
-				user_group_id = user_info.pw_gid
-				group_name = subprocess.getoutput(f"getent group {user_group_id} | cut -d: -f1")
-
-				self.log_message.emit(f"🔧 Cambio proprietà di {PROJECT_DIR} a {current_user}:{group_name}", "info")
-				self.run_command(
-					f"chown -R {current_user}:{group_name} {PROJECT_DIR}",
-					"✅ Permessi aggiornati.",
-					"❌ Errore nel cambio proprietà."
-				)
-			else:
-				# Altre distro: mantieni comportamento originale
-				self.log_message.emit(f"Changing ownership of {PROJECT_DIR} to user {current_user}.", "info")
-				self.run_command(
-					f"chown -R {current_user}:{current_user} {PROJECT_DIR}",
-					"Permessi aggiornati.",
-					"Failed to change ownership."
-				)
-
-			# Configura git safe.directory
-			self.run_as_user(
-				f"git config --global --add safe.directory {PROJECT_DIR}",
-				"Git safe.directory configurato."
-			)
-
-		except OSError:
+			user = pwd.getpwnam(self.current_user)
+		except KeyError:
 			self.log_message.emit(
 				"Could not determine current user. Skipping ownership change. This may cause issues.",
 				"warning"
 			)
+			return
 
+		counts = {}
+		def on_output(line):
+			if line.startswith("{"):
+				counts.update(json.loads(line))
+		self.log_message.emit(f"🔧 Verifica proprietà di {PROJECT_DIR} per {self.current_user}...", "info")
+		source = base64.b64encode(OWNERSHIP_REPAIR_SOURCE.encode("utf-8")).decode("ascii")
+		self.run_command(
+			f'{sys.executable} -c "import base64; exec(base64.b64decode(\'{source}\'))" {user.pw_uid} {user.pw_gid} {PROJECT_DIR}',
+			error_msg="❌ Errore nel cambio proprietà.",
+			on_output=on_output
+		)
+		if counts:
+			self.log_message.emit(f"✅ Permessi verificati: {counts['scanned']} voci controllate, {counts['changed']} corrette, {counts['errors']} errori.", "success" if not counts["errors"] else "warning")
 
+		self.ensure_git_safe_directory()
 
 	def install_dependencies(self):
 		self.log_message.emit("🔧 Inizio installazione dipendenze...", "info")
@@ -1099,14 +4147,39 @@ class Worker(QThread):
 		self.run_as_user(f"mkdir -p {PROJECT_DIR}/vendor", "📁 Cartella vendor creata.")
 
 		# Fix: aggiungi safe.directory per evitare errore Git
-		self.run_as_user(f"git config --global --add safe.directory {PROJECT_DIR}", "🔐 Git safe.directory configurato.")
+		self.ensure_git_safe_directory()
+
+		self.plan.once("prepare_dependency_cache", self.prepare_dependency_cache)
+
+		# PHP e JavaScript hanno alberi di dipendenze indipendenti: installati in parallelo
+		self.run_concurrently([self.install_composer_dependencies, self.install_npm_dependencies])
 
-		# Composer
-		self.run_as_user(f"cd {PROJECT_DIR} && composer install", "✅ Dipendenze Composer installate.")
+	def install_composer_dependencies(self):
+		"""
+		Installs the Composer dependencies, together with COMPOSER_EXTRA_PACKAGES.
+		"""
+		# Composer: usa la cache condivisa e scarica solo i pacchetti mancanti.
+		# "composer require" installa anche le dipendenze già bloccate, quindi i
+		# pacchetti aggiuntivi vengono richiesti nello stesso passaggio.
+		composer_stats = DependencyCacheStats("composer")
+		self.configure_packagist()
+		if self.prefetcher.get("composer_cache"):
+			self.log_message.emit("📦 Pacchetti Composer già scaricati in background.", "info")
+		missing = self.missing_composer_packages()
+		if missing:
+			self.plan.once(f"composer require {' '.join(missing)}", lambda: self.run_as_user(f"cd {PROJECT_DIR} && {self.composer_env()}composer require {' '.join(missing)} --no-interaction", "✅ Dipendenze Composer installate.", on_output=composer_stats.feed, label="composer", retries=COMMAND_RETRIES))
+		else:
+			self.run_as_user(f"cd {PROJECT_DIR} && {self.composer_env()}composer install", "✅ Dipendenze Composer installate.", on_output=composer_stats.feed, label="composer", retries=COMMAND_RETRIES)
+		self.log_cache_stats(composer_stats)
 
+	def install_npm_dependencies(self):
+		"""
+		Configures npm for the shared cache and installs the npm dependencies.
+		"""
 		# Configura npm per stabilità di rete
-		self.run_as_user("npm config set registry https://registry.npmmirror.com", "✅ Registry npm impostato.")
-		self.run_as_user("npm config set prefer-online true", "✅ Preferenza online abilitata.")
+		self.run_as_user(f"npm config set registry {self.mirror('npm')}", "✅ Registry npm impostato.")
+		self.run_as_user(f"npm config set cache {self.dependency_cache_path('npm')}", "✅ Cache npm condivisa impostata.")
+		self.run_as_user("npm config delete prefer-online && npm config set prefer-offline true", "✅ Preferenza offline abilitata.")
 		self.run_as_user("npm config set fetch-retries 10", "✅ Retry aumentati.")
 		self.run_as_user("npm config set fetch-retry-mintimeout 20000", "✅ Timeout minimo impostato.")
 		self.run_as_user("npm config set fetch-retry-maxtimeout 120000", "✅ Timeout massimo impostato.")
@@ -1116,7 +4189,119 @@ class Worker(QThread):
 		#self.run_as_user("npm install -g npm@latest", "✅ npm aggiornato all'ultima versione.")
 
 		# Installazione con retry esteso
-		self.run_as_user(f"cd {PROJECT_DIR} && npm install --yes", "✅ Dipendenze NPM installate.", retries=10, delay=10)
+		if self.prefetcher.get("npm_cache"):
+			self.log_message.emit("📦 Pacchetti npm già scaricati in background.", "info")
+		npm_stats = DependencyCacheStats("npm")
+		self.run_as_user(f"cd {PROJECT_DIR} && npm install --yes --prefer-offline --loglevel http", "✅ Dipendenze NPM installate.", retries=10, delay=10, on_output=npm_stats.feed, label="npm")
+		self.log_cache_stats(npm_stats)
+
+	def run_concurrently(self, funcs):
+		"""
+		Runs funcs in parallel as part of the current step: their commands are
+		traced and their failures counted against the step. Raises the first
+		exception once all of them are done.
+		"""
+		index = getattr(self.step_state, "index", None)
+		failures = []
+		def run(func):
+			self.step_state.index = index
+			self.step_state.failed_commands = 0
+			try:
+				return func()
+			finally:
+				failures.append(self.step_state.failed_commands)
+				self.step_state.index = None
+		with ThreadPoolExecutor(max_workers=len(funcs)) as pool:
+			futures = [pool.submit(run, func) for func in funcs]
+			wait(futures)
+		self.step_state.failed_commands = getattr(self.step_state, "failed_commands", 0) + sum(failures)
+		for future in futures:
+			if future.exception() is not None:
+				raise future.exception()
+
+	def configure_packagist(self):
+		"""
+		Points Composer to the Packagist endpoint chosen by the MirrorSelector, once per run.
+		"""
+		self.plan.once("composer-packagist", lambda: self.run_as_user(
+			f"composer config --global repos.packagist composer {self.mirror('packagist')}",
+			"✅ Repository Packagist impostato."
+		))
+
+	def ensure_git_safe_directory(self):
+		"""
+		Marks the project as a safe git directory for the user, once per run
+		and without adding duplicate entries to the global gitconfig.
+		"""
+		self.plan.once("git-safe-directory", lambda: self.run_as_user(
+			f"git config --global --fixed-value --get safe.directory {PROJECT_DIR} || git config --global --add safe.directory {PROJECT_DIR}",
+			"🔐 Git safe.directory configurato."
+		))
+
+	def missing_composer_packages(self):
+		"""
+		Returns the COMPOSER_EXTRA_PACKAGES not yet required by composer.json.
+		"""
+		try:
+			with open(os.path.join(PROJECT_DIR, "composer.json"), "r") as f:
+				manifest = json.load(f)
+		except (OSError, ValueError):
+			return list(self.COMPOSER_EXTRA_PACKAGES)
+		required = set(manifest.get("require", {})) | set(manifest.get("require-dev", {}))
+		return [name for name in self.COMPOSER_EXTRA_PACKAGES if name not in required]
+
+	def run_artisan_batch(self, project_dir, commands, success_msg=""):
+		"""
+		Runs several artisan commands, given as (command, optional), in a single
+		PHP process so that the framework boots only once.
+		"""
+		if len(commands) == 1:
+			command, optional = commands[0]
+			suffix = " || true" if optional else ""
+			return self.run_as_user(f"cd {project_dir} && php artisan {command}{suffix}", success_msg)
+
+		boot = []
+		def on_output(line):
+			match = ARTISAN_BOOT_RE.search(line)
+			if match:
+				boot.append(int(match.group(1)) / 1000)
+		# In base64 il sorgente attraversa il quoting di run_as_user intatto
+		source = base64.b64encode(ARTISAN_BATCH_SOURCE.encode("utf-8")).decode("ascii")
+		batch = " ".join(f'"{command}{"?" if optional else ""}"' for command, optional in commands)
+		result = self.run_as_user(
+			f'cd {project_dir} && php -r "eval(base64_decode(\\"{source}\\"));" -- {batch}',
+			success_msg,
+			on_output=on_output
+		)
+		# Ogni comando accorpato risparmia un avvio di PHP e di Laravel
+		self.plan.skipped("php artisan " + " + ".join(command for command, _ in commands), len(commands) - 1, (len(commands) - 1) * (boot[0] if boot else 0.0))
+		return result
+
+	def log_plan_savings(self):
+		summary = self.plan.summary()
+		if summary["saved_processes"]:
+			self.log_message.emit(f"📉 Piano comandi: {summary['saved_processes']} sottoprocessi evitati, circa {summary['saved_seconds']:.1f} s risparmiati.", "info")
+
+	def dependency_cache_path(self, tool):
+		return os.path.join(DEPENDENCY_CACHE_DIR, tool)
+
+	def composer_env(self):
+		"""
+		Returns the environment prefix that points Composer to the shared cache.
+		"""
+		return f"COMPOSER_CACHE_DIR={self.dependency_cache_path('composer')} "
+
+	def prepare_dependency_cache(self):
+		"""
+		Creates the shared cache directories and gives them to the user running the installs.
+		"""
+		dirs = " ".join([self.dependency_cache_path(tool) for tool in ["composer", "npm"]] + [PREFETCH_DIR])
+		self.run_command(f"mkdir -p {dirs}", "")
+		self.run_command(f"chown {self.current_user} {DEPENDENCY_CACHE_DIR} {dirs}", f"📦 Cache dipendenze pronta in {DEPENDENCY_CACHE_DIR}.")
+
+	def log_cache_stats(self, stats):
+		hits, misses = stats.summary()
+		self.log_message.emit(f"📦 Cache {stats.tool}: {hits} hit, {misses} miss.", "info")
 
 
 
@@ -1126,28 +4311,58 @@ class Worker(QThread):
 		"""
 		if self.is_canceled: return
 		project_dir = PROJECT_DIR
-		self.run_as_user(f"cd {project_dir} && php artisan config:clear && php artisan route:clear && php artisan view:clear", "Cache di Laravel cancellata.")
-
-		# .env file management
-		if not os.path.exists(os.path.join(project_dir, ".env")):
-			self.run_as_user(f"cd {project_dir} && cp .env.example .env && php artisan key:generate", ".env creato e chiave generata.")
+		# Le route e le viste vengono ripulite da "optimize:clear" in configure_filament;
+		# la configurazione in cache va tolta solo se esiste, prima delle migrazioni.
+		if os.path.exists(os.path.join(project_dir, "bootstrap", "cache", "config.php")):
+			self.run_as_user(f"cd {project_dir} && php artisan config:clear", "Cache della configurazione cancellata.")
+			self.plan.skipped("php artisan route:clear + view:clear", 2)
 		else:
-			self.log_message.emit(".env file già presente.", "info")
+			self.plan.skipped("php artisan config:clear + route:clear + view:clear", 3)
+
+		self.update_env_file(project_dir)
 
-		# Update DB configuration in .env
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_CONNECTION=/c\DB_CONNECTION=mysql' .env", "Configurazione DB aggiornata.")
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_HOST=/c\DB_HOST=127.0.0.1' .env", "Host DB aggiornato.")
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_PORT=/c\DB_PORT=3306' .env", "Porta DB aggiornata.")
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_DATABASE=/c\DB_DATABASE=laravel_oxylabs_test_database' .env", "Nome DB aggiornato.")
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_USERNAME=/c\DB_USERNAME=laravel_oxylabs_test_user' .env", "Utente DB aggiornato.")
-		self.run_as_user(fr"cd {project_dir} && sed -i '/DB_PASSWORD=/c\DB_PASSWORD=kA[Q+LgF-~1C' .env", "Password DB aggiornata.")
+		# DomCrawler viene di norma richiesto insieme a "composer install"
+		missing = self.missing_composer_packages()
+		if missing:
+			self.plan.once(f"composer require {' '.join(missing)}", lambda: self.run_as_user(f"cd {project_dir} && {self.composer_env()}composer require {' '.join(missing)} --no-interaction", "DomCrawler installato.", retries=COMMAND_RETRIES))
+		else:
+			self.plan.skipped("composer require symfony/dom-crawler", 1)
 
-		# Migrations and storage link
-		self.run_as_user(f"cd {project_dir} && php artisan migrate --force && php artisan storage:link", "Migrazioni e link di storage eseguiti.")
+		# Migrations, storage link and import in a single artisan process
+		self.run_artisan_batch(project_dir, [("migrate --force", False), ("storage:link", False), ("import:products", True)], "Migrazioni, link di storage e importazione prodotti eseguiti.")
 		self.log_message.emit("Configurazione di Laravel completata.", "success")
 
-		self.run_as_user(f"cd {project_dir} && composer require symfony/dom-crawler --no-interaction", "DomCrawler installato.")
-		self.run_as_user(f"cd {project_dir} && php artisan import:products || true", "Tentato importazione prodotti.")
+	def update_env_file(self, project_dir):
+		"""
+		Creates .env from .env.example if needed and applies ENV_SETTINGS in a
+		single atomic write, logging which keys changed.
+		"""
+		env_file = EnvFile(os.path.join(project_dir, ".env"), template=os.path.join(project_dir, ".env.example"))
+		changes = dict(self.ENV_SETTINGS)
+		if env_file.created:
+			self.log_message.emit(".env creato da .env.example.", "info")
+		else:
+			self.log_message.emit(".env file già presente.", "info")
+		# Stessa chiave generata da "php artisan key:generate" (AES-256-CBC)
+		if not env_file.values(["APP_KEY"]).get("APP_KEY"):
+			changes["APP_KEY"] = "base64:" + base64.b64encode(os.urandom(32)).decode("ascii")
+
+		try:
+			changed = env_file.update(changes)
+			if self.dry_run:
+				if changed or env_file.created:
+					self.record_planned_command(f"# scrittura di {env_file.path}: {', '.join(changed)}", False)
+				return
+			if changed or env_file.created:
+				env_file.save()
+		except OSError as e:
+			self.log_message.emit(f"Impossibile aggiornare il file .env: {e}", "error")
+			self.note_command_failure()
+			return
+		if changed:
+			self.log_message.emit(f"Configurazione .env aggiornata: {', '.join(changed)}.", "success")
+		else:
+			self.log_message.emit("Configurazione .env già aggiornata.", "info")
 
 	def configure_filament(self):
 		"""
@@ -1159,11 +4374,7 @@ class Worker(QThread):
 
 		# Now we handle interactive input for the panel ID
 		self.log_message.emit("Installazione di Filament in corso...", "info")
-		filament_panel_id = self.get_user_input(
-			"Configurazione Filament",
-			"Inserisci l'ID del pannello Filament:",
-			"admin"
-		)
+		filament_panel_id = self.get_answer("panel_id")
 
 		# Imposta le risposte da passare al processo interattivo
 		self.input_queue = [filament_panel_id, "no"]
@@ -1177,9 +4388,6 @@ class Worker(QThread):
 		)
 		self.input_queue = None	 # reset per sicurezza
 
-		# Piccola pausa per stabilità
-		time.sleep(1)
-
 		# Sostituzione file AdminPanelProvider
 		self.log_message.emit("Sostituzione di AdminPanelProvider.php...", "info")
 		self.run_as_user(
@@ -1196,9 +4404,9 @@ class Worker(QThread):
 		self.run_as_user(f"cd {project_dir} && php artisan optimize:clear", "Cache di Laravel ottimizzata e cancellata.")
 
 		# Creazione utente admin
-		admin_name = self.get_user_input("Crea Utente Amministratore", "Nome utente per l'amministratore:", "admin")
-		admin_email = self.get_user_input("Crea Utente Amministratore", "Email per l'amministratore:", "admin@example.com")
-		admin_password = self.get_password_input("Crea Utente Amministratore", "Password per l'amministratore:")
+		admin_name = self.get_answer("admin_name")
+		admin_email = self.get_answer("admin_email")
+		admin_password = self.get_answer("admin_password")
 
 		self.log_message.emit(f"Creazione utente admin: {admin_name}...", "info")
 		self.run_as_user(
@@ -1217,19 +4425,19 @@ class Worker(QThread):
 		try:
 			self.log_message.emit("Controllo e installazione del gestore Cron...", "info")
 			if pm == "apt":
-				self.run_command("apt-get install -y cron", "Cron installato.")
+				self.run_command("apt-get install -y cron", "Cron installato.", retries=COMMAND_RETRIES)
 				self.run_command("systemctl enable --now cron.service", "Servizio Cron abilitato e avviato.")
 			elif pm == "dnf":
-				self.run_command("dnf install -y cronie", "Cronie installato.")
+				self.run_command("dnf install -y cronie", "Cronie installato.", retries=COMMAND_RETRIES)
 				self.run_command("systemctl enable --now crond.service", "Servizio Cron abilitato e avviato.")
 			elif pm == "pacman":
-				self.run_command("pacman -S --noconfirm --needed cronie", "Cronie installato.")
+				self.run_command("pacman -S --noconfirm --needed cronie", "Cronie installato.", retries=COMMAND_RETRIES)
 				self.run_command("systemctl enable --now cronie.service", "Servizio Cron abilitato e avviato.")
 			elif pm == "pkg":
-				self.run_command("pkg install -y cron", "Cron installato.")
+				self.run_command("pkg install -y cron", "Cron installato.", retries=COMMAND_RETRIES)
 				self.run_command("service cron start", "Servizio Cron avviato.")
 			elif pm == "zypper":
-				self.run_command("sudo zypper install --no-confirm cronie", "Cronie installato.")
+				self.run_command("sudo zypper install --no-confirm cronie", "Cronie installato.", retries=COMMAND_RETRIES)
 				self.run_command("sudo systemctl enable --now cron.service", "Servizio Cron abilitato e avviato.")
 			else:
 				self.log_message.emit("Non è stato possibile installare il gestore Cron per il tuo sistema.", "warning")
@@ -1249,6 +4457,9 @@ class Worker(QThread):
 
 			# Scrive il contenuto in un file temporaneo e lo usa per aggiornare il crontab
 			temp_file = "/tmp/crontab.tmp"
+			if self.dry_run:
+				self.run_command(f"crontab {temp_file}", "Cron configurato.")
+				return
 			with open(temp_file, "w") as f:
 				f.write(new_crontab_content)
 
@@ -1266,30 +4477,46 @@ class Worker(QThread):
 
 	def start_services(self):
 		"""
-		Starts Laravel services in the background.
-		NOTE: These commands are executed without waiting for their completion.
+		Starts Laravel services in the background, under a ServiceSupervisor
+		that keeps them running after the step (see kill_processes).
 		"""
 		if self.is_canceled: return
 		project_dir = PROJECT_DIR
+		workers = queue_pool_size()
+		queue_command = f"php artisan queue:work --tries=3 --memory={QUEUE_WORKER_MEMORY_MB} --max-jobs={QUEUE_WORKER_MAX_JOBS}"
+		if self.dry_run:
+			for service in ["npm run dev", "php artisan serve --host=127.0.0.1 --port=8000"] + [queue_command] * workers:
+				self.record_planned_command(f"cd {project_dir} && {service}", False)
+			return
 
-		# Start the frontend compilation in the background
-		frontend_cmd = f"cd {project_dir} && nohup npm run dev > storage/logs/dev.log 2>&1 &"
-		self.log_message.emit(f"Avvio compilazione frontend: {frontend_cmd}", "info")
-		proc = subprocess.Popen(frontend_cmd, shell=True, preexec_fn=os.setsid, executable="/bin/bash")
-		self.processes.append(proc)
-
-		# Start the Laravel development server
-		server_cmd = f"cd {project_dir} && nohup php artisan serve --host=127.0.0.1 --port=8000 > storage/logs/serve.log 2>&1 &"
-		self.log_message.emit(f"Avvio server Laravel: {server_cmd}", "info")
-		proc = subprocess.Popen(server_cmd, shell=True, preexec_fn=os.setsid, executable="/bin/bash")
-		self.processes.append(proc)
-
-		# Start the Laravel queue worker
-		queue_cmd = f"cd {project_dir} && nohup php artisan queue:work --tries=3 --stop-when-empty > storage/logs/queue.log 2>&1 &"
-		self.log_message.emit(f"Avvio coda Laravel: {queue_cmd}", "info")
-		proc = subprocess.Popen(queue_cmd, shell=True, preexec_fn=os.setsid, executable="/bin/bash")
-		self.processes.append(proc)
-
+		try:
+			user = pwd.getpwnam(self.current_user)
+		except KeyError:
+			user = None
+		logs_dir = os.path.join(project_dir, "storage", "logs")
+		supervisor = ServiceSupervisor(project_dir, user, on_event=self.log_message.emit)
+		# Frontend, server e coda; vengono arrestati in ordine inverso
+		supervisor.add(SupervisedService("frontend", "npm run dev", os.path.join(logs_dir, "dev.log")))
+		supervisor.add(SupervisedService("server", "php artisan serve --host=127.0.0.1 --port=8000", os.path.join(logs_dir, "serve.log"),
+			health=ReadinessProbe.http("http://127.0.0.1:8000/")))
+		# Worker della coda a lunga vita, riciclati da Laravel oltre i limiti di memoria e di job
+		queue_logs = []
+		for number in range(1, workers + 1):
+			queue_log = os.path.join(logs_dir, f"queue-{number}.log")
+			queue_logs.append(queue_log)
+			# Senza supervisione nessuno riavvierebbe un worker uscito dopo --max-jobs: resta solo il limite di memoria
+			supervisor.add(SupervisedService(f"queue-{number}", queue_command, queue_log,
+				health=lambda queue_log=queue_log: self.queue_heartbeat(queue_log), restart="recycle",
+				unsupervised_cmd=f"php artisan queue:work --tries=3 --memory={QUEUE_WORKER_MEMORY_MB}"))
+		self.queue_monitor = QueueMonitor(queue_logs, self.queue_backlog, self.log_message.emit)
+		supervisor.add_reporter(self.queue_monitor.sample, QUEUE_REPORT_INTERVAL)
+		self.log_message.emit(f"👷 {workers} worker della coda, riciclati oltre {QUEUE_WORKER_MEMORY_MB} MB o dopo {QUEUE_WORKER_MAX_JOBS} job.", "info")
+		supervisor.start()
+		self.supervisor = supervisor
+
+		# Gli URL vengono proposti solo quando il server risponde
+		self.wait_until_ready(ReadinessProbe("server Laravel su :8000", [ReadinessProbe.http("http://127.0.0.1:8000/")], timeout=30),
+			should_stop=lambda: not supervisor.running("server"))
 		self.log_message.emit("Tutti i servizi sono stati avviati in background.", "success")
 
 class SetupGUI(QWidget):
@@ -1362,6 +4589,8 @@ class SetupGUI(QWidget):
 
 		self.logText = QTextEdit()
 		self.logText.setReadOnly(True)
+		# Le righe più vecchie vengono scartate dalla finestra (restano nel file di log)
+		self.logText.document().setMaximumBlockCount(LOG_MAX_LINES)
 		self.logText.setStyleSheet("""
 			background-color: #2e2e2e;
 			color: #f5f5f5;
@@ -1435,19 +4664,42 @@ class SetupGUI(QWidget):
 			self._log_message("Password sudo non fornita. Annullamento.", "error")
 			return
 
+		# Tutte le risposte vengono chieste subito, così il setup non si ferma a metà
+		answers = self._collect_answers()
+		if answers is None:
+			self._log_message("Configurazione non completata. Annullamento.", "error")
+			return
+
 		self._is_canceled = False
 		self._set_button_state(running=True)
 		self.worker = Worker(parent=self)
 		self.worker.set_sudo_password(password)
+		self.worker.set_answers(answers)
 
 		self.worker.request_input.connect(self._handle_input_request)
 		self.worker.request_password_input.connect(self._handle_password_request)
 
-		self.worker.log_message.connect(self._on_log_message_received)
+		self.worker.log_batch.connect(self._on_log_batch_received)
 		self.worker.step_status_updated.connect(self._on_step_status_updated)
 		self.worker.finished.connect(self._on_setup_finished)
 		self.worker.start()
 
+	def _collect_answers(self):
+		"""
+		Asks all the answers listed in Worker.INPUT_PROMPTS.
+		Returns None if a dialog is canceled or left empty.
+		"""
+		answers = {}
+		for key, title, label, default_value, is_password in Worker.INPUT_PROMPTS:
+			if is_password:
+				result, ok = QInputDialog.getText(self, title, label, QLineEdit.EchoMode.Password)
+			else:
+				result, ok = QInputDialog.getText(self, title, label, QLineEdit.EchoMode.Normal, default_value)
+			if not ok or not result:
+				return None
+			answers[key] = result
+		return answers
+
 	def _set_button_state(self, running):
 		self.startButton.setEnabled(not running)
 
@@ -1458,7 +4710,7 @@ class SetupGUI(QWidget):
 		self.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
 		self.show()
 		result, ok = QInputDialog.getText(self, title, label, QLineEdit.EchoMode.Normal, default_value)
-		self.worker.input_result = (result, ok)
+		self.worker.provide_input(result, ok)
 
 	def _handle_password_request(self, title, label):
 		"""
@@ -1467,7 +4719,7 @@ class SetupGUI(QWidget):
 		self.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
 		self.show()
 		result, ok = QInputDialog.getText(self, title, label, QLineEdit.EchoMode.Password)
-		self.worker.input_result = (result, ok)
+		self.worker.provide_input(result, ok)
 
 	def _on_step_status_updated(self, index, status_type):
 		"""
@@ -1493,16 +4745,22 @@ class SetupGUI(QWidget):
 
 		self.step_list.scrollToItem(item, QAbstractItemView.ScrollHint.PositionAtCenter)
 
-	def _on_log_message_received(self, message, message_type):
+	def _on_log_batch_received(self, entries):
 		"""
-		Adds a message to the log with formatting depending on the type.
+		Adds a batch of worker messages to the log.
 		"""
-		self._log_message(message, message_type)
+		self._append_log_entries(entries)
 
 	def _log_message(self, message, message_type):
 		"""
 		Adds a message to the log with formatting depending on the type.
 		"""
+		self._append_log_entries([(message, message_type)])
+
+	def _format_log_entry(self, message, message_type):
+		"""
+		Returns the HTML of a log message, formatted depending on the type.
+		"""
 		color = "white"
 		if message_type == "success":
 			color = "#5cb85c"
@@ -1516,8 +4774,37 @@ class SetupGUI(QWidget):
 		elif message_type == "output":
 			color = "#f5f5f5"
 
+		return f"<span style='color: {color};'>{html.escape(message)}</span>"
+
+	def _append_log_entries(self, entries):
+		"""
+		Appends the messages to the log within a single edit block.
+		"""
+		document = self.logText.document()
+		cursor = QTextCursor(document)
+		cursor.movePosition(QTextCursor.MoveOperation.End)
+		cursor.beginEditBlock()
+		for message, message_type in entries:
+			if not document.isEmpty():
+				cursor.insertBlock()
+			cursor.insertHtml(self._format_log_entry(message, message_type))
+		cursor.endEditBlock()
 		self.logText.moveCursor(QTextCursor.MoveOperation.End)
-		self.logText.append(f"<span style='color: {color};'>{message}</span>")
+
+	def closeEvent(self, event):
+		"""
+		Asks whether the services started by the setup should keep running
+		after closing, as they do by default in headless mode, or be shut down.
+		"""
+		if self.worker is not None and self.worker.supervisor is not None:
+			answer = QMessageBox.question(self, "Servizi in esecuzione",
+				"Lasciare in esecuzione server, frontend e coda dopo la chiusura?",
+				QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.Yes)
+			if answer == QMessageBox.StandardButton.No:
+				self.worker.kill_processes()
+			else:
+				self.worker.detach_processes()
+		super().closeEvent(event)
 
 	def _on_setup_finished(self, success):
 		"""
@@ -1553,8 +4840,231 @@ class SetupGUI(QWidget):
 		else:
 			QMessageBox.critical(self, "Setup Fallito", "Setup di Laravel fallito. Controlla il log per i dettagli.")
 
+class LogFloodEmitter(QObject):
+	"""
+	Signals used by the log benchmark to deliver lines from a background thread.
+	"""
+	line = pyqtSignal(str, str)
+	batch = pyqtSignal(list)
+
+def measure_log_flood(gui, total_lines, batched, interval_ms=10):
+	"""
+	Floods the log of gui with total_lines lines from a background thread and
+	measures how late a periodic timer of the event loop fires meanwhile.
+	batched=False delivers one signal per line, batched=True uses LogPipeline.
+	"""
+	gui.logText.clear()
+	rendered = [0]
+	append_entries = gui._append_log_entries
+	def counting_append(entries):
+		append_entries(entries)
+		rendered[0] += len(entries)
+	gui._append_log_entries = counting_append
+
+	emitter = LogFloodEmitter()
+	pipeline = None
+	if batched:
+		pipeline = LogPipeline(emitter.batch.emit, os.path.join(tempfile.gettempdir(), "setup-log-benchmark.log"))
+		emitter.batch.connect(gui._on_log_batch_received)
+		send = pipeline.emit
+	else:
+		emitter.line.connect(gui._log_message)
+		send = emitter.line.emit
+
+	def flood():
+		if pipeline:
+			pipeline.start()
+		for i in range(total_lines):
+			send(f"Riga di prova {i} " + "x" * 60, "output")
+		if pipeline:
+			pipeline.stop()
+
+	latencies = []
+	loop = QEventLoop()
+	last_tick = [time.perf_counter()]
+	def probe():
+		now = time.perf_counter()
+		latencies.append(max(0.0, now - last_tick[0] - interval_ms / 1000))
+		last_tick[0] = now
+		if rendered[0] >= total_lines:
+			loop.quit()
+	timer = QTimer()
+	timer.timeout.connect(probe)
+	timer.start(interval_ms)
+
+	started = time.perf_counter()
+	producer = threading.Thread(target=flood, daemon=True)
+	producer.start()
+	loop.exec()
+	elapsed = time.perf_counter() - started
+	timer.stop()
+	producer.join()
+	del gui._append_log_entries
+
+	latencies.sort()
+	return {
+		"mode": "batched" if batched else "per-line",
+		"lines": total_lines,
+		"seconds": round(elapsed, 3),
+		"mean_latency_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+		"p99_latency_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+		"max_latency_ms": round(latencies[-1] * 1000, 2)
+	}
+
+def run_headless(answers):
+	"""
+	Runs the Worker pipeline without GUI. Answers and options come from the
+	answer file; every event is written on stdout as a JSON line.
+	Returns the exit code.
+	"""
+	output_lock = threading.Lock()
+	def write_event(event, **fields):
+		fields["event"] = event
+		fields["time"] = round(time.time(), 3)
+		with output_lock:
+			sys.stdout.write(json.dumps(fields, ensure_ascii=False) + "\n")
+			sys.stdout.flush()
+
+	missing = [key for key, _, _, default_value, _ in Worker.INPUT_PROMPTS if not answers.get(key) and not default_value]
+	if missing:
+		write_event("error", message=f"Risposte mancanti nel file: {', '.join(missing)}")
+		return 2
+
+	sudo_method = answers.get("sudo_method", "password")
+	sudo_password = answers.get("sudo_password") or os.environ.get(answers.get("sudo_password_env", "SETUP_SUDO_PASSWORD"), "")
+	if sudo_method == "password" and not sudo_password:
+		write_event("error", message="sudo_method 'password' richiede sudo_password o la variabile indicata da sudo_password_env.")
+		return 2
+
+	worker = Worker()
+	if sudo_method == "password":
+		worker.set_sudo_password(sudo_password)
+	worker.set_answers({key: answers.get(key) or default_value for key, _, _, default_value, _ in Worker.INPUT_PROMPTS})
+	if answers.get("options", {}).get("no_resume"):
+		worker.checkpoints.clear()
+
+	# Nessuno può rispondere a una richiesta di input: viene rifiutata
+	worker.request_input.connect(lambda title, label, default_value: worker.provide_input(None, False))
+	worker.request_password_input.connect(lambda title, label: worker.provide_input(None, False))
+
+	worker.log_batch.connect(lambda entries: [write_event("log", type=message_type, message=message) for message, message_type in entries])
+	worker.step_status_updated.connect(lambda index, status: write_event("step", index=index, name=Worker.STEPS[index], status=status))
+	worker.progress_updated.connect(lambda value: write_event("progress", value=value))
+	result = {}
+	worker.finished.connect(lambda success: result.setdefault("success", success))
+
+	stop_requested = threading.Event()
+	def on_signal(signum, frame):
+		worker.cancel()
+		stop_requested.set()
+	signal.signal(signal.SIGINT, on_signal)
+	signal.signal(signal.SIGTERM, on_signal)
+	write_event("start", log_file=worker.log_path)
+	worker.start()
+	worker.wait()
+
+	success = result.get("success", False)
+	write_event("finished", success=success, canceled=worker.is_canceled)
+	if worker.supervisor is not None:
+		if success and (answers.get("options", {}).get("serve") or "--serve" in sys.argv):
+			# Con --serve i servizi restano supervisionati fino a SIGINT/SIGTERM
+			write_event("serving", services=worker.supervisor.status())
+			while not stop_requested.wait(1):
+				pass
+			supervisor = worker.supervisor
+			worker.kill_processes()
+			write_event("stopped", services=supervisor.status(), queue=worker.queue_monitor.sample())
+		else:
+			# Come in passato i servizi continuano a girare dopo l'uscita, senza supervisione
+			supervisor = worker.supervisor
+			worker.detach_processes()
+			write_event("detached", services=supervisor.status(), queue=worker.queue_monitor.last)
+	return 0 if success else 1
+
+def run_dry_run(answers):
+	"""
+	Runs the Worker steps without executing anything and prints the ordered
+	command plan of every step, with the durations estimated from the history
+	of previous real runs. Returns the exit code.
+	"""
+	worker = Worker()
+	placeholders = {key: answers.get(key) or default_value or "********" for key, _, _, default_value, _ in Worker.INPUT_PROMPTS}
+	worker.set_answers(placeholders)
+	errors = []
+	worker.log_batch.connect(lambda entries: errors.extend(message for message, message_type in entries if message_type == "error"))
+	result = {}
+	worker.finished.connect(lambda success: result.setdefault("success", success))
+	worker.start()
+	worker.wait()
+
+	history = CommandHistory(HISTORY_FILE)
+	context = getattr(worker, "context", {})
+	statuses = {span["args"].get("index"): span["args"].get("status") for span in worker.trace.spans if span["category"] == "step"}
+	print(f"Piano di esecuzione per {context.get('distro') or '?'} ({context.get('pm') or '?'}), nessun comando eseguito.")
+	step_seconds = {}
+	unknown = 0
+	total_commands = 0
+	for index, name in enumerate(Worker.STEPS):
+		commands = worker.dry_run_plan.get(index, [])
+		lines = []
+		seconds = 0.0
+		for cmd, use_sudo in commands:
+			if cmd.startswith("#"):
+				lines.append(f"      -    {cmd}")
+				continue
+			total_commands += 1
+			estimate, source = history.estimate(cmd)
+			if estimate is None:
+				unknown += 1
+				label = "   ?   "
+			else:
+				seconds += estimate
+				label = f"{'~' if source == 'tool' else ' '}{estimate:6.1f}s"
+			# Gli script passati in base64 non dicono nulla a chi legge il piano
+			shown = re.sub(r"[A-Za-z0-9+/]{100,}={0,2}", "…", CommandHistory.key(cmd))
+			lines.append(f"    {label}  {'[root] ' if use_sudo else ''}{shown}")
+		step_seconds[index] = seconds
+		if commands:
+			state = f"{len(commands)} comandi, {seconds:.1f} s"
+		elif statuses.get(index) == "skipped":
+			state = "già completato, verrà saltato"
+		else:
+			state = "nessun comando"
+		print(f"\n[{index + 1}/{len(Worker.STEPS)}] {name} ({state})")
+		for line in lines:
+			print(line)
+
+	# Fine stimata di ogni passaggio seguendo le dipendenze (senza contesa di risorse)
+	finish = {}
+	for index, (_, _, deps, _) in enumerate(Worker.STEP_GRAPH):
+		finish[index] = max((finish[dep] for dep in deps), default=0.0) + step_seconds[index]
+	print(f"\nTotale: {total_commands} comandi, circa {sum(step_seconds.values()):.0f} s in sequenza, "
+		f"{max(finish.values(), default=0.0):.0f} s sul percorso critico dei passaggi paralleli.")
+	if unknown:
+		print(f"{unknown} comandi senza storico non sono inclusi nella stima (~ = stima da comandi simili).")
+	for message in errors:
+		print(f"⚠️ {message}", file=sys.stderr)
+	return 0 if result.get("success") else 1
+
 if __name__ == '__main__':
+	if DRY_RUN:
+		sys.exit(run_dry_run(HEADLESS_ANSWERS))
+
+	if HEADLESS:
+		sys.exit(run_headless(HEADLESS_ANSWERS))
+
+	if "--startup-probe" in sys.argv:
+		# Usato da benchmark_startup: bootstrap e import di PyQt6 completati
+		sys.exit(0)
+
 	app = QApplication(sys.argv)
+	if "--benchmark-log" in sys.argv:
+		# Latenza del loop degli eventi con 100k righe di log, senza e con LogPipeline
+		gui = SetupGUI()
+		gui.show()
+		for batched in (False, True):
+			print(json.dumps(measure_log_flood(gui, 100000, batched)))
+		sys.exit(0)
 	gui = SetupGUI()
 	gui.show()
 	sys.exit(app.exec())